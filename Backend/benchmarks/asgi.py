@@ -0,0 +1,15 @@
+"""
+Websocket + http application for running the benchmark settings under daphne:
+
+    DJANGO_SETTINGS_MODULE=benchmarks.settings daphne benchmarks.asgi:application
+"""
+
+import os
+
+import django
+from channels.routing import get_default_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+application = get_default_application()
@@ -0,0 +1,168 @@
+"""
+ShardedRedisChannelLayer's consistent hashing against channels_redis' crc32 % hosts, and group_send
+throughput of the layer over 1 to --shards local redis-server processes.
+
+Movement: share of --groups groups changing host when a host is added to n hosts, and how many groups
+the busiest host holds against an even share. Needs nothing but python.
+
+Throughput: --shards redis-servers are started on ports from --port. For every shard count --workers
+processes each hold --groups-per-worker groups with one socket channel in each, send --messages
+group_sends to groups of all workers and receive theirs. Skipped with --no-redis.
+
+    python -m benchmarks.channel_layer_shards --shards 4 --workers 8 --redis-server /usr/bin/redis-server
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from .utils import BACKEND_DIR
+
+
+def placements(layer, groups):
+    return [layer.consistent_hash(group) for group in groups]
+
+
+def movement(args):
+    from channels_redis.core import RedisChannelLayer
+    from chat.channel_layers import ShardedRedisChannelLayer
+
+    groups = [f'chat_{pk}' for pk in range(args.groups)]
+    print(f'{args.groups} groups, moved when a host is added, busiest host / even share')
+    print(f'{"hosts":>8} {"crc32 moved":>12} {"ring moved":>11} {"crc32 busiest":>14} {"ring busiest":>13}')
+    for count in range(1, args.shards + 1):
+        hosts = [('redis', 6379 + index) for index in range(count)]
+        row = []
+        for layer_class in (RedisChannelLayer, ShardedRedisChannelLayer):
+            before = placements(layer_class(hosts=hosts), groups)
+            after = placements(layer_class(hosts=hosts + [('redis', 6379 + count)]), groups)
+            moved = sum(1 for old, new in zip(before, after) if old != new) / len(groups)
+            busiest = max(after.count(index) for index in range(count + 1)) / (len(groups) / (count + 1))
+            row.append((moved, busiest))
+        (crc_moved, crc_busiest), (ring_moved, ring_busiest) = row
+        print(f'{f"{count}->{count + 1}":>8} {crc_moved:>12.1%} {ring_moved:>11.1%} '
+              f'{crc_busiest:>14.2f} {ring_busiest:>13.2f}')
+
+
+def targets(worker, args):
+    """ groups worker's group_sends go to, spread over groups of all workers """
+    total = args.workers * args.groups_per_worker
+    return [(worker * 7919 + message * 31) % total for message in range(args.messages)]
+
+
+async def run_worker(number, hosts, args, ready, start):
+    from chat.channel_layers import ShardedRedisChannelLayer
+
+    layer = ShardedRedisChannelLayer(hosts=hosts, capacity=args.messages * args.workers)
+    own = range(number * args.groups_per_worker, (number + 1) * args.groups_per_worker)
+    channels = dict()
+    for group in own:
+        channels[group] = await layer.new_channel()
+        await layer.group_add(f'bench_{group}', channels[group])
+    expected = {group: 0 for group in own}
+    for worker in range(args.workers):
+        for group in targets(worker, args):
+            if group in expected:
+                expected[group] += 1
+
+    ready.wait()
+    start.wait()
+    began = time.perf_counter()
+
+    async def send():
+        for group in targets(number, args):
+            await layer.group_send(f'bench_{group}', {'type': 'bench.message', 'group': group})
+
+    async def receive(group):
+        for _ in range(expected[group]):
+            await layer.receive(channels[group])
+        return expected[group]
+
+    try:
+        _, *received = await asyncio.wait_for(asyncio.gather(send(), *(receive(group) for group in own)),
+                                              args.deadline)
+        received = sum(received)
+    except asyncio.TimeoutError:
+        received = None
+    elapsed = time.perf_counter() - began
+    await layer.flush()
+    await layer.close_pools()
+    return received, sum(expected.values()), elapsed
+
+
+def worker_main(number, hosts, args, ready, start, results):
+    sys.path.insert(0, BACKEND_DIR)
+    results.put(asyncio.run(run_worker(number, hosts, args, ready, start)))
+
+
+def start_servers(args):
+    servers = []
+    for index in range(args.shards):
+        servers.append(subprocess.Popen(
+            [args.redis_server, '--port', str(args.port + index), '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    time.sleep(1)
+    return servers
+
+
+def throughput(args):
+    context = multiprocessing.get_context('spawn')
+    servers = start_servers(args)
+    try:
+        print(f'\n{args.workers} workers, {args.workers * args.messages} group_sends')
+        print(f'{"shards":>8} {"seconds":>8} {"sends/s":>9} {"delivered":>10}')
+        for count in range(1, args.shards + 1):
+            hosts = [f'redis://localhost:{args.port + index}' for index in range(count)]
+            ready = context.Barrier(args.workers + 1)
+            start = context.Barrier(args.workers + 1)
+            results = context.Queue()
+            workers = [context.Process(target=worker_main, args=(number, hosts, args, ready, start, results))
+                       for number in range(args.workers)]
+            for worker in workers:
+                worker.start()
+            ready.wait()
+            start.wait()
+            outcomes = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            elapsed = max(elapsed for _, _, elapsed in outcomes)
+            delivered = sum(received or 0 for received, _, _ in outcomes)
+            expected = sum(expected for _, expected, _ in outcomes)
+            print(f'{count:>8} {elapsed:>8.2f} {args.workers * args.messages / elapsed:>9.0f} '
+                  f'{delivered:>5}/{expected}')
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--groups', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument('--groups-per-worker', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=5000, help='group_sends of every worker')
+    parser.add_argument('--deadline', type=float, default=120)
+    parser.add_argument('--port', type=int, default=16379)
+    parser.add_argument('--redis-server', default=shutil.which('redis-server'))
+    parser.add_argument('--no-redis', action='store_true')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    movement(args)
+    if args.no_redis:
+        return
+    if args.redis_server is None:
+        parser.error('redis-server not found, pass --redis-server or --no-redis')
+    throughput(args)
+
+
+if __name__ == '__main__':
+    main()
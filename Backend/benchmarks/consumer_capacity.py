@@ -0,0 +1,95 @@
+"""
+How many concurrent sockets one worker can hold.
+
+Every socket connects with its token, sends one chat message to its own
+conversation and waits for the `new_message` frame to come back. A level
+passes when all of its sockets finish before --deadline. The worker thread
+pool is fixed with ASGI_THREADS, like a single daphne process.
+
+    python -m benchmarks.consumer_capacity --levels 100,200,400,800,1600
+
+For the "before" number run the same command on a checkout where
+ChatConsumer was still a sync WebsocketConsumer.
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import time
+
+from .utils import setup_django, create_users, auth_headers
+
+
+def load_consumer(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+async def run_level(consumer, fixtures, deadline):
+    from channels.testing import WebsocketCommunicator
+
+    communicators = []
+
+    async def session(token, conversation_id):
+        communicator = WebsocketCommunicator(consumer, '/ws/chat/', headers=auth_headers(token))
+        communicators.append(communicator)
+        connected, _ = await communicator.connect(timeout=deadline)
+        if not connected:
+            return False
+        await communicator.send_json_to({'type': 'message', 'content': 'ping', 'conversation_id': conversation_id})
+        response = await communicator.receive_json_from(timeout=deadline)
+        return response['type'] == 'new_message'
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(session(token, conversation_id) for token, conversation_id in fixtures)),
+            deadline)
+        held = sum(results)
+    except asyncio.TimeoutError:
+        held = None
+    elapsed = time.perf_counter() - start
+
+    for communicator in communicators:
+        try:
+            await communicator.disconnect()
+        except Exception:
+            pass
+    return held, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='50,100,200,400,800')
+    parser.add_argument('--deadline', type=float, default=10.0, help='seconds a level may take')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ASGI_THREADS', 8)))
+    parser.add_argument('--consumer', default='chat.consumers.ChatConsumer')
+    args = parser.parse_args()
+
+    os.environ['ASGI_THREADS'] = str(args.threads)
+    setup_django()
+    from chat.utils import create_new_conversation
+
+    levels = [int(level) for level in args.levels.split(',')]
+    fixtures = []
+    for user, token in create_users(max(levels)):
+        conversation = create_new_conversation(f'bench {user.pk}', user)
+        fixtures.append((token, conversation.pk))
+
+    consumer = load_consumer(args.consumer)
+    print(f'{args.consumer}, ASGI_THREADS={args.threads}, deadline={args.deadline}s')
+    print(f'{"sockets":>8} {"held":>8} {"seconds":>8}')
+    capacity = 0
+    for level in levels:
+        held, elapsed = asyncio.get_event_loop().run_until_complete(
+            run_level(consumer, fixtures[:level], args.deadline))
+        print(f'{level:>8} {held if held is not None else "timeout":>8} {elapsed:>8.2f}')
+        if held != level:
+            break
+        capacity = level
+    print(f'capacity: {capacity} concurrent sockets')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Load test of the chat socket: many clients at once in the scenarios of
+benchmarks/load/scenarios.py, reporting p50/p95/p99 latency from sending an
+event to its delivery, throughput and SQL queries per sent event.
+
+In this process, consumers on the in-memory channel layer (no server needed):
+
+    python -m benchmarks.load --scale 0.5 --output before.json
+
+Against a daphne started here, real sockets, in-memory or redis channel layer:
+
+    python -m benchmarks.load --daphne [--redis redis://127.0.0.1:6379]
+
+Against a server which is already running, fixtures are written to its
+database so this needs the same settings and BENCH_DB it uses:
+
+    python -m benchmarks.load --url ws://127.0.0.1:8000/ws/chat/
+
+Queries are only counted in process. Compare two result files with:
+
+    python -m benchmarks.load --compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from ..utils import BACKEND_DIR, setup_django
+from .clients import CommunicatorClient, SocketClient
+from .recorder import Recorder, QueryCounter
+from .scenarios import SCENARIOS
+
+
+async def open_clients(make_client, users, batch, timeout):
+    clients = dict()
+    for start in range(0, len(users), batch):
+        opening = [make_client(user, token) for user, token in users[start:start + batch]]
+        await asyncio.gather(*(client.connect(timeout) for client in opening))
+        clients.update((client.user.pk, client) for client in opening)
+    return clients
+
+
+async def read_events(client, scenario, recorder):
+    while True:
+        event = await client.receive()
+        if event is None:
+            return
+        if 'mailbox_id' in event:
+            # like the real client, so mailboxes are trimmed as they would be
+            await client.send({'type': 'ack', 'mailbox_id': event['mailbox_id']})
+        await scenario.on_event(client, event, recorder)
+
+
+async def run_scenario(scenario, users, make_client, args, queries=None):
+    clients = await open_clients(make_client, users, args.connect_batch, args.timeout)
+    recorder = Recorder()
+    readers = [asyncio.ensure_future(read_events(client, scenario, recorder)) for client in clients.values()]
+    queries_before = queries.count if queries is not None else None
+
+    async def drive():
+        await scenario.run(clients, recorder)
+        recorder.finish_sending()
+        await recorder.done.wait()
+
+    try:
+        await asyncio.wait_for(drive(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    result = recorder.summary()
+    result['connections'] = len(clients)
+    if queries is not None:
+        result['queries'] = queries.count - queries_before
+        result['queries_per_event'] = result['queries'] / result['sent'] if result['sent'] else None
+
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.gather(*(client.close() for client in clients.values()), return_exceptions=True)
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_daphne(port, redis):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.settings')
+    if redis:
+        env['BENCH_REDIS'] = redis
+    server = subprocess.Popen([sys.executable, '-c', 'from daphne.cli import CommandLineInterface; '
+                               'CommandLineInterface.entrypoint()',
+                               '-v', '0', '-b', '127.0.0.1', '-p', str(port), 'benchmarks.asgi:application'],
+                              cwd=BACKEND_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'daphne exited with code {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('daphne did not start listening in 30 seconds')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def number(value, format):
+    return 'n/a' if value is None else f'{value:{format}}'
+
+
+HEADER = (f'{"scenario":>22} {"sockets":>7} {"sent":>7} {"delivered":>10} {"seconds":>8} {"deliv/s":>9} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries/event":>13}')
+
+
+def row(result):
+    latency = result['latency_ms']
+    delivered = f'{result["delivered"]}/{result["expected"]}'
+    return (f'{result["scenario"]:>22} {result["connections"]:>7} {result["sent"]:>7} {delivered:>10} '
+            f'{result["seconds"]:>8.2f} {number(result["deliveries_per_second"], ".0f"):>9} '
+            f'{number(latency["p50"], ".1f"):>8} {number(latency["p95"], ".1f"):>8} '
+            f'{number(latency["p99"], ".1f"):>8} {number(result.get("queries_per_event"), ".2f"):>13}')
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = {result['scenario']: result for result in json.load(f)['scenarios']}
+    with open(after_path) as f:
+        after = json.load(f)['scenarios']
+
+    def change(old, new):
+        if old is None or new is None:
+            return f'{"n/a":>24}'
+        relative = f'{(new - old) / old:+.0%}' if old else ''
+        return f'{old:>9.1f} -> {new:>9.1f} {relative:>5}'
+
+    print(f'{"scenario":>22} {"metric":>16} {"before -> after":>24}')
+    for result in after:
+        old = before.get(result['scenario'])
+        if old is None:
+            continue
+        metrics = [('p50 ms', old['latency_ms']['p50'], result['latency_ms']['p50']),
+                   ('p95 ms', old['latency_ms']['p95'], result['latency_ms']['p95']),
+                   ('p99 ms', old['latency_ms']['p99'], result['latency_ms']['p99']),
+                   ('deliveries/s', old['deliveries_per_second'], result['deliveries_per_second']),
+                   ('queries/event', old.get('queries_per_event'), result.get('queries_per_event'))]
+        for name, old_value, new_value in metrics:
+            print(f'{result["scenario"]:>22} {name:>16} {change(old_value, new_value)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'any of {", ".join(SCENARIOS)}')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies users and conversations, '
+                                                                 'group sizes stay')
+    parser.add_argument('--protocol', choices=('json', 'msgpack'), default='json')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds a scenario may take')
+    parser.add_argument('--connect-batch', type=int, default=100, help='sockets opened at once')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ASGI_THREADS', 8)))
+    parser.add_argument('--daphne', action='store_true', help='start daphne and connect to it over TCP')
+    parser.add_argument('--redis', help='channel layer of the started daphne, in-memory without it')
+    parser.add_argument('--url', help='chat socket url of a running server')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    os.environ['ASGI_THREADS'] = str(args.threads)
+    # a running server keeps its database, new users get a prefix of their own
+    setup_django(fresh_db=args.url is None)
+    from django.db import transaction
+    from chat.consumers import ChatConsumer
+
+    protocol = 'justchat.msgpack' if args.protocol == 'msgpack' else None
+    server = None
+    queries = None
+    if args.daphne:
+        port = free_port()
+        server = start_daphne(port, args.redis)
+        args.url = f'ws://127.0.0.1:{port}/ws/chat/'
+    if args.url:
+        driver = 'socket'
+
+        def make_client(user, token):
+            return SocketClient(args.url, user, token, protocol)
+    else:
+        driver = 'in-process'
+        queries = QueryCounter()
+        queries.install()
+
+        def make_client(user, token):
+            return CommunicatorClient(ChatConsumer, user, token, protocol)
+
+    tag = datetime.now().strftime('%H%M%S')
+    results = []
+    print(f'{driver}{" " + args.url if args.url else ""}, protocol {args.protocol}, scale {args.scale}')
+    print(HEADER)
+    try:
+        for name in args.scenarios.split(','):
+            scenario = SCENARIOS[name](args.scale)
+            with transaction.atomic():
+                users = scenario.setup(f'{name}_{tag}_')
+            result = {'scenario': name, 'parameters': scenario.parameters()}
+            result.update(asyncio.get_event_loop().run_until_complete(
+                run_scenario(scenario, users, make_client, args, queries)))
+            print(row(result))
+            results.append(result)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'driver': driver,
+                'channel_layer': 'redis' if args.redis else ('in-memory' if not args.url or args.daphne else None),
+                'protocol': args.protocol,
+                'scale': args.scale,
+                'threads': args.threads,
+                'scenarios': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
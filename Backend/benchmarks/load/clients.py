@@ -0,0 +1,178 @@
+"""
+Chat socket clients of the load test. Both speak the same events, one through
+channels' WebsocketCommunicator inside this process, the other over a real
+TCP websocket to a running server.
+"""
+
+import asyncio
+import base64
+import os
+import sys
+from urllib.parse import urlparse
+
+from ..utils import BACKEND_DIR, auth_headers
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from chat import wire  # noqa: E402
+
+
+class Client:
+    """ one user's socket, 'protocol' is the websocket subprotocol to ask for (None for plain JSON) """
+
+    def __init__(self, user, token, protocol=None):
+        self.user = user
+        self.token = token
+        self.protocol = protocol
+
+    def encode(self, event):
+        if self.protocol == wire.MSGPACK_PROTOCOL:
+            return wire.encode_msgpack(event)
+        return wire.encode_json(event)
+
+    def decode(self, frame):
+        if isinstance(frame, bytes):
+            return wire.decode_msgpack(frame)
+        return wire.decode_json(frame)
+
+    async def connect(self, timeout):
+        raise NotImplementedError
+
+    async def send(self, event):
+        raise NotImplementedError
+
+    async def receive(self):
+        """ next event from the server, None once the socket is closed """
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+
+class CommunicatorClient(Client):
+    """ socket to a consumer running in this process, on the in-memory channel layer """
+
+    def __init__(self, application, user, token, protocol=None):
+        super().__init__(user, token, protocol)
+        self.application = application
+        self.communicator = None
+
+    async def connect(self, timeout):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(self.application, '/ws/chat/', headers=auth_headers(self.token),
+                                                  subprotocols=[self.protocol] if self.protocol else None)
+        connected, _ = await self.communicator.connect(timeout=timeout)
+        if not connected:
+            raise ConnectionError(f'{self.user.username} was not accepted')
+
+    async def send(self, event):
+        frame = self.encode(event)
+        if isinstance(frame, bytes):
+            await self.communicator.send_to(bytes_data=frame)
+        else:
+            await self.communicator.send_to(text_data=frame)
+
+    async def receive(self):
+        # a timeout would make the communicator cancel the consumer, readers are cancelled instead
+        try:
+            return self.decode(await self.communicator.receive_from(timeout=24 * 60 * 60))
+        except AssertionError:
+            return None  # consumer closed the socket
+
+    async def close(self):
+        if self.communicator is not None:
+            await self.communicator.disconnect()
+
+
+def mask_payload(mask, payload):
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(repeated, 'little')).to_bytes(len(payload), 'little')
+
+
+class SocketClient(Client):
+    """
+    websocket over TCP to a server at 'url', e.g. ws://127.0.0.1:8000/ws/chat/. Minimal RFC 6455 client on
+    asyncio streams: loading django imports daphne, which ties autobahn to twisted in this process
+    """
+
+    TEXT, BINARY, CLOSE, PING, PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+    def __init__(self, url, user, token, protocol=None):
+        super().__init__(user, token, protocol)
+        self.url = url
+        self.reader = self.writer = None
+
+    async def connect(self, timeout):
+        url = urlparse(self.url)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, url.port or 80), timeout)
+        request = [f'GET {url.path or "/"}{"?" + url.query if url.query else ""} HTTP/1.1',
+                   f'Host: {url.netloc}',
+                   'Upgrade: websocket',
+                   'Connection: Upgrade',
+                   f'Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}',
+                   'Sec-WebSocket-Version: 13',
+                   f'Authorization: Token {self.token.key}']
+        if self.protocol:
+            request.append(f'Sec-WebSocket-Protocol: {self.protocol}')
+        self.writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+        response = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        status = response.split(b'\r\n', 1)[0].decode()
+        if status.split()[1] != '101':
+            raise ConnectionError(f'{self.user.username} was not accepted: {status}')
+
+    def write_frame(self, opcode, payload):
+        # client frames are always masked
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 1 << 16:
+            header.append(0x80 | 126)
+            header += length.to_bytes(2, 'big')
+        else:
+            header.append(0x80 | 127)
+            header += length.to_bytes(8, 'big')
+        mask = os.urandom(4)
+        self.writer.write(bytes(header) + mask + mask_payload(mask, payload))
+
+    async def send(self, event):
+        frame = self.encode(event)
+        if isinstance(frame, bytes):
+            self.write_frame(self.BINARY, frame)
+        else:
+            self.write_frame(self.TEXT, frame.encode())
+
+    async def receive(self):
+        message, kind = b'', None
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                opcode, length = first & 0x0f, second & 0x7f
+                if length >= 126:
+                    length = int.from_bytes(await self.reader.readexactly(2 if length == 126 else 8), 'big')
+                mask = await self.reader.readexactly(4) if second & 0x80 else None
+                payload = await self.reader.readexactly(length)
+                if mask is not None:
+                    payload = mask_payload(mask, payload)
+                if opcode == self.CLOSE:
+                    return None
+                if opcode == self.PING:
+                    self.write_frame(self.PONG, payload)
+                    continue
+                if opcode == self.PONG:
+                    continue
+                if opcode:  # 0 continues a fragmented message
+                    kind = opcode
+                message += payload
+                if first & 0x80:
+                    return self.decode(message if kind == self.BINARY else message.decode())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    async def close(self):
+        if self.writer is not None:
+            self.write_frame(self.CLOSE, (1000).to_bytes(2, 'big'))
+            self.writer.close()
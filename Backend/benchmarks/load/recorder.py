@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import math
+import threading
+import time
+
+
+def percentile(ordered, fraction):
+    """ nearest-rank percentile of a sorted list """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class Recorder:
+    """
+    send time of every event a scenario sends and latency of every delivery it causes.
+    An event is identified by a key the scenario can read back from the delivered frames
+    """
+
+    def __init__(self):
+        self.pending = dict()
+        self.latencies = []
+        self.keys = itertools.count()
+        self.sent_count = 0
+        self.expected = 0
+        self.delivered_count = 0
+        self.first_sent = None
+        self.last_delivered = None
+        self.sending = True
+        self.done = asyncio.Event()
+
+    def new_key(self):
+        return f'load {next(self.keys)}'
+
+    def count_sent(self):
+        """ an event which is not waited for, e.g. an answer to a delivered one """
+        self.sent_count += 1
+        if self.first_sent is None:
+            self.first_sent = time.perf_counter()
+
+    def sent(self, key, deliveries, echo_pk=None):
+        """
+        event 'key' is about to be sent and should reach 'deliveries' sockets. Returns a future
+        done when socket of user echo_pk gets it
+        """
+        self.count_sent()
+        echo = asyncio.get_event_loop().create_future()
+        self.pending[key] = [time.perf_counter(), deliveries, echo, echo_pk]
+        self.expected += deliveries
+        return echo
+
+    def delivered(self, key, receiver_pk):
+        entry = self.pending.get(key)
+        if entry is None:
+            return
+        now = time.perf_counter()
+        sent_at, _, echo, echo_pk = entry
+        self.latencies.append(now - sent_at)
+        self.delivered_count += 1
+        self.last_delivered = now
+        if receiver_pk == echo_pk and not echo.done():
+            echo.set_result(None)
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.pending[key]
+        self.check_done()
+
+    def finish_sending(self):
+        self.sending = False
+        self.check_done()
+
+    def check_done(self):
+        if not self.sending and self.delivered_count >= self.expected:
+            self.done.set()
+
+    def summary(self):
+        seconds = (self.last_delivered or time.perf_counter()) - (self.first_sent or time.perf_counter())
+        ordered = sorted(self.latencies)
+        return {
+            'sent': self.sent_count,
+            'expected': self.expected,
+            'delivered': self.delivered_count,
+            'complete': self.delivered_count >= self.expected,
+            'seconds': seconds,
+            'events_per_second': self.sent_count / seconds if seconds else None,
+            'deliveries_per_second': self.delivered_count / seconds if seconds else None,
+            'latency_ms': {
+                'p50': percentile(ordered, 0.50) * 1000 if ordered else None,
+                'p95': percentile(ordered, 0.95) * 1000 if ordered else None,
+                'p99': percentile(ordered, 0.99) * 1000 if ordered else None,
+                'max': ordered[-1] * 1000 if ordered else None,
+            },
+        }
+
+
+class QueryCounter:
+    """
+    counts SQL queries of every database connection of this process. Consumers query from
+    worker threads, each with its own connection, so the wrapper is added to every new one
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        connection_created.connect(self.connection_created, weak=False)
+        for connection in connections.all():
+            self.connection_created(connection)
+
+    def connection_created(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
@@ -0,0 +1,207 @@
+"""
+Load test scenarios. A scenario creates its users and conversations with the
+ORM, then drives their sockets: run() sends events, on_event() sees every
+event a socket receives and tells the recorder which sent event it delivers.
+"""
+
+import asyncio
+import random
+
+from ..utils import create_users
+
+
+def scaled(count, scale):
+    return max(1, round(count * scale))
+
+
+class Scenario:
+    name = None
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.random = random.Random(0)
+
+    def parameters(self):
+        return {}
+
+    def setup(self, prefix):
+        """ create fixtures, return (user, token) pairs which need a socket """
+        raise NotImplementedError
+
+    async def run(self, clients, recorder):
+        """ send events, 'clients' are sockets by user pk """
+        raise NotImplementedError
+
+    async def on_event(self, client, event, recorder):
+        pass
+
+    def create_conversation(self, title, members):
+        from chat.utils import create_new_conversation, add_user_to_conversation
+
+        admin, *others = members
+        conversation = create_new_conversation(title, admin, False)
+        for user in others:
+            add_user_to_conversation(user, conversation)
+        return conversation.pk
+
+    async def chat(self, client, conversation_id, members, count, recorder):
+        """ send 'count' messages, each after the previous one came back, like a user typing """
+        for _ in range(count):
+            content = recorder.new_key()
+            echo = recorder.sent(content, members, echo_pk=client.user.pk)
+            await client.send({'type': 'message', 'content': content, 'conversation_id': conversation_id})
+            await echo
+
+
+class ChatScenario(Scenario):
+    """ every delivered new_message frame counts """
+
+    async def on_event(self, client, event, recorder):
+        if event['type'] == 'new_message':
+            recorder.delivered(event['content'], client.user.pk)
+
+
+class OneToOne(ChatScenario):
+    """ pairs of friends writing to each other at the same time """
+
+    name = 'one_to_one'
+
+    def __init__(self, scale=1.0, pairs=100, messages=10):
+        super().__init__(scale)
+        self.pairs = scaled(pairs, scale)
+        self.messages = messages
+
+    def parameters(self):
+        return {'pairs': self.pairs, 'messages': self.messages}
+
+    def setup(self, prefix):
+        users = create_users(2 * self.pairs, prefix)
+        self.conversations = []
+        for first, second in zip(users[::2], users[1::2]):
+            members = [first[0], second[0]]
+            conversation_id = self.create_conversation(f'{prefix}{first[0].pk}, {second[0].pk}', members)
+            self.conversations.append((conversation_id, [user.pk for user in members]))
+        return users
+
+    async def run(self, clients, recorder):
+        await asyncio.gather(*(self.chat(clients[pk], conversation_id, len(members), self.messages, recorder)
+                               for conversation_id, members in self.conversations for pk in members))
+
+
+class Group(ChatScenario):
+    """ groups of 'size' members, a few of them writing at once, everybody receives everything """
+
+    def __init__(self, scale=1.0, size=50, groups=4, senders=10, messages=5):
+        super().__init__(scale)
+        self.name = f'group_{size}'
+        self.size = size
+        self.groups = scaled(groups, scale)
+        self.senders = min(senders, size)
+        self.messages = messages
+
+    def parameters(self):
+        return {'size': self.size, 'groups': self.groups, 'senders': self.senders, 'messages': self.messages}
+
+    def setup(self, prefix):
+        users = create_users(self.size * self.groups, prefix)
+        self.conversations = []
+        for start in range(0, len(users), self.size):
+            members = [user for user, _ in users[start:start + self.size]]
+            conversation_id = self.create_conversation(f'{prefix}{start}', members)
+            self.conversations.append((conversation_id, [user.pk for user in members]))
+        return users
+
+    async def run(self, clients, recorder):
+        await asyncio.gather(*(self.chat(clients[pk], conversation_id, len(members), self.messages, recorder)
+                               for conversation_id, members in self.conversations
+                               for pk in self.random.sample(members, self.senders)))
+
+
+class FriendRequestStorm(Scenario):
+    """ every user invites the next 'invites' users at the same moment """
+
+    name = 'friend_request_storm'
+
+    def __init__(self, scale=1.0, users=200, invites=5):
+        super().__init__(scale)
+        self.users = scaled(users, scale)
+        self.invites = min(invites, self.users - 1)
+
+    def parameters(self):
+        return {'users': self.users, 'invites': self.invites}
+
+    def setup(self, prefix):
+        self.fixtures = create_users(self.users, prefix)
+        return self.fixtures
+
+    async def invite(self, client, friends, recorder):
+        for friend in friends:
+            recorder.sent((client.user.username, friend.pk), 1)
+            await client.send({'type': 'invite_friend', 'friend_id': friend.pk})
+
+    async def run(self, clients, recorder):
+        users = [user for user, _ in self.fixtures]
+        await asyncio.gather(*(
+            self.invite(clients[user.pk], [users[(i + n) % len(users)] for n in range(1, self.invites + 1)], recorder)
+            for i, user in enumerate(users)))
+
+    async def on_event(self, client, event, recorder):
+        if event['type'] == 'friend_request':
+            recorder.delivered((event['sender'], client.user.pk), client.user.pk)
+
+
+class KeyExchangeBurst(Scenario):
+    """
+    members of a new group all ask its admin for the conversation key at once, the admin answers each request.
+    Latency is the whole round trip, key_request out to key_response back
+    """
+
+    name = 'key_exchange_burst'
+
+    def __init__(self, scale=1.0, members=200):
+        super().__init__(scale)
+        self.members = scaled(members, scale)
+
+    def parameters(self):
+        return {'members': self.members}
+
+    def setup(self, prefix):
+        users = create_users(self.members + 1, prefix)
+        self.admin_pk = users[0][0].pk
+        self.conversation_id = self.create_conversation(f'{prefix}keys', [user for user, _ in users])
+        return users
+
+    def big_int(self):
+        # 2048 bit DH public key / RSA parts like the real client sends
+        return self.random.getrandbits(2048) | (1 << 2047)
+
+    async def run(self, clients, recorder):
+        async def request(client):
+            recorder.sent((self.conversation_id, client.user.pk), 1)
+            await client.send({'type': 'key_request', 'conversation_id': self.conversation_id,
+                               'dh_key': self.big_int()})
+
+        await asyncio.gather(*(request(client) for pk, client in clients.items() if pk != self.admin_pk))
+
+    async def on_event(self, client, event, recorder):
+        if event['type'] == 'key_request' and client.user.pk == self.admin_pk:
+            recorder.count_sent()
+            await client.send({
+                'type': 'key_response',
+                'conversation_id': event['conversation_id'],
+                'user_id': event['user_id'],
+                'dh_key': self.big_int(),
+                'rsa_key': {name: str(self.big_int()) for name in ('n', 'e', 'd', 'p', 'q')},
+                'flag': self.big_int(),
+            })
+        elif event['type'] == 'key_response':
+            recorder.delivered((event['conversation_id'], client.user.pk), client.user.pk)
+
+
+SCENARIOS = {
+    'one_to_one': OneToOne,
+    'group_50': lambda scale: Group(scale, size=50, groups=4, senders=10, messages=5),
+    'group_1000': lambda scale: Group(scale, size=1000, groups=1, senders=10, messages=3),
+    'friend_request_storm': FriendRequestStorm,
+    'key_exchange_burst': KeyExchangeBurst,
+}
@@ -0,0 +1,98 @@
+"""
+Serialization time and bytes on the wire of a history response of --messages
+messages: JSONRenderer vs ORJSONRenderer, stdlib json vs orjson parsing on the
+client, each encoding of CompressionMiddleware, and the whole request through
+the middleware for every Accept-Encoding the client may send.
+
+    python -m benchmarks.rest_responses --messages 1000 --message-length 120
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+import brotli
+import orjson
+
+from .utils import setup_django, create_users
+from .wire_formats import ciphertext
+
+
+def median_ms(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def create_history(count, message_length):
+    from chat.models import Message
+    from chat.utils import create_new_conversation, add_user_to_conversation
+
+    (author, token), (reader, _) = create_users(2)
+    conversation = create_new_conversation('history', author)
+    add_user_to_conversation(reader, conversation)
+    Message.objects.bulk_create(Message(author=author, conversation=conversation, sequence=sequence,
+                                        content=ciphertext(message_length)) for sequence in range(1, count + 1))
+    conversation.last_sequence = count
+    conversation.save(update_fields=['last_sequence'])
+    return conversation, token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--message-length', type=int, default=120, help='plaintext characters of a message')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from rest_framework.renderers import JSONRenderer
+    from chat.renderers import ORJSONRenderer
+    from chat.serializers import serialize_messages
+
+    conversation, token = create_history(args.messages, args.message_length)
+    data = {'content': serialize_messages(conversation.get_newest_messages(args.messages))}
+    body = ORJSONRenderer().render(data)
+    assert body == JSONRenderer().render(data)
+
+    print(f'{args.messages} messages, {len(body)} bytes of JSON, median of {args.repeat}')
+    print(f'{"":>22} {"ms":>8}')
+    print(f'{"JSONRenderer":>22} {median_ms(lambda: JSONRenderer().render(data), args.repeat):>8.2f}')
+    print(f'{"ORJSONRenderer":>22} {median_ms(lambda: ORJSONRenderer().render(data), args.repeat):>8.2f}')
+    print(f'{"json.loads":>22} {median_ms(lambda: json.loads(body.decode()), args.repeat):>8.2f}')
+    print(f'{"orjson.loads":>22} {median_ms(lambda: orjson.loads(body.decode()), args.repeat):>8.2f}')
+
+    print(f'\n{"encoding":>22} {"bytes":>8} {"ratio":>6} {"compress ms":>12} {"decompress ms":>14}')
+    encodings = [('gzip 1', lambda: gzip.compress(body, 1), gzip.decompress),
+                 ('gzip 6', lambda: gzip.compress(body, 6), gzip.decompress),
+                 ('brotli 1', lambda: brotli.compress(body, quality=1), brotli.decompress),
+                 ('brotli 5', lambda: brotli.compress(body, quality=5), brotli.decompress),
+                 ('brotli 11', lambda: brotli.compress(body, quality=11), brotli.decompress)]
+    for name, compress, decompress in encodings:
+        compressed = compress()
+        print(f'{name:>22} {len(compressed):>8} {len(compressed) / len(body):>6.2f} '
+              f'{median_ms(compress, args.repeat):>12.2f} {median_ms(lambda: decompress(compressed), args.repeat):>14.2f}')
+
+    # the client's old offset paging, the newest page beyond the recent messages cache comes from the database
+    client = Client()
+    path = f'/chat/messages/{conversation.pk}'
+    query = f'start=0&end={args.messages}'
+    print(f'\n{"Accept-Encoding":>22} {"bytes":>8} {"request ms":>11}')
+    for accept in ('', 'gzip', 'br, gzip'):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token.key}', 'HTTP_ACCEPT_ENCODING': accept}
+
+        def request():
+            return client.generic('GET', path, query, 'application/x-www-form-urlencoded', **headers)
+        response = request()
+        assert response.status_code == 200
+        print(f'{accept or "(none)":>22} {len(response.content):>8} {median_ms(request, args.repeat):>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+ModelSerializers against the values()-based serializers of chat/serializers.py
+on the hot read paths: a page of messages (with and without select_related of
+authors, get_last_messages has none), a friends list and friend requests.
+Times include the queries, which are counted too.
+
+    python -m benchmarks.serializers --messages 1000 --friends 500 --requests 200
+"""
+
+import argparse
+import statistics
+import time
+
+from .utils import setup_django, create_users
+
+
+def measure(function, repeat):
+    """ median milliseconds and queries of one call """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    return statistics.median(times) * 1000, len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--friends', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from chat import serializers
+    from chat.models import FriendRequest, Message
+    from chat.utils import add_user_to_conversation, create_new_conversation
+
+    users = [user for user, _ in create_users(max(args.friends, args.requests) + 1)]
+    user, others = users[0], users[1:]
+    user.contact.get().friends.add(*others[:args.friends])
+    notifications = user.notifications.get()
+    FriendRequest.objects.bulk_create(FriendRequest(user=notifications, sender=sender, sender_name=sender.username)
+                                      for sender in others[:args.requests])
+    conversation = create_new_conversation('benchmark', user, False)
+    for other in others[:10]:
+        add_user_to_conversation(other, conversation)
+    # authors take turns, like in a group conversation
+    Message.objects.bulk_create(Message(author=others[i % 10], conversation=conversation, sequence=i + 1,
+                                        content=f'message {i}') for i in range(args.messages))
+
+    cases = [
+        (f'{args.messages} messages, select_related',
+         lambda: serializers.MessageSerializer(conversation.get_newest_messages(args.messages), many=True).data,
+         lambda: serializers.serialize_messages(conversation.get_newest_messages(args.messages))),
+        (f'{args.messages} messages, get_last_messages',
+         lambda: serializers.MessageSerializer(conversation.get_last_messages(0, args.messages), many=True).data,
+         lambda: serializers.serialize_messages(conversation.get_last_messages(0, args.messages))),
+        (f'{args.friends} friends',
+         lambda: serializers.ContactSerializer(user.contact.get()).data,
+         lambda: serializers.serialize_contact(user)),
+        (f'{args.requests} friend requests',
+         lambda: serializers.FriendRequestsSerializer(notifications.get_all_notifications(), many=True).data,
+         lambda: serializers.serialize_friend_requests(user)),
+    ]
+    print(f'{"":>34} {"ModelSerializer ms":>19} {"queries":>8} {"values() ms":>12} {"queries":>8} {"speedup":>8}')
+    for name, model_serializer, fast_serializer in cases:
+        assert model_serializer() == fast_serializer()
+        model_ms, model_queries = measure(model_serializer, args.repeat)
+        fast_ms, fast_queries = measure(fast_serializer, args.repeat)
+        print(f'{name:>34} {model_ms:>19.2f} {model_queries:>8} {fast_ms:>12.2f} {fast_queries:>8} '
+              f'{model_ms / fast_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Settings used by the benchmarks: the real project settings with a local SQLite
+database, in-memory cache, channel layer, mailbox and recent messages cache, so
+nothing but python is needed.
+With BENCH_REDIS=redis://host:port[,redis://host2:port...] the channel layer is the
+redis one instead, sharded over all listed servers.
+"""
+
+import os
+import tempfile
+
+from justchat.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', os.path.join(tempfile.gettempdir(), 'justchat_bench.sqlite3')),
+        'OPTIONS': {'timeout': 60},
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+if os.environ.get('BENCH_REDIS'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.channel_layers.ShardedRedisChannelLayer',
+            'CONFIG': {
+                'hosts': os.environ['BENCH_REDIS'].split(','),
+            },
+        },
+    }
+
+MAILBOX = {
+    'BACKEND': 'chat.mailbox.LocalMailbox',
+}
+
+MESSAGE_CACHE = {
+    'BACKEND': 'chat.message_cache.LocalMessageCache',
+    'SIZE': 50,
+    'TTL': 24 * 60 * 60,
+    'MAX_CONVERSATIONS': 10000,
+}
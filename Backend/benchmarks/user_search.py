@@ -0,0 +1,110 @@
+"""
+Latency of username search, the old two icontains scans of SearchView against
+the n-gram index of chat/search.py, on a table of --users generated users.
+
+Users are bulk inserted without signals, filling a million takes a few minutes,
+--reuse keeps a database which already has them:
+
+    python -m benchmarks.user_search --users 1000000 --repeat 20 [--reuse]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from .utils import setup_django
+
+SYLLABLES = ['an', 'na', 'ma', 'rek', 'ola', 'jan', 'ka', 'to', 'mi', 'ro', 'ber', 'ta', 'zu', 'li', 'wo', 'ska',
+             'pa', 'de', 'el', 'us']
+KEYS = ['a', 'an', 'ann', 'anna', 'marek', 'olaf', 'ber12', 'qqq']
+
+
+def usernames(count, seed=1):
+    """ 'count' unique usernames of 2-4 syllables, some with digits """
+    generator = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        name = ''.join(generator.choice(SYLLABLES) for _ in range(generator.randint(2, 4)))
+        if generator.random() < 0.5:
+            name += str(generator.randint(0, 999))
+        names.add(name)
+    return sorted(names)
+
+
+def fill_users(count, batch=10000):
+    from chat.models import User, UsernameGram
+    from chat.search import username_grams
+
+    names = usernames(count)
+    for start in range(0, count, batch):
+        User.objects.bulk_create(User(username=name) for name in names[start:start + batch])
+    grams = []
+    for pk, username in User.objects.values_list('pk', 'username').iterator():
+        grams.extend(UsernameGram(user_id=pk, gram=gram) for gram in username_grams(username))
+        if len(grams) >= batch * 10:
+            UsernameGram.objects.bulk_create(grams)
+            grams = []
+    UsernameGram.objects.bulk_create(grams)
+
+
+def old_search(user, key):
+    """ queries of SearchView before the index """
+    from chat.models import User
+
+    matching_friends = list(user.contact.get().friends.filter(username__icontains=key))
+    friends = [x.username for x in matching_friends]
+    return matching_friends + list(User.objects.filter(username__icontains=key).exclude(username__in=friends)
+                                   .exclude(pk=user.pk))
+
+
+def indexed_search(user, key):
+    from chat.search import search_users
+
+    return list(search_users(user, key, limit=21))
+
+
+def measure(search, user, key, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = search(user, key)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), max(times), len(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keys', default=','.join(KEYS))
+    parser.add_argument('--reuse', action='store_true', help='keep the database if it has --users users already')
+    args = parser.parse_args()
+
+    setup_django(fresh_db=not args.reuse)
+    from django.db import transaction
+    from chat.models import User, Contact
+
+    if User.objects.count() != args.users + 1:
+        if args.reuse:
+            setup_django(fresh_db=True)
+        print(f'creating {args.users} users')
+        start = time.perf_counter()
+        with transaction.atomic():
+            fill_users(args.users)
+            searcher = User.objects.create(username='searcher')
+            Contact.objects.create(user=searcher).friends.add(*User.objects.filter(username__startswith='anna')[:10])
+        print(f'created in {time.perf_counter() - start:.0f} s')
+    searcher = User.objects.get(username='searcher')
+
+    print(f'milliseconds per search, {args.users} users, old returns every match, index a page of 20')
+    print(f'{"key":>8} {"old p50":>9} {"max":>8} {"found":>7} {"index p50":>10} {"max":>8} {"found":>6}')
+    for key in args.keys.split(','):
+        old_p50, old_max, old_found = measure(old_search, searcher, key, args.repeat)
+        new_p50, new_max, new_found = measure(indexed_search, searcher, key, args.repeat)
+        print(f'{key:>8} {old_p50 * 1000:>9.1f} {old_max * 1000:>8.1f} {old_found:>7} '
+              f'{new_p50 * 1000:>10.2f} {new_max * 1000:>8.2f} {min(new_found, 20):>6}')
+
+
+if __name__ == '__main__':
+    main()
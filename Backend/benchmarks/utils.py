@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(fresh_db=True):
+    """ configure django with benchmark settings and (re)create the database """
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+    import django
+    from django.conf import settings
+    django.setup()
+
+    db_name = settings.DATABASES['default']['NAME']
+    if fresh_db and os.path.exists(db_name):
+        os.remove(db_name)
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+
+
+def create_users(count, prefix='bench'):
+    """ create users the way signup does (contact + notifications) and return (user, token) pairs """
+    from rest_framework.authtoken.models import Token
+    from chat.models import User, Contact, Notifications
+
+    users = []
+    for i in range(count):
+        user = User.objects.create(username=f'{prefix}{i}')
+        Contact.objects.create(user=user)
+        Notifications.objects.create(user=user)
+        users.append((user, Token.objects.create(user=user)))
+    return users
+
+
+def auth_headers(token):
+    return [(b'authorization', f'Token {token.key}'.encode())]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
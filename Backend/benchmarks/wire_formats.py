@@ -0,0 +1,91 @@
+"""
+Frame size and encode/decode time of every chat socket event, JSON vs MessagePack.
+
+Events are built the way the clients send them: 2048 bit DH keys, RSA keys
+encrypted with DH and AES-GCM ciphertext of a --message-length characters
+long message. Needs no database:
+
+    python -m benchmarks.wire_formats --repeat 20000
+"""
+
+import argparse
+import base64
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat import wire  # noqa: E402
+
+
+def big_int(bits=2048):
+    return random.getrandbits(bits) | (1 << (bits - 1))
+
+
+def ciphertext(length):
+    # nonce + ciphertext + tag, like RSAManager.encrypt
+    return wire.AES_PREFIX + base64.b64encode(os.urandom(12 + length + 16)).decode()
+
+
+def events(message_length):
+    """ (name, event) pairs in the shape they have on the socket, both directions """
+    author = {'id': 12, 'username': 'username12'}
+    rsa_key = {'n': str(big_int()), 'e': '65537', 'd': str(big_int()), 'p': str(big_int()), 'q': str(big_int())}
+    return [
+        ('message (client)', {'type': 'message', 'content': ciphertext(message_length), 'conversation_id': 42}),
+        ('new_message', {'type': 'new_message', 'conversation_id': 42, 'author': author,
+                         'timestamp': '2020-05-20T18:31:05.123456Z', 'content': ciphertext(message_length)}),
+        ('key_request (client)', {'type': 'key_request', 'conversation_id': 42, 'dh_key': big_int()}),
+        ('key_request', {'type': 'key_request', 'conversation_id': 42, 'dh_key': str(big_int()), 'user_id': 12}),
+        ('key_response (client)', {'type': 'key_response', 'conversation_id': 42, 'user_id': 12,
+                                   'dh_key': big_int(), 'rsa_key': rsa_key, 'flag': big_int()}),
+        ('key_response', {'type': 'key_response', 'user_id': 12, 'conversation_id': 42, 'dh_key': str(big_int()),
+                          'rsa_key': rsa_key, 'flag': str(big_int())}),
+        ('mark_read (client)', {'type': 'mark_read', 'conversation_id': 42}),
+        ('invite_friend (client)', {'type': 'invite_friend', 'friend_id': 12}),
+        ('friend_request', {'type': 'friend_request', 'sender': 'username12', 'request_id': 7,
+                            'timestamp': '2020-05-20 18:31:05.123456+00:00'}),
+        ('response_friend_req (client)', {'type': 'response_friend_req', 'id': 7, 'response': 'True'}),
+        ('response_f_request', {'type': 'response_f_request', 'sender': 'username12', 'response': 'True'}),
+        ('create_group (client)', {'type': 'create_group', 'title': 'group', 'admin_id': 12,
+                                   'users_ids': [13, 14, 15]}),
+        ('create_group_notify', {'type': 'create_group_notify', 'title': 'group', 'admin': 'username12'}),
+        ('new_conversation', {'type': 'new_conversation', 'conversation_id': 42}),
+        ('new_notification', {'type': 'new_notification', 'conversation_id': 42}),
+    ]
+
+
+def measure(function, argument, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(argument)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--message-length', type=int, default=200)
+    args = parser.parse_args()
+
+    print('sizes in bytes, times in us per frame')
+    print(f'{"":>30} {"json":>6} {"msgpack":>8} {"saved":>6}   {"json enc":>8} {"dec":>6}   {"mp enc":>8} {"dec":>6}')
+    totals = [0, 0]
+    for name, event in events(args.message_length):
+        json_frame = wire.encode_json(event).encode()
+        msgpack_frame = wire.encode_msgpack(event)
+        totals[0] += len(json_frame)
+        totals[1] += len(msgpack_frame)
+        print(f'{name:>30} {len(json_frame):>6} {len(msgpack_frame):>8} '
+              f'{1 - len(msgpack_frame) / len(json_frame):>6.0%}   '
+              f'{measure(wire.encode_json, event, args.repeat):>8.2f} '
+              f'{measure(wire.decode_json, json_frame, args.repeat):>6.2f}   '
+              f'{measure(wire.encode_msgpack, event, args.repeat):>8.2f} '
+              f'{measure(wire.decode_msgpack, msgpack_frame, args.repeat):>6.2f}')
+    print(f'{"all events":>30} {totals[0]:>6} {totals[1]:>8} {1 - totals[1] / totals[0]:>6.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULT_TOKEN_CACHE = {
+    'BACKEND': 'chat.authentication.LocalTokenCache',
+    'TTL': 300,
+    'MAX_SIZE': 10000,
+}
+
+
+class LocalTokenCache:
+    """
+    token key -> Token (with its user) kept in process memory, with TTL and LRU eviction. Tokens are kept
+    pickled, so every request gets Token and User instances of its own to change.
+    Deleted tokens and changed users are dropped only by the process which deleted or changed them, the
+    others keep accepting them for up to TTL seconds, so use it for tests and single process servers only
+    """
+
+    def __init__(self, ttl, max_size, **kwargs):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (pickled token, user pk, expiry time)
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.tokens.get(key)
+            if entry is None:
+                return None
+            token, _, expires = entry
+            if expires < time.monotonic():
+                del self.tokens[key]
+                return None
+            self.tokens.move_to_end(key)
+        return pickle.loads(token)
+
+    def set(self, key, token):
+        entry = (pickle.dumps(token), token.user_id, time.monotonic() + self.ttl)
+        with self.lock:
+            self.tokens[key] = entry
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.tokens.pop(key, None)
+
+    def delete_user(self, user_pk):
+        with self.lock:
+            for key in [key for key, (_, token_user_pk, _) in self.tokens.items() if token_user_pk == user_pk]:
+                del self.tokens[key]
+
+
+class SharedTokenCache:
+    """
+    token key -> Token stored in a django cache (CACHES[CACHE]), so all nodes see the same entries.
+    Point that cache at redis and let its maxmemory-policy (allkeys-lru) do the LRU eviction.
+
+    Every entry holds the version of its user's tokens it was read at. delete_user replaces the version,
+    so all entries of the user stop matching without a list of their keys to update; an entry stored by a
+    read racing with delete_user, or one whose version was evicted, does not match either
+    """
+
+    prefix = 'token_user'
+
+    def __init__(self, ttl, cache='default', **kwargs):
+        self.ttl = ttl
+        self.alias = cache
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def user_key(self, user_pk):
+        return f'{self.prefix}:user:{user_pk}'
+
+    def get(self, key):
+        entry = self.cache.get(f'{self.prefix}:{key}')
+        if entry is None:
+            return None
+        token, version = entry
+        if self.cache.get(self.user_key(token.user_id)) != version:
+            return None
+        return token
+
+    def set(self, key, token):
+        user_key = self.user_key(token.user_id)
+        # add is atomic, of two nodes making a version at once both use the one stored first
+        self.cache.add(user_key, uuid.uuid4().hex, self.ttl)
+        version = self.cache.get(user_key)
+        if version is not None:
+            self.cache.set(f'{self.prefix}:{key}', (token, version), self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(f'{self.prefix}:{key}')
+
+    def delete_user(self, user_pk):
+        self.cache.set(self.user_key(user_pk), uuid.uuid4().hex, self.ttl)
+
+
+_token_cache = None
+
+
+def token_cache():
+    global _token_cache
+    if _token_cache is None:
+        config = {**DEFAULT_TOKEN_CACHE, **getattr(settings, 'TOKEN_CACHE', {})}
+        backend = import_string(config.pop('BACKEND'))
+        _token_cache = backend(**{name.lower(): value for name, value in config.items()})
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting == 'TOKEN_CACHE':
+        _token_cache = None
+
+
+def get_token(key):
+    """ return Token with its user, raises Token.DoesNotExist """
+    token = token_cache().get(key)
+    if token is None:
+        token = Token.objects.select_related('user').get(key=key)
+        token_cache().set(key, token)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication which looks tokens up in token_cache() before the database """
+
+    def authenticate_credentials(self, key):
+        try:
+            token = get_token(key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return token.user, token
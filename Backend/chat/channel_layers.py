@@ -0,0 +1,90 @@
+"""
+Channel layer spreading groups and process channels over several redis servers by consistent hashing.
+
+channels_redis picks the server of a group or a process channel with crc32(name) % len(hosts), so adding or
+removing a server moves almost every group to another one. Here every host owns REPLICAS points on a hash
+ring, placed by the host's address, and a name belongs to the host of the first point after the name's hash.
+Adding a host moves only the groups landing on its points, about 1/n of them, removing one moves only the
+groups it had. All nodes have to run with the same hosts, after changing them run
+`manage.py rebalance_channel_layer` to move memberships of the groups that changed hosts.
+"""
+
+import bisect
+import hashlib
+
+from channels_redis.core import ConnectionPool, RedisChannelLayer
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """ consistent hashing of names to nodes, every node has 'replicas' points on the ring """
+
+    def __init__(self, nodes, replicas=160):
+        points = sorted((ring_hash(f'{node}-{replica}'), node) for node in nodes for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node(self, name):
+        index = bisect.bisect(self.hashes, ring_hash(name))
+        return self.nodes[index % len(self.nodes)]
+
+
+def host_name(host):
+    """ name of a decoded channels_redis host on the ring, 'host:port' or its redis:// address """
+    address = host['address']
+    if isinstance(address, (tuple, list)):
+        return '%s:%s' % tuple(address)
+    return address
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """ RedisChannelLayer whose groups and process channels are placed on hosts by a HashRing """
+
+    def __init__(self, hosts=None, replicas=160, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.host_indexes = {host_name(host): index for index, host in enumerate(self.hosts)}
+        if len(self.host_indexes) != len(self.hosts):
+            raise ValueError('Every channel layer host has to be listed once.')
+        self.ring = HashRing(self.host_indexes, replicas)
+
+    def consistent_hash(self, value):
+        if isinstance(value, bytes):
+            value = value.decode('utf8')
+        # RedisChannelLayer.send hashes a whole process channel name while receive hashes its non-local part,
+        # hashing the non-local part only sends them to the same host
+        if '!' in value:
+            value = self.non_local_name(value)
+        return self.host_indexes[self.ring.node(value)]
+
+    async def rebalance(self, old_hosts=()):
+        """
+        move every group to the host owning it now, reading groups from all hosts and from 'old_hosts', ones
+        removed from hosts. Returns the number of groups moved
+        """
+        group_prefix = self._group_key('')
+        old_pools = [ConnectionPool(host) for host in self.decode_hosts(old_hosts)] if old_hosts else []
+        sources = [(index, pool) for index, pool in enumerate(self.pools)] + [(None, pool) for pool in old_pools]
+        moved = 0
+        try:
+            for source_index, pool in sources:
+                async with self.ConnectionContextManager(pool) as source:
+                    keys = [key async for key in source.iscan(match=group_prefix + b'*')]
+                    for key in keys:
+                        index = self.consistent_hash(key[len(group_prefix):])
+                        if index == source_index:
+                            continue
+                        members = await source.zrange(key, 0, -1, withscores=True)
+                        if members:
+                            pairs = [value for channel, score in members for value in (score, channel)]
+                            async with self.connection(index) as target:
+                                await target.zadd(key, *pairs)
+                                await target.expire(key, self.group_expiry)
+                        await source.delete(key)
+                        moved += 1
+        finally:
+            for pool in old_pools:
+                await pool.close()
+        return moved
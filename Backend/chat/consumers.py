@@ -1,285 +1,510 @@
 # chat/consumers.py
 
 import json
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
-from .serializers import MessageSerializer
-from .utils import create_message, create_friend_request, accept_friend, reject_friend, create_new_conversation, add_user_to_conversation
+import logging
+import time
+from urllib.parse import parse_qs
+
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from .serializers import serialize_message, serialize_messages
+from .utils import create_message, mark_conversation_read, create_friend_request, accept_friend, reject_friend, create_new_conversation, add_user_to_conversation
 from .models import Conversation, UserConversation, FriendRequest, User
-from rest_framework.authtoken.models import Token
+from .authentication import get_token
+from .mailbox import is_mailbox_id, mailbox, mailbox_key
+from . import metrics
+from .wire import MSGPACK_PROTOCOL, select_protocol, encode_json, decode_json, encode_msgpack, decode_msgpack
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_group_name(conversation_id):
+    return f'conv_{conversation_id}'
 
 
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
+class ChatConsumer(AsyncWebsocketConsumer):
+    # missed messages sent per conversation when resuming, client refetches the rest if there are more
+    resume_limit = 200
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.mailbox_position = None
+        self.resumed_sequences = dict()
         try:
-            headers = dict(self.scope['headers']) # data sent by user 
+            headers = dict(self.scope['headers']) # data sent by user
             if b'authorization' in headers:
                 token_name, token_key = headers[b'authorization'].decode().split()
                 if token_name == 'Token':
-                    token = Token.objects.get(key=token_key)
-                    self.scope['user'] = token.user
-                    self.user = token.user
+                    self.user = await self.get_token_user(token_key)
+                    self.scope['user'] = self.user
 
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception('token authentication of a socket failed')
             self.user = self.scope['user']
 
         self.room_group_name = 'chat_%s' % self.user.pk
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        self.accept()
+        # messages are fanned out through one group per conversation
+        self.conversation_groups = set()
+        for conversation_id in await self.get_listened_conversations():
+            await self.join_conversation_group({'conversation_id': conversation_id})
+        # frame format asked for in Sec-WebSocket-Protocol, JSON when client asked for none we know
+        self.protocol = select_protocol(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.protocol)
+        self.counted = True
+        metrics.open_connections.inc()
+        await self.replay_mailbox()
+        await self.resume_conversations()
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
+    async def disconnect(self, close_code):
+        if getattr(self, 'counted', False):
+            self.counted = False
+            metrics.open_connections.dec()
+        await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        for group_name in getattr(self, 'conversation_groups', ()):
+            await self.channel_layer.group_discard(
+                group_name,
+                self.channel_name
+            )
 
     # Receive message from WebSocket
-    def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            text_data_json = decode_msgpack(bytes_data)
+        else:
+            text_data_json = decode_json(text_data)
         type = text_data_json['type']
-        if type == 'message':
-            # server receives a message from user to his conversation
-            content = text_data_json['content']
-            conversation_id = text_data_json['conversation_id']
-            conversation = Conversation.objects.get(pk=conversation_id)
-            message = create_message(self.user, conversation, content)
-            for user in conversation.participants.all(): # server sends message to all conversation participants
-                userConversation = UserConversation.objects.get(user=user, conversation=conversation)
-                if userConversation.is_listening:
-                    room_group_name = 'chat_%s' % user.pk
-                    output_dict = MessageSerializer(message).data
-                    output_dict['conversation_id'] = conversation_id
-                    output_dict['type'] = 'message'
-
-                    async_to_sync(self.channel_layer.group_send)(
-                        room_group_name,
-                        output_dict
-                    )
-                else: # currently not used, but has potential 
-                    room_group_name = 'chat_%s' % user.pk
-                    async_to_sync(self.channel_layer.group_send)(
-                        room_group_name,
-                        {
-                            'type': 'notify',
-                            'conversation_id': conversation_id
-                        }
-                    )
-        elif type == 'join_conversation': # currently not used, but has potential 
-            conversation_id = text_data_json['conversation_id']
-            conversation = Conversation.objects.get(pk=conversation_id)
-            userConversation = UserConversation.objects.get(user=self.user, conversation=conversation)
-            userConversation.is_listening = True
-            userConversation.save()
-
-        elif type == 'key_request':
-            conversation_id = text_data_json['conversation_id']
-            dh_key = text_data_json['dh_key']
-
-            conversation = Conversation.objects.get(pk=conversation_id)
-            if conversation:
-                userConversation = UserConversation.objects.get(user=self.user, conversation=conversation)
-                if userConversation:  # sender of a request is a member of the conversation, notify admin
-                    room_group_name = 'chat_%s' % conversation.admin.pk
-                    async_to_sync(self.channel_layer.group_send)(
-                        room_group_name,
-                        {
-                            'type': 'key_request',
-                            'conversation_id': conversation_id,
-                            'dh_key': str(dh_key),
-                            'user_id': self.user.pk
-                        }
-                    )
-        elif type == 'key_response':
-            # get message from conversation admin, and redirect it to its proper receiver
-            conversation_id = text_data_json['conversation_id']
-            user_id = text_data_json['user_id']
-            dh_key = text_data_json['dh_key']
-            rsa_key = text_data_json['rsa_key']
-            flag = text_data_json['flag']
-
-            room_group_name = 'chat_%s' % user_id
-            async_to_sync(self.channel_layer.group_send)(
-                room_group_name,
+        handler = self.inbound_handlers.get(type)
+        if handler is None:
+            metrics.inbound_events.inc('unknown')
+            return
+        with metrics.track_event(type):
+            await handler(self, text_data_json)
+
+    async def receive_message(self, text_data_json):
+        # server receives a message from user to his conversation
+        content = text_data_json['content']
+        conversation_id = text_data_json['conversation_id']
+        output_dict, not_listening = await self.store_message(conversation_id, content)
+        if output_dict is None:
+            return
+        output_dict['conversation_id'] = conversation_id
+        output_dict['type'] = 'message'
+        # serialized once, delivered to every listening participant by a single send
+        await self.group_send(
+            conversation_group_name(conversation_id),
+            output_dict
+        )
+        for user_pk in not_listening: # currently not used, but has potential
+            await self.group_send(
+                'chat_%s' % user_pk,
+                {
+                    'type': 'notify',
+                    'conversation_id': conversation_id
+                }
+            )
+
+    async def receive_join_conversation(self, text_data_json): # currently not used, but has potential
+        conversation_id = text_data_json['conversation_id']
+        # only members may listen, a join of any other conversation is ignored
+        if await self.start_listening(conversation_id):
+            await self.join_conversation_group({'conversation_id': conversation_id})
+
+    async def receive_mark_read(self, text_data_json):
+        # user has seen all messages of the conversation
+        conversation_id = text_data_json['conversation_id']
+        await database_sync_to_async(mark_conversation_read)(self.user, conversation_id)
+
+    async def receive_key_request(self, text_data_json):
+        conversation_id = text_data_json['conversation_id']
+        dh_key = text_data_json['dh_key']
+
+        admin_pk = await self.get_conversation_admin(conversation_id)
+        if admin_pk is not None:  # sender of a request is a member of the conversation, notify admin
+            await self.send_to_user(
+                admin_pk,
                 {
-                    'type': 'key_response',
-                    'user_id': user_id,
+                    'type': 'key_request',
                     'conversation_id': conversation_id,
                     'dh_key': str(dh_key),
-                    'rsa_key': rsa_key,
-                    'flag': str(flag),
+                    'user_id': self.user.pk
                 }
             )
-        elif type == 'invite_friend':
-            friend_id = int(text_data_json['friend_id'])
-
-            try:
-                # return if users are friends already
-                self.user.contact.get().friends.get(pk=friend_id)
-                return
-            except:
-                receiver = User.objects.get(pk=friend_id)
-                notifications = receiver.notifications.get()
-                # if friend request was not already sent
-                if not FriendRequest.objects.filter(user=notifications,
-                                                    sender=self.user).exists():
-                    request = create_friend_request(notifications, self.user)
-                else:
-                    request = FriendRequest.objects.get(user=notifications, sender=self.user)
-                room_group_name = f'chat_{friend_id}'
-                async_to_sync(self.channel_layer.group_send)(
-                    room_group_name,
-                    {
-                        'type': 'invite',
-                        'sender_name': self.user.username,
-                        'request_id': request.id,
-                        'timestamp': str(request.timestamp)
-                    }
-                )
-
-        elif type == 'response_friend_req':
-            # creating conversation (or not, depends on whether user accepted friend request or not) and assinging its admin 
-            request_id = text_data_json['id']
-            response = text_data_json['response']
-            f_request = FriendRequest.objects.get(id=request_id)
-            if response == 'True':
-                conversation = accept_friend(self.user, f_request.sender, f_request)
-                if conversation is not None:
-                    self.notify_conversation_admin(conversation) # VERY IMPORTANT LINE 
-            elif response == "False":
-                reject_friend(f_request)
-            room_group_name = f'chat_{f_request.sender.id}'
-            async_to_sync(self.channel_layer.group_send)(
-                room_group_name,
+
+    async def receive_key_response(self, text_data_json):
+        # get message from conversation admin, and redirect it to its proper receiver
+        conversation_id = text_data_json['conversation_id']
+        user_id = text_data_json['user_id']
+        dh_key = text_data_json['dh_key']
+        rsa_key = text_data_json['rsa_key']
+        flag = text_data_json['flag']
+
+        await self.send_to_user(
+            user_id,
+            {
+                'type': 'key_response',
+                'user_id': user_id,
+                'conversation_id': conversation_id,
+                'dh_key': str(dh_key),
+                'rsa_key': rsa_key,
+                'flag': str(flag),
+            }
+        )
+
+    async def receive_ack(self, text_data_json):
+        # client handled events of its mailbox up to this one, they are not replayed on next connect
+        mailbox_id = text_data_json.get('mailbox_id')
+        if not is_mailbox_id(mailbox_id):
+            return
+        await mailbox().ack(self.user.pk, mailbox_id)
+
+    async def receive_invite_friend(self, text_data_json):
+        friend_id = int(text_data_json['friend_id'])
+
+        request = await self.store_friend_request(friend_id)
+        # return if users are friends already
+        if request is None:
+            return
+        await self.send_to_user(
+            friend_id,
+            {
+                'type': 'invite',
+                'sender_name': self.user.username,
+                'request_id': request['id'],
+                'timestamp': request['timestamp']
+            }
+        )
+
+    async def receive_response_friend_req(self, text_data_json):
+        # creating conversation (or not, depends on whether user accepted friend request or not) and assinging its admin
+        request_id = text_data_json['id']
+        response = text_data_json['response']
+        sender_pk, conversation = await self.store_friend_response(request_id, response)
+        if conversation is not None:
+            await self.notify_conversation_admin(*conversation) # VERY IMPORTANT LINE
+            await self.add_to_conversation_group(conversation[0], [self.user.pk, sender_pk])
+        await self.send_to_user(
+            sender_pk,
+            {
+                'type': 'response_req_notify',
+                'sender_name': self.user.username,
+                'response': response,
+            }
+        )
+
+    async def receive_create_group(self, text_data_json):
+        # creating group conversation
+        title = text_data_json['title']
+        admin_id = int(text_data_json['admin_id'])
+        users = [int(user_id) for user_id in text_data_json['users_ids']]
+        conversation, admin_name = await self.store_group(title, admin_id, users)
+        if conversation is None:
+            return
+        await self.notify_conversation_admin(*conversation)
+        await self.add_to_conversation_group(conversation[0], [admin_id] + users)
+        for user_id in users: # notify ppl added to created conversation
+            await self.send_to_user(
+                user_id,
                 {
-                    'type': 'response_req_notify',
-                    'sender_name': self.user.username,
-                    'response': response,
+                    'type': 'created_group_notify',
+                    'title': title,
+                    'admin_name': admin_name,
                 }
             )
-        elif type == 'create_group': 
-            # creating group conversation 
-            title = text_data_json['title']
-            admin_id = int(text_data_json['admin_id'])
-            users = text_data_json['users_ids']
-            admin = User.objects.get(pk=admin_id)
-            conv = create_new_conversation(title, admin, False)
-            self.notify_conversation_admin(conv)
-            for user_id in users: # adding ppl to created conversation
-                user = User.objects.get(pk=int(user_id))
-                add_user_to_conversation(user, conv)
-
-                room_group_name = f'chat_{int(user_id)}'
-                async_to_sync(self.channel_layer.group_send)(
-                    room_group_name,
-                    {
-                        'type': 'created_group_notify',
-                        'title': title,
-                        'admin_name': admin.username,
-                    }
-                )
-            
 
+    # handler of every event type clients send
+    inbound_handlers = {
+        'message': receive_message,
+        'join_conversation': receive_join_conversation,
+        'mark_read': receive_mark_read,
+        'key_request': receive_key_request,
+        'key_response': receive_key_response,
+        'ack': receive_ack,
+        'invite_friend': receive_invite_friend,
+        'response_friend_req': receive_response_friend_req,
+        'create_group': receive_create_group,
+    }
+
+    # Database access, every method runs in a single worker thread hop
+    @database_sync_to_async
+    def get_token_user(self, token_key):
+        return get_token(token_key).user
+
+    @database_sync_to_async
+    def get_listened_conversations(self):
+        return list(UserConversation.objects.filter(user=self.user, is_listening=True)
+                    .values_list('conversation_id', flat=True))
+
+    @database_sync_to_async
+    def store_message(self, conversation_id, content):
+        """ save message, return its serialized form and pks of participants who are not listening """
+        conversation = Conversation.objects.get(pk=conversation_id)
+        message = create_message(self.user, conversation, content)
+        if message is None:
+            return None, []
+        not_listening = list(UserConversation.objects.filter(conversation=conversation, is_listening=False)
+                             .values_list('user_id', flat=True))
+        return serialize_message(message), not_listening
+
+    @database_sync_to_async
+    def get_missed_messages(self, resume):
+        """ {conversation_id: (messages newer than resume[conversation_id] newest first, whether some were left out)} """
+        missed = dict()
+        for conversation in Conversation.objects.filter(pk__in=resume, participants=self.user):
+            if conversation.last_sequence <= resume[conversation.pk]:
+                continue
+            messages = serialize_messages(conversation.get_messages_after_sequence(resume[conversation.pk],
+                                                                                   self.resume_limit + 1))
+            missed[conversation.pk] = (messages[:self.resume_limit], len(messages) > self.resume_limit)
+        return missed
+
+    @database_sync_to_async
+    def start_listening(self, conversation_id):
+        """ return whether current user is a member of the conversation, who listens to it now """
+        return UserConversation.objects.filter(user=self.user, conversation_id=conversation_id).update(
+            is_listening=True) > 0
+
+    @database_sync_to_async
+    def get_conversation_admin(self, conversation_id):
+        """ return admin pk if current user is a member of the conversation """
+        if not UserConversation.objects.filter(user=self.user, conversation_id=conversation_id).exists():
+            return None
+        return Conversation.objects.values_list('admin_id', flat=True).get(pk=conversation_id)
+
+    @database_sync_to_async
+    def store_friend_request(self, friend_id):
+        if self.user.contact.get().friends.filter(pk=friend_id).exists():
+            return None
+        receiver = User.objects.get(pk=friend_id)
+        notifications = receiver.notifications.get()
+        # if friend request was not already sent
+        request = FriendRequest.objects.filter(user=notifications, sender=self.user).first()
+        if request is None:
+            request = create_friend_request(notifications, self.user)
+        return {'id': request.id, 'timestamp': str(request.timestamp)}
+
+    @database_sync_to_async
+    def store_friend_response(self, request_id, response):
+        """ return sender pk and (conversation_id, admin_pk) of created conversation """
+        f_request = FriendRequest.objects.select_related('sender').get(id=request_id)
+        sender_pk = f_request.sender.pk
+        conversation = None
+        if response == 'True':
+            created = accept_friend(self.user, f_request.sender, f_request)
+            if created is not None:
+                conversation = (created.id, created.admin_id)
+        elif response == "False":
+            reject_friend(f_request)
+        return sender_pk, conversation
+
+    @database_sync_to_async
+    def store_group(self, title, admin_id, users):
+        admin = User.objects.get(pk=admin_id)
+        conv = create_new_conversation(title, admin, False)
+        if conv is None:
+            return None, admin.username
+        for user in User.objects.filter(pk__in=users): # adding ppl to created conversation
+            add_user_to_conversation(user, conv)
+        return (conv.id, conv.admin_id), admin.username
+
+    async def send_event(self, frame, event=None):
+        """
+        send frame to the client in the format chosen on connect. 'event' is the channel layer event
+        the frame was made of, its mailbox id goes to the client so it can ack it
+        """
+        mailbox_id = event.get('mailbox_id') if event is not None else None
+        if mailbox_id is not None:
+            if self.mailbox_position is not None and mailbox_key(mailbox_id) <= mailbox_key(self.mailbox_position):
+                return  # replayed on connect already
+            frame['mailbox_id'] = mailbox_id
+        if self.protocol == MSGPACK_PROTOCOL:
+            await self.send(bytes_data=encode_msgpack(frame))
+        else:
+            await self.send(text_data=encode_json(frame))
+
+    async def send_to_user(self, user_pk, event):
+        """ group_send to every socket of the user, event stays in the user's mailbox for sockets opened later """
+        event['mailbox_id'] = await mailbox().append(user_pk, event)
+        await self.group_send(f'chat_{user_pk}', event)
+
+    async def group_send(self, group_name, event):
+        start = time.perf_counter()
+        await self.channel_layer.group_send(group_name, event)
+        metrics.group_send_seconds.observe(time.perf_counter() - start, event['type'])
+
+    async def dispatch(self, message):
+        """ channel layer events are timed per handler, websocket ones are timed in receive """
+        if message['type'].startswith('websocket.'):
+            return await super().dispatch(message)
+        start = time.perf_counter()
+        await super().dispatch(message)
+        handler = get_handler_name(message)
+        metrics.outbound_events.inc(handler)
+        metrics.outbound_seconds.observe(time.perf_counter() - start, handler)
+
+    async def replay_mailbox(self):
+        """
+        send events the client missed: the ones after 'last_id' from the query string, or after the last one
+        it acked. Events queued for this socket meanwhile are not sent twice
+        """
+        last_id = self.query.get('last_id', [None])[0]
+        if not is_mailbox_id(last_id):
+            last_id = None
+        position = None
+        for mailbox_id, event in await mailbox().read_after(self.user.pk, last_id):
+            await self.dispatch(dict(event, mailbox_id=mailbox_id))
+            position = mailbox_id
+        self.mailbox_position = position
+
+    async def resume_conversations(self):
+        """
+        send messages the client missed in conversations of the 'resume' query parameter, JSON object
+        {conversation_id: sequence of the last message client has}. Messages of a conversation go in one frame
+        """
+        if 'resume' not in self.query:
+            return
+        try:
+            resume = {int(conversation_id): int(sequence)
+                      for conversation_id, sequence in json.loads(self.query['resume'][0]).items()}
+        except (ValueError, AttributeError):
+            return
+        for conversation_id, (messages, has_more) in (await self.get_missed_messages(resume)).items():
+            # these may come through the conversation group too, they are not sent again then
+            self.resumed_sequences[conversation_id] = messages[0]['sequence']
+            await self.send_event({
+                'type': 'missed_messages',
+                'conversation_id': conversation_id,
+                'messages': messages,
+                'has_more': has_more,
+            })
 
     # Receive message from room conversation
-    def chat_message(self, event):
+    async def chat_message(self, event):
         message = event['message']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'message': message
-        })))
+        })
 
-    def notify(self, event):
+    async def notify(self, event):
         conversation_id = event['conversation_id']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'new_notification',
             'conversation_id': conversation_id
-        })))
+        })
 
-    def key_request(self, event):
+    async def key_request(self, event):
         conversation_id = event['conversation_id']
         dh_key = event['dh_key']
         user_id = event['user_id']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'key_request',
             'conversation_id': conversation_id,
             'dh_key': dh_key,
             'user_id': user_id
-        })))
+        }, event)
 
-    def key_response(self, event):
+    async def key_response(self, event):
         user_id = event['user_id']
         conversation_id = event['conversation_id']
         dh_key = event['dh_key']
         rsa_key = event['rsa_key']
         flag = event['flag']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'key_response',
             'user_id': user_id,
             'conversation_id': conversation_id,
             'dh_key': dh_key,
             'rsa_key': rsa_key,
             'flag': flag,
-        })))
+        }, event)
 
-    def message(self, event):
+    async def message(self, event):
         content = event['content']
         conversation_id = event['conversation_id']
         author = event['author']
         timestamp = event['timestamp']
-        async_to_sync(self.send(text_data=json.dumps({
+        sequence = event['sequence']
+        if sequence <= self.resumed_sequences.get(conversation_id, 0):
+            return  # sent with missed messages on connect
+        await self.send_event({
             'type': 'new_message',
             'conversation_id': conversation_id,
             'author': author,
             'timestamp': timestamp,
-            'content': content
-        })))
+            'content': content,
+            'sequence': sequence,
+        })
 
-    def invite(self, event):
+    async def invite(self, event):
         request_id = event['request_id']
         sender = event['sender_name']
         timestamp = event['timestamp']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'friend_request',
             'sender': sender,
             'request_id': request_id,
             'timestamp': timestamp
-        })))
+        }, event)
 
-    def response_req_notify(self, event):
+    async def response_req_notify(self, event):
         sender = event['sender_name']
         response = event['response']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'response_f_request',
             'sender': sender,
             'response': response,
-        })))
+        }, event)
 
-    def notify_conversation_admin(self, conversation : Conversation):
-        room_group_name = f'chat_{conversation.admin.pk}'
-        async_to_sync(self.channel_layer.group_send)(
-            room_group_name,
+    async def notify_conversation_admin(self, conversation_id, admin_pk):
+        await self.send_to_user(
+            admin_pk,
             {
                 'type': 'new_conversation',
-                'conversation_id': conversation.id,
+                'conversation_id': conversation_id,
             }
         )
-    def new_conversation(self,event):
+
+    async def add_to_conversation_group(self, conversation_id, user_pks):
+        """ make every open socket of given users join the conversation group """
+        for user_pk in user_pks:
+            await self.group_send(
+                f'chat_{user_pk}',
+                {
+                    'type': 'join_conversation_group',
+                    'conversation_id': conversation_id,
+                }
+            )
+
+    async def join_conversation_group(self, event):
+        # internal event, nothing is sent to the client
+        group_name = conversation_group_name(event['conversation_id'])
+        if group_name not in self.conversation_groups:
+            self.conversation_groups.add(group_name)
+            await self.channel_layer.group_add(
+                group_name,
+                self.channel_name
+            )
+
+    async def new_conversation(self, event):
         conversation_id = event['conversation_id']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'new_conversation',
             'conversation_id': conversation_id,
-        })))
+        }, event)
 
-    def created_group_notify(self, event):
+    async def created_group_notify(self, event):
         title = event['title']
         admin_name = event['admin_name']
-        async_to_sync(self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'create_group_notify',
             'title': title,
             'admin': admin_name,
-        })))
-
-
+        }, event)
@@ -0,0 +1,155 @@
+import itertools
+import json
+import re
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_MAILBOX = {
+    'BACKEND': 'chat.mailbox.LocalMailbox',
+    'MAX_LENGTH': 1000,
+    'TTL': 7 * 24 * 60 * 60,
+}
+
+
+MAILBOX_ID = re.compile(r'[0-9]+-[0-9]+')
+
+# sets the acked position only when it moves forward, so of two sockets acking at once the newer id stays
+ACK_SCRIPT = """
+local function newer(id, than)
+    local milliseconds, sequence = string.match(id, '^(%d+)-(%d+)$')
+    local than_milliseconds, than_sequence = string.match(than, '^(%d+)-(%d+)$')
+    if not than_milliseconds then
+        return true
+    end
+    milliseconds, than_milliseconds = tonumber(milliseconds), tonumber(than_milliseconds)
+    return milliseconds > than_milliseconds
+        or milliseconds == than_milliseconds and tonumber(sequence) > tonumber(than_sequence)
+end
+local acked = redis.call('GET', KEYS[1])
+if acked and not newer(ARGV[1], acked) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+def mailbox_key(mailbox_id):
+    """
+    sort key of mailbox ids, they look like redis stream ids '<milliseconds>-<sequence>'.
+    Raises ValueError for anything else, ids come from clients
+    """
+    if not isinstance(mailbox_id, str) or MAILBOX_ID.fullmatch(mailbox_id) is None:
+        raise ValueError(f'Invalid mailbox id {mailbox_id!r}')
+    milliseconds, sequence = mailbox_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def is_mailbox_id(value):
+    try:
+        mailbox_key(value)
+    except ValueError:
+        return False
+    return True
+
+
+class LocalMailbox:
+    """ per-user mailboxes kept in process memory, for tests and a single process server """
+
+    def __init__(self, max_length, **kwargs):
+        self.max_length = max_length
+        self.events = defaultdict(lambda: deque(maxlen=self.max_length))
+        self.acked = dict()
+        self.counter = itertools.count(1)
+
+    async def append(self, user_pk, event):
+        mailbox_id = f'{next(self.counter)}-0'
+        self.events[user_pk].append((mailbox_id, event))
+        return mailbox_id
+
+    async def read_after(self, user_pk, last_id=None):
+        last_id = last_id if is_mailbox_id(last_id) else self.acked.get(user_pk)
+        if last_id is None:
+            return list(self.events[user_pk])
+        last = mailbox_key(last_id)
+        return [(mailbox_id, event) for mailbox_id, event in self.events[user_pk] if mailbox_key(mailbox_id) > last]
+
+    async def ack(self, user_pk, mailbox_id):
+        key = mailbox_key(mailbox_id)
+        acked = self.acked.get(user_pk)
+        if acked is None or key > mailbox_key(acked):
+            self.acked[user_pk] = mailbox_id
+
+
+class RedisMailbox:
+    """
+    one redis stream per user (mailbox:<pk>) capped at about MAX_LENGTH events, with position of the last
+    event acked by the client next to it. Both expire TTL seconds after the last event
+    """
+
+    prefix = 'mailbox'
+
+    def __init__(self, max_length, ttl, address='redis://redis:6379', **kwargs):
+        self.max_length = max_length
+        self.ttl = ttl
+        self.address = address
+        self.redis = None
+
+    async def connection(self):
+        if self.redis is None:
+            import aioredis
+            self.redis = await aioredis.create_redis_pool(self.address)
+        return self.redis
+
+    async def append(self, user_pk, event):
+        redis = await self.connection()
+        key = f'{self.prefix}:{user_pk}'
+        mailbox_id = await redis.execute(b'XADD', key, b'MAXLEN', b'~', self.max_length, b'*',
+                                         b'event', json.dumps(event))
+        await redis.expire(key, self.ttl)
+        return mailbox_id.decode()
+
+    async def read_after(self, user_pk, last_id=None):
+        redis = await self.connection()
+        key = f'{self.prefix}:{user_pk}'
+        if not is_mailbox_id(last_id):
+            last_id = await redis.get(f'{key}:acked')
+            last_id = last_id.decode() if last_id is not None else None
+            # acks stored before they were validated may hold anything
+            if not is_mailbox_id(last_id):
+                last_id = '0-0'
+        # XREAD returns entries with id greater than last_id, None when there are none
+        streams = await redis.execute(b'XREAD', b'COUNT', self.max_length, b'STREAMS', key, last_id)
+        if not streams:
+            return []
+        _, entries = streams[0]
+        return [(mailbox_id.decode(), json.loads(dict(zip(fields[::2], fields[1::2]))[b'event']))
+                for mailbox_id, fields in entries]
+
+    async def ack(self, user_pk, mailbox_id):
+        mailbox_key(mailbox_id)
+        redis = await self.connection()
+        await redis.eval(ACK_SCRIPT, keys=[f'{self.prefix}:{user_pk}:acked'], args=[mailbox_id, self.ttl])
+
+
+_mailbox = None
+
+
+def mailbox():
+    global _mailbox
+    if _mailbox is None:
+        config = {**DEFAULT_MAILBOX, **getattr(settings, 'MAILBOX', {})}
+        backend = import_string(config.pop('BACKEND'))
+        _mailbox = backend(**{name.lower(): value for name, value in config.items()})
+    return _mailbox
+
+
+@receiver(setting_changed)
+def reset_mailbox(setting, **kwargs):
+    global _mailbox
+    if setting == 'MAILBOX':
+        _mailbox = None
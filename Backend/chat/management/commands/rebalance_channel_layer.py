@@ -0,0 +1,22 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management import BaseCommand, CommandError
+
+from chat.channel_layers import ShardedRedisChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Move channel layer groups to the redis hosts owning them, run after CHANNEL_LAYERS hosts changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--old-host', dest='old_hosts', action='append', default=[],
+            help='Address of a host removed from CHANNEL_LAYERS, like redis://redis2:6379, its groups move too.',
+        )
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer()
+        if not isinstance(layer, ShardedRedisChannelLayer):
+            raise CommandError('The default channel layer is not a ShardedRedisChannelLayer.')
+        moved = async_to_sync(layer.rebalance)(options['old_hosts'])
+        self.stdout.write(f'Moved {moved} groups.')
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import QuerySet
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_MESSAGE_CACHE = {
+    'BACKEND': 'chat.message_cache.LocalMessageCache',
+    'SIZE': 50,
+    'TTL': 24 * 60 * 60,
+    'MAX_CONVERSATIONS': 10000,
+}
+
+# serialized message with what pagination cursors are made of (pk, timestamp)
+CachedMessage = namedtuple('CachedMessage', ['pk', 'timestamp', 'sequence', 'data'])
+
+
+def cached_messages(messages):
+    """ CachedMessages of a messages queryset, read in one query with authors, or of a list of saved messages """
+    from .serializers import message_values, serialize_message, serialize_message_row
+
+    if isinstance(messages, QuerySet):
+        return [CachedMessage(row['pk'], row['timestamp'], row['sequence'], serialize_message_row(row))
+                for row in message_values(messages)]
+    return [CachedMessage(message.pk, message.timestamp, message.sequence, serialize_message(message))
+            for message in messages]
+
+
+def wanted_sequences(last_sequence, count):
+    """ sequences of the newest 'count' messages of a conversation whose newest message is 'last_sequence' """
+    return list(range(last_sequence, max(last_sequence - count, 0), -1))
+
+
+def complete(messages, sequences):
+    """ messages read from slots, or None when some slot is empty or holds another message """
+    if any(message is None or message.sequence != sequence for message, sequence in zip(messages, sequences)):
+        return None
+    return messages
+
+
+def oldest_first(messages, size):
+    # only the newest 'size' messages get slots, newer messages win slots they share with older ones
+    return sorted(messages, key=lambda message: message.sequence)[-size:]
+
+
+class LocalMessageCache:
+    """
+    last SIZE messages of every conversation kept in process memory, for tests and a single process server.
+    Conversations not used for TTL seconds are dropped, and least recently used ones above MAX_CONVERSATIONS
+    """
+
+    def __init__(self, size, ttl, max_conversations, **kwargs):
+        self.size = size
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        # conversation id -> (ring of SIZE slots indexed by sequence % SIZE, expiry time)
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+
+    def ring(self, conversation_id, create):
+        # lock is held
+        entry = self.conversations.get(conversation_id)
+        now = time.monotonic()
+        if entry is not None and entry[1] < now:
+            del self.conversations[conversation_id]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = [[None] * self.size, 0]
+            self.conversations[conversation_id] = entry
+            while len(self.conversations) > self.max_conversations:
+                self.conversations.popitem(last=False)
+        entry[1] = now + self.ttl
+        self.conversations.move_to_end(conversation_id)
+        return entry[0]
+
+    def add(self, conversation_id, messages):
+        with self.lock:
+            ring = self.ring(conversation_id, create=True)
+            for message in oldest_first(messages, self.size):
+                ring[message.sequence % self.size] = message
+
+    def get_newest(self, conversation_id, last_sequence, count):
+        """ newest 'count' CachedMessages newest first, None unless all of them are cached """
+        if count > self.size:
+            return None
+        sequences = wanted_sequences(last_sequence, count)
+        with self.lock:
+            ring = self.ring(conversation_id, create=False)
+            if ring is None:
+                return None
+            return complete([ring[sequence % self.size] for sequence in sequences], sequences)
+
+
+class SharedMessageCache:
+    """
+    last SIZE messages of every conversation stored in a django cache (CACHES[CACHE]), so all nodes see the
+    same entries. Every message has a slot of its own (message:<conversation id>:<sequence % SIZE>), written
+    by whoever stored the message, so concurrent senders never overwrite each other. Slots expire TTL seconds
+    after they were written, point that cache at redis to keep them there.
+    """
+
+    prefix = 'message'
+
+    def __init__(self, size, ttl, cache='default', **kwargs):
+        self.size = size
+        self.ttl = ttl
+        self.alias = cache
+
+    @property
+    def cache(self):
+        # django cache handles are per thread, this instance is shared by all of them
+        return caches[self.alias]
+
+    def slot(self, conversation_id, sequence):
+        return f'{self.prefix}:{conversation_id}:{sequence % self.size}'
+
+    def add(self, conversation_id, messages):
+        slots = {self.slot(conversation_id, message.sequence): message
+                 for message in oldest_first(messages, self.size)}
+        self.cache.set_many(slots, self.ttl)
+
+    def get_newest(self, conversation_id, last_sequence, count):
+        if count > self.size:
+            return None
+        sequences = wanted_sequences(last_sequence, count)
+        slots = self.cache.get_many([self.slot(conversation_id, sequence) for sequence in sequences])
+        return complete([slots.get(self.slot(conversation_id, sequence)) for sequence in sequences], sequences)
+
+
+_message_cache = None
+
+
+def message_cache():
+    global _message_cache
+    if _message_cache is None:
+        config = {**DEFAULT_MESSAGE_CACHE, **getattr(settings, 'MESSAGE_CACHE', {})}
+        backend = import_string(config.pop('BACKEND'))
+        _message_cache = backend(**{name.lower(): value for name, value in config.items()})
+    return _message_cache
+
+
+@receiver(setting_changed)
+def reset_message_cache(setting, **kwargs):
+    global _message_cache
+    if setting == 'MESSAGE_CACHE':
+        _message_cache = None
+
+
+def newest_messages(conversation, count):
+    """
+    newest 'count' messages of the conversation as CachedMessages, newest first. Served from message_cache()
+    when it has all of them, otherwise read from the database and put into it
+    """
+    from . import metrics
+
+    if conversation.last_sequence == 0:
+        return []
+    messages = message_cache().get_newest(conversation.pk, conversation.last_sequence, count)
+    if messages is not None:
+        metrics.message_cache_requests.inc('hit')
+        return messages
+    metrics.message_cache_requests.inc('miss')
+    messages = cached_messages(conversation.get_newest_messages(count))
+    message_cache().add(conversation.pk, [message for message in messages if message.sequence is not None])
+    return messages
@@ -0,0 +1,299 @@
+"""
+Counters, gauges and histograms of the chat server, exported in Prometheus text format on /metrics.
+
+Recording is a lock and a dict update, cheap enough for every socket event. Values live in process memory,
+each daphne process exports its own. SQL queries run while handling an inbound event are counted through a
+context variable which database_sync_to_async carries into worker threads.
+
+/metrics answers only addresses of METRICS['ALLOWED_NETWORKS'] and requests with the bearer METRICS['TOKEN'].
+"""
+
+import hmac
+import ipaddress
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULT_METRICS = {
+    'ALLOWED_NETWORKS': ['127.0.0.0/8', '::1/128'],
+    'TOKEN': None,
+    'DEPTH_INTERVAL': 15,
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = dict()
+        _registry.append(self)
+
+    def samples(self):
+        """ (name suffix, label values, extra labels, value) of the current values """
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in sorted(values):
+            yield '', label_values, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(self.labels, label_values, extra)} '
+                         f'{format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """ value set by the code, or read from 'collect' on every scrape: {label values: value} """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception:
+                # one broken collector must not fail the whole scrape
+                logger.exception('collecting %s failed', self.name)
+                return
+            for label_values, value in sorted(values.items()):
+                yield '', label_values, (), value
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                # count per bucket (last one is +Inf), sum, count
+                state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = [(label_values, (list(counts), total, count))
+                      for label_values, (counts, total, count) in self.values.items()]
+        for label_values, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', label_values, (('le', format_value(float(bound))),), cumulative
+            yield '_sum', label_values, (), total
+            yield '_count', label_values, (), count
+
+
+def render():
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+def metrics_config():
+    return {**DEFAULT_METRICS, **getattr(settings, 'METRICS', {})}
+
+
+def scrape_allowed(request):
+    """ whether the request comes from an allowed network or carries the metrics token """
+    config = metrics_config()
+    token = config['TOKEN']
+    if token is not None:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if header.startswith('Bearer ') and hmac.compare_digest(header[len('Bearer '):], token):
+            return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in config['ALLOWED_NETWORKS'])
+
+
+# SQL queries of the event being handled: [count, seconds] or None outside of an event
+_db_usage = ContextVar('db_usage', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    usage = _db_usage.get()
+    if usage is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        usage[0] += 1
+        usage[1] += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def add_query_counter(connection, **kwargs):
+    # every worker thread has its own connection, reopened when it gets old
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class track_event:
+    """
+    context manager around handling of an inbound socket event: counts it and observes its latency,
+    SQL queries and time spent in them
+    """
+
+    def __init__(self, event_type):
+        self.event_type = event_type
+
+    def __enter__(self):
+        self.usage = [0, 0.0]
+        self.token = _db_usage.set(self.usage)
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _db_usage.reset(self.token)
+        inbound_events.inc(self.event_type)
+        inbound_seconds.observe(elapsed, self.event_type)
+        event_queries.observe(self.usage[0], self.event_type)
+        event_query_seconds.observe(self.usage[1], self.event_type)
+        if exc_type is not None:
+            inbound_errors.inc(self.event_type, exc_type.__name__)
+
+
+def process_channel_keys(layer):
+    """
+    redis lists this process reads: the one of its process channels and ones of normal channels it listens on,
+    {list key: index of its connection}
+    """
+    names = {f'specific.{layer.client_prefix}!'}
+    names.update(layer.non_local_name(channel) if '!' in channel else channel for channel in layer.receive_buffer)
+    return {layer.prefix + name: layer.consistent_hash(name) for name in names}
+
+
+async def channel_layer_depth(layer):
+    """
+    messages waiting for this process in the channel layer, {(location,): count}. 'local' are queues in this
+    process (in-memory layer, or redis messages already read for local channels), 'redis' are lists on the
+    servers still to be read. Asks redis about the lists of this process only, never scans the keyspace
+    """
+    if hasattr(layer, 'channels'):
+        return {('local',): sum(queue.qsize() for queue in layer.channels.values())}
+    depth = {('local',): sum(queue.qsize() for queue in getattr(layer, 'receive_buffer', {}).values())}
+    if hasattr(layer, 'pools'):
+        waiting = 0
+        for key, index in process_channel_keys(layer).items():
+            async with layer.connection(index) as connection:
+                waiting += await connection.llen(key)
+        depth[('redis',)] = waiting
+    return depth
+
+
+# (monotonic time, value) of the last depth measured, scrapes within METRICS['DEPTH_INTERVAL'] get it again
+_depth_sample = None
+_depth_lock = threading.Lock()
+
+
+def collect_channel_layer_depth():
+    from channels.layers import get_channel_layer
+
+    global _depth_sample
+    with _depth_lock:
+        now = time.monotonic()
+        if _depth_sample is not None and now - _depth_sample[0] < metrics_config()['DEPTH_INTERVAL']:
+            return _depth_sample[1]
+        layer = get_channel_layer()
+        depth = {} if layer is None else async_to_sync(channel_layer_depth)(layer)
+        _depth_sample = (now, depth)
+        return depth
+
+
+@receiver(setting_changed)
+def reset_depth_sample(setting, **kwargs):
+    global _depth_sample
+    if setting in ('METRICS', 'CHANNEL_LAYERS'):
+        _depth_sample = None
+
+
+inbound_events = Counter('chat_inbound_events_total', 'Socket events received from clients.', ['type'])
+inbound_errors = Counter('chat_inbound_errors_total', 'Socket events whose handling raised.', ['type', 'exception'])
+inbound_seconds = Histogram('chat_inbound_event_seconds', 'Time to handle a socket event from a client.', ['type'])
+event_queries = Histogram('chat_inbound_event_queries', 'SQL queries run while handling a socket event.', ['type'],
+                          buckets=COUNT_BUCKETS)
+event_query_seconds = Histogram('chat_inbound_event_query_seconds',
+                                'Time spent in SQL queries while handling a socket event.', ['type'])
+outbound_events = Counter('chat_outbound_events_total', 'Channel layer events handled by sockets.', ['handler'])
+outbound_seconds = Histogram('chat_outbound_event_seconds', 'Time to handle a channel layer event.', ['handler'])
+group_send_seconds = Histogram('chat_group_send_seconds', 'Time of channel layer group_send by event type.',
+                               ['type'])
+open_connections = Gauge('chat_open_connections', 'Accepted chat sockets.')
+open_connections.set(0)
+channel_layer_queue_depth = Gauge('chat_channel_layer_queue_depth', 'Messages waiting in the channel layer.',
+                                  ['location'], collect=collect_channel_layer_depth)
+message_cache_requests = Counter('chat_message_cache_requests_total',
+                                 'Newest pages of conversation history asked from the recent messages cache.',
+                                 ['result'])
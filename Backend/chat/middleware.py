@@ -0,0 +1,76 @@
+import gzip
+
+import brotli
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+DEFAULT_RESPONSE_COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+# preferred first when the client accepts several with the same quality
+ENCODINGS = ('br', 'gzip')
+
+
+def accepted_encoding(header):
+    """ best of ENCODINGS accepted in Accept-Encoding header value, None when the client takes none of them """
+    qualities = dict()
+    for part in header.split(','):
+        name, _, parameters = part.strip().partition(';')
+        quality = 1.0
+        parameter, _, value = parameters.strip().partition('=')
+        if parameter.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    wildcard = qualities.get('*', 0.0)
+    best = max(ENCODINGS, key=lambda encoding: (qualities.get(encoding, wildcard), -ENCODINGS.index(encoding)))
+    return best if qualities.get(best, wildcard) > 0 else None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli or gzip compression of responses of at least MIN_SIZE bytes, whichever the client prefers in
+    Accept-Encoding. Like django's GZipMiddleware responses are sent compressed only when that makes them
+    shorter, and their ETags become weak
+    """
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        config = {**DEFAULT_RESPONSE_COMPRESSION, **getattr(settings, 'RESPONSE_COMPRESSION', {})}
+        self.min_size = config['MIN_SIZE']
+        self.gzip_level = config['GZIP_LEVEL']
+        self.brotli_quality = config['BROTLI_QUALITY']
+
+    def compress(self, encoding, content):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+        return gzip.compress(content, compresslevel=self.gzip_level, mtime=0)
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < self.min_size:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = self.compress(encoding, response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        # compressed bytes differ from the identity ones, conditional requests still match weak ETags
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_conversation_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userconversation',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
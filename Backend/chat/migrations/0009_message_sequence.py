@@ -0,0 +1,41 @@
+# Generated by Django 3.0.5 on 2026-10-18 03:14
+
+from django.db import migrations, models
+
+
+def number_messages(apps, schema_editor):
+    """ number existing messages of every conversation in order they were sent """
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.all():
+        messages = list(Message.objects.filter(conversation=conversation).order_by('timestamp', 'pk'))
+        for sequence, message in enumerate(messages, 1):
+            message.sequence = sequence
+        Message.objects.bulk_update(messages, ['sequence'], batch_size=1000)
+        conversation.last_sequence = len(messages)
+        conversation.save(update_fields=['last_sequence'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_userconversation_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation', 'sequence'), name='message_conversation_sequence'),
+        ),
+    ]
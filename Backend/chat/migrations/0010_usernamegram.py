@@ -0,0 +1,44 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_usernames(apps, schema_editor):
+    """ index usernames of existing users for search """
+    from chat.search import username_grams
+
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UsernameGram = apps.get_model('chat', 'UsernameGram')
+    grams = []
+    for pk, username in User.objects.values_list('pk', 'username').iterator():
+        grams.extend(UsernameGram(user_id=pk, gram=gram) for gram in username_grams(username))
+        if len(grams) >= 10000:
+            UsernameGram.objects.bulk_create(grams)
+            grams = []
+    UsernameGram.objects.bulk_create(grams)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0009_message_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsernameGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='username_grams', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='usernamegram',
+            constraint=models.UniqueConstraint(fields=('gram', 'user'), name='username_gram_user'),
+        ),
+        migrations.RunPython(index_usernames, migrations.RunPython.noop),
+    ]
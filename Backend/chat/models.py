@@ -1,7 +1,12 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from allauth.account.signals import user_signed_up
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .search import index_user
 
 User = get_user_model()
 
@@ -16,6 +21,20 @@ def after_user_signed_up(request, user, **kwargs):
     Notifications.objects.create(user=user)
 
 
+# executes when user was saved, keeps username search index up to date
+@receiver(post_save, sender=User)
+def after_user_saved(sender, instance, created, update_fields, **kwargs):
+    # skip saves which cannot change username, like last_login on every login
+    if created or update_fields is None or 'username' in update_fields:
+        index_user(instance)
+
+
+# executes when token was deleted (logout, user removal)
+@receiver(post_delete, sender=Token)
+def after_token_deleted(sender, instance, **kwargs):
+    token_cache().delete(instance.key)
+
+
 class Contact(models.Model):
     user = models.ForeignKey(
         User, related_name='contact', on_delete=models.CASCADE)
@@ -25,12 +44,28 @@ class Contact(models.Model):
         return self.user.username
 
 
+class UsernameGram(models.Model):
+    """ username search index, see search.py """
+    user = models.ForeignKey(User, related_name='username_grams', on_delete=models.CASCADE)
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gram', 'user'], name='username_gram_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.gram}: {self.user_id}"
+
+
 class Conversation(models.Model):
     participants = models.ManyToManyField(
         User, related_name='conversations', blank=True, through='UserConversation')
     is_private = models.BooleanField(default=True)
     title = models.CharField(max_length=1000)
     admin = models.ForeignKey(User, default=None, null=True, on_delete=models.CASCADE)
+    # sequence of the newest message, see utils.create_message
+    last_sequence = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return "{}: {}".format(self.pk, self.title)
@@ -41,6 +76,23 @@ class Conversation(models.Model):
     def get_last_messages_timestamp(self, timestamp):
         return self.messages.order_by('-timestamp').filter(timestamp__gt=timestamp)
 
+    def get_newest_messages(self, count):
+        return self.messages.select_related('author').order_by('-timestamp', '-pk')[:count]
+
+    def get_messages_before(self, timestamp, pk, count):
+        """ newest first, older than message (timestamp, pk), seeks on (conversation, timestamp) index """
+        older = Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+        return self.messages.select_related('author').filter(older).order_by('-timestamp', '-pk')[:count]
+
+    def get_messages_after(self, timestamp, pk, count):
+        """ oldest first, newer than message (timestamp, pk) """
+        newer = Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+        return self.messages.select_related('author').filter(newer).order_by('timestamp', 'pk')[:count]
+
+    def get_messages_after_sequence(self, sequence, count):
+        """ newest first, at most 'count' of messages with sequence greater than given one """
+        return self.messages.select_related('author').filter(sequence__gt=sequence).order_by('-sequence')[:count]
+
 
 class Message(models.Model):
     author = models.ForeignKey(
@@ -49,6 +101,16 @@ class Message(models.Model):
         Conversation, related_name='messages', on_delete=models.CASCADE, null=True)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # 1, 2, 3... in every conversation, in order of saving
+    sequence = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='message_conversation_time'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'sequence'], name='message_conversation_sequence'),
+        ]
 
     def __str__(self):
         return "author:{}, conversation: {}, id: {}".format(self.author.username, self.conversation, self.pk)
@@ -61,6 +123,7 @@ class UserConversation(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
 
     unread = models.BooleanField(default=False)
+    unread_count = models.PositiveIntegerField(default=0)
     last_read_timestamp = models.DateTimeField(auto_now_add=True)
     is_listening = models.BooleanField(default=True)
 
@@ -70,7 +133,7 @@ class UserConversation(models.Model):
         return self.conversation.get_last_messages_timestamp(self.last_read_timestamp)
 
     def count_unread(self):
-        return len(self.get_unread())
+        return self.unread_count
 
     def title(self):
         return self.conversation.title
@@ -0,0 +1,42 @@
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(message):
+    """ opaque cursor pointing at message, ordered by (timestamp, pk) """
+    raw = '{}|{}'.format(message.timestamp.isoformat(), message.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """ return (timestamp, pk) of cursor, raises ValueError when cursor is malformed """
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(e)
+    if timestamp is None:
+        raise ValueError('Invalid cursor timestamp')
+    return timestamp, int(pk)
+
+
+def encode_watermark(read_since, sequences):
+    """ opaque /chat/sync/ watermark: time read states are compared with, last sequence of every conversation """
+    raw = '{}|{}'.format(read_since.isoformat(),
+                         ','.join('{}:{}'.format(pk, sequence) for pk, sequence in sorted(sequences.items())))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_watermark(watermark):
+    """ return (read_since, {conversation pk: last sequence}), raises ValueError when watermark is malformed """
+    try:
+        read_since, sequences = base64.urlsafe_b64decode(watermark.encode()).decode().split('|')
+        read_since = parse_datetime(read_since)
+        sequences = dict(map(int, pair.split(':')) for pair in sequences.split(',') if pair)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(e)
+    if read_since is None:
+        raise ValueError('Invalid watermark timestamp')
+    return read_since, sequences
@@ -0,0 +1,67 @@
+"""
+Username search on an n-gram index instead of icontains scans of the whole user table.
+
+Every username is indexed as its lowercase trigrams plus '^'-prefixed grams of its first one and two letters.
+A query of three or more letters narrows users down to those having all of its trigrams: entries of one trigram
+are read from the (gram, user) index and the others are looked up in it for each of them, only users left are
+checked with icontains. Shorter queries match username prefixes.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db.models import Case, Exists, IntegerField, OuterRef, Value, When
+from django.db.models.functions import Length
+
+User = get_user_model()
+
+PREFIX = '^'
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def username_grams(username):
+    username = username.lower()
+    return {PREFIX + username[:length] for length in (1, 2) if len(username) >= length} | trigrams(username)
+
+
+def index_user(user):
+    """ (re)build index entries of the user, after signup or a change of username """
+    from .models import UsernameGram
+
+    UsernameGram.objects.filter(user=user).delete()
+    UsernameGram.objects.bulk_create(UsernameGram(user=user, gram=gram) for gram in username_grams(user.username))
+
+
+def query_grams(key):
+    key = key.lower()
+    if len(key) >= 3:
+        return trigrams(key)
+    return {PREFIX + key}
+
+
+def search_users(user, key, limit=SEARCH_LIMIT, offset=0):
+    """
+    users other than 'user' whose username contains 'key', exact match first, then prefix and substring
+    matches, shorter usernames first within each. 'is_friend' tells whether they are friends of 'user'
+    """
+    from .models import Contact, UsernameGram
+
+    key = key.strip()
+    if not key:
+        return User.objects.none()
+    first, *rest = sorted(query_grams(key))
+    candidates = UsernameGram.objects.filter(gram=first)
+    for gram in rest:
+        candidates = candidates.filter(Exists(UsernameGram.objects.filter(user=OuterRef('user'), gram=gram)))
+    friendship = Contact.friends.through.objects.filter(contact__user=user, user=OuterRef('pk'))
+    users = (User.objects.filter(pk__in=candidates.values('user'), username__icontains=key).exclude(pk=user.pk)
+             .annotate(rank=Case(When(username__iexact=key, then=Value(0)),
+                                 When(username__istartswith=key, then=Value(1)),
+                                 default=Value(2), output_field=IntegerField()),
+                       length=Length('username'),
+                       is_friend=Exists(friendship))
+             .order_by('rank', 'length', 'username'))
+    return users[offset:offset + limit]
@@ -8,6 +8,15 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username']
 
 
+class UserSearchSerializer(serializers.ModelSerializer):
+    # annotated by search.search_users
+    is_friend = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'is_friend']
+
+
 class ContactSerializer(serializers.ModelSerializer):
     friends = UserSerializer(many=True, read_only=True)
 
@@ -17,14 +26,14 @@ class ContactSerializer(serializers.ModelSerializer):
 
 
 class UserConversationSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField('get_conversation_id')
+    id = serializers.IntegerField(source='conversation_id', read_only=True)
+    # annotated by ConversationsView
+    last_message_timestamp = serializers.DateTimeField(read_only=True, default=None)
+    last_message = serializers.CharField(read_only=True, default=None)
 
     class Meta:
         model = UserConversation
-        fields = ['id', 'title', 'count_unread']
-
-    def get_conversation_id(self, obj):
-        return obj.conversation.pk
+        fields = ['id', 'title', 'count_unread', 'last_message_timestamp', 'last_message']
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -32,10 +41,74 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['content', 'timestamp', 'author']
+        fields = ['content', 'timestamp', 'author', 'sequence']
 
 
 class FriendRequestsSerializer(serializers.ModelSerializer):
     class Meta:
         model = FriendRequest
         fields = ['id', 'sender_name', 'timestamp']
+
+
+# Read-only serializers of hot paths. They give the same dicts as the ModelSerializers above, built from
+# .values() rows of one query (authors joined) without running DRF fields for every row.
+
+_datetime_field = serializers.DateTimeField()
+
+MESSAGE_VALUES = ('pk', 'content', 'timestamp', 'sequence', 'author_id', 'author__username')
+
+
+def format_datetime(value):
+    """ like DateTimeField of DRF: ISO 8601 in current time zone, UTC as 'Z' """
+    return _datetime_field.to_representation(value)
+
+
+def message_values(messages, *fields):
+    """ rows of the messages queryset with what serialize_message_row needs, and 'fields' """
+    return messages.values(*MESSAGE_VALUES, *fields)
+
+
+def serialize_message_row(row):
+    return {
+        'content': row['content'],
+        'timestamp': format_datetime(row['timestamp']),
+        'author': {'id': row['author_id'], 'username': row['author__username']},
+        'sequence': row['sequence'],
+    }
+
+
+def serialize_message(message):
+    """ MessageSerializer(message).data of a message whose author is loaded already """
+    return {
+        'content': message.content,
+        'timestamp': format_datetime(message.timestamp),
+        'author': {'id': message.author_id, 'username': message.author.username},
+        'sequence': message.sequence,
+    }
+
+
+def serialize_messages(messages):
+    """ MessageSerializer(messages, many=True).data of a messages queryset """
+    return [serialize_message_row(row) for row in message_values(messages)]
+
+
+def serialize_users(users):
+    """ UserSerializer(users, many=True).data of a users queryset """
+    return list(users.values('id', 'username'))
+
+
+def serialize_friends(user):
+    """ UserSerializer of friends of user """
+    return serialize_users(User.objects.filter(contacts__user=user))
+
+
+def serialize_contact(user):
+    """ ContactSerializer(user.contact.get()).data """
+    return {'user': user.pk, 'friends': serialize_friends(user)}
+
+
+def serialize_friend_requests(user):
+    """ FriendRequestsSerializer of friend requests sent to user, newest first """
+    requests = FriendRequest.objects.filter(user__user=user).order_by('-timestamp')
+    return [{'id': pk, 'sender_name': sender_name, 'timestamp': format_datetime(timestamp)}
+            for pk, sender_name, timestamp in requests.values_list('id', 'sender_name', 'timestamp')]
@@ -1,3 +1,849 @@
-from django.test import TestCase
+import base64
+import importlib.util
+import json
+import os
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.parse import quote
 
-# Create your tests here.
+import brotli
+import msgpack
+import orjson
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import metrics, serializers, versions
+from .authentication import get_token, token_cache
+from .channel_layers import ShardedRedisChannelLayer
+from .consumers import ChatConsumer, conversation_group_name
+from .message_cache import message_cache
+from .middleware import accepted_encoding
+from .models import User, Contact, Notifications, Conversation, Message, UserConversation
+from .renderers import ORJSONRenderer
+from .views import SyncView
+from . import wire
+from .utils import create_new_conversation, add_user_to_conversation, create_message, create_friend_request, \
+    accept_friend, mark_conversation_read
+
+
+def create_user(username):
+    user = User.objects.create(username=username)
+    Contact.objects.create(user=user)
+    Notifications.objects.create(user=user)
+    return user
+
+
+# project settings keep shared state in redis, tests use in-process stand-ins
+local_services = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    MAILBOX={'BACKEND': 'chat.mailbox.LocalMailbox'},
+    MESSAGE_CACHE={'BACKEND': 'chat.message_cache.LocalMessageCache'},
+)
+
+
+@local_services
+class ConversationsViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.friend = create_user('friend')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_conversations(self, count):
+        for i in range(count):
+            conversation = create_new_conversation(f'conversation {i}', self.friend, False)
+            add_user_to_conversation(self.user, conversation)
+            create_message(self.friend, conversation, f'message {i}')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/chat/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data['content']
+
+    def test_query_count_does_not_depend_on_conversation_count(self):
+        self.create_conversations(1)
+        queries_one, _ = self.count_queries()
+        self.create_conversations(10)
+        queries_many, content = self.count_queries()
+        self.assertEqual(len(content), 11)
+        self.assertEqual(queries_one, queries_many)
+
+    def test_conversations_are_ordered_by_last_message(self):
+        self.create_conversations(3)
+        _, content = self.count_queries()
+        self.assertEqual([c['title'] for c in content], ['conversation 2', 'conversation 1', 'conversation 0'])
+        self.assertEqual(content[0]['last_message'], 'message 2')
+        self.assertEqual(content[0]['count_unread'], 1)
+
+
+@local_services
+class SyncViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.friend = create_user('friend')
+        self.user.contact.get().friends.add(self.friend)
+        self.conversation = create_new_conversation('user, friend', self.friend)
+        add_user_to_conversation(self.user, self.conversation)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_returns_conversations_messages_and_friends(self):
+        create_message(self.friend, self.conversation, 'hello')
+        content = self.client.get('/chat/sync/').data['content']
+        self.assertEqual([c['id'] for c in content['conversations']], [self.conversation.pk])
+        self.assertEqual(content['conversations'][0]['count_unread'], 1)
+        self.assertEqual([m['content'] for m in content['messages'][str(self.conversation.pk)]], ['hello'])
+        self.assertEqual([f['username'] for f in content['friends']], ['friend'])
+        self.assertEqual(content['notifications'], [])
+        # orjson takes string keys only, the response must not fall back to JSONRenderer
+        orjson.dumps(content, default=ORJSONRenderer.default, option=ORJSONRenderer.options)
+
+    def test_messages_of_all_conversations_are_read_in_one_query(self):
+        def sync_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/chat/sync/', {'count': 2})
+            return response, len(queries)
+
+        for i in range(3):
+            create_message(self.friend, self.conversation, f'message {i}')
+        response, queries = sync_queries()
+        self.assertEqual([m['content'] for m in response.data['content']['messages'][str(self.conversation.pk)]],
+                         ['message 2', 'message 1'])
+        for i in range(10):
+            conversation = create_new_conversation(f'conversation {i}', self.friend)
+            add_user_to_conversation(self.user, conversation)
+            create_message(self.friend, conversation, 'hello')
+        response, more_conversations_queries = sync_queries()
+        self.assertEqual(len(response.data['content']['messages']), 11)
+        self.assertEqual(more_conversations_queries, queries)
+
+    def test_invalid_count_is_rejected(self):
+        self.assertEqual(self.client.get('/chat/sync/', {'count': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/chat/sync/', {'count': 0}).status_code, 400)
+
+    def sync_since(self, watermark):
+        return self.client.get('/chat/sync/', {'since': watermark}).data['content']
+
+    def test_since_returns_only_changes(self):
+        create_message(self.friend, self.conversation, 'old')
+        # the conversation was joined just now, its read state would be sent again within the overlap
+        with mock.patch.object(SyncView, 'read_overlap', timedelta(0)):
+            watermark = self.client.get('/chat/sync/').data['content']['watermark']
+        content = self.sync_since(watermark)
+        self.assertEqual(content['conversations'], [])
+        self.assertEqual(content['messages'], {})
+
+        create_message(self.friend, self.conversation, 'new')
+        content = self.sync_since(watermark)
+        self.assertEqual([m['content'] for m in content['messages'][str(self.conversation.pk)]], ['new'])
+
+    def test_since_returns_messages_committed_late(self):
+        watermark = self.client.get('/chat/sync/').data['content']['watermark']
+        # its transaction began, and took the timestamp, before the previous sync
+        message = create_message(self.friend, self.conversation, 'late')
+        Message.objects.filter(pk=message.pk).update(timestamp=timezone.now() - timedelta(hours=1))
+        content = self.sync_since(watermark)
+        self.assertEqual([m['content'] for m in content['messages'][str(self.conversation.pk)]], ['late'])
+        self.assertEqual(self.sync_since(content['watermark'])['messages'], {})
+
+    def test_since_returns_new_and_read_conversations(self):
+        create_message(self.friend, self.conversation, 'hello')
+        watermark = self.client.get('/chat/sync/').data['content']['watermark']
+        conversation = create_new_conversation('new', self.friend)
+        add_user_to_conversation(self.user, conversation)
+        mark_conversation_read(self.user, self.conversation.pk)
+        content = self.sync_since(watermark)
+        self.assertEqual({c['id'] for c in content['conversations']}, {self.conversation.pk, conversation.pk})
+        self.assertEqual(content['messages'], {})
+
+    def test_invalid_since_is_rejected(self):
+        for since in ['2020-01-01T00:00:00', 'abc', '']:
+            self.assertEqual(self.client.get('/chat/sync/', {'since': since}).status_code, 400)
+
+
+@local_services
+class LocalTokenCacheTests(TestCase):
+    token_cache = {'BACKEND': 'chat.authentication.LocalTokenCache', 'TTL': 300, 'MAX_SIZE': 100}
+
+    def setUp(self):
+        settings = self.settings(TOKEN_CACHE=self.token_cache)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = create_user('user')
+        self.user.set_password('old password')
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+
+    def test_cached_token_is_read_without_queries(self):
+        with self.assertNumQueries(1):
+            get_token(self.token.key)
+        with self.assertNumQueries(0):
+            first = get_token(self.token.key)
+            second = get_token(self.token.key)
+        self.assertEqual(first.user, self.user)
+        # requests never share a User they may change
+        self.assertIsNot(first.user, second.user)
+
+    def test_expired_token_is_read_again(self):
+        with self.settings(TOKEN_CACHE={**self.token_cache, 'TTL': 0}):
+            get_token(self.token.key)
+            with self.assertNumQueries(1):
+                get_token(self.token.key)
+
+    def test_deleted_token_is_rejected(self):
+        get_token(self.token.key)
+        self.token.delete()
+        with self.assertRaises(Token.DoesNotExist):
+            get_token(self.token.key)
+
+    def test_password_change_drops_cached_tokens_of_user(self):
+        other = Token.objects.create(user=create_user('other'))
+        get_token(self.token.key)
+        get_token(other.key)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertTrue(client.post('/chat/password/change/', {'new_passw': 'new password'}).data['content'])
+
+        with self.assertNumQueries(1):
+            self.assertTrue(get_token(self.token.key).user.check_password('new password'))
+        with self.assertNumQueries(0):
+            get_token(other.key)
+
+
+class SharedTokenCacheTests(LocalTokenCacheTests):
+    token_cache = {'BACKEND': 'chat.authentication.SharedTokenCache', 'TTL': 300}
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(token_cache().cache.clear)
+
+
+@local_services
+class ConditionalGetTests(TransactionTestCase):
+    # versions change when transactions commit
+    def setUp(self):
+        self.addCleanup(versions.versions().cache.clear)
+        self.user = create_user('user')
+        self.friend = create_user('friend')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertNotModified(self, path, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def assertModified(self, path, etag):
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_versions_are_shared_between_processes(self):
+        # a change seen by one process must not leave another answering 304 with its old version
+        first, second = versions.SharedVersions(ttl=60), versions.SharedVersions(ttl=60)
+        version = first.get(self.user.pk, versions.CONTACTS)
+        self.assertEqual(second.get(self.user.pk, versions.CONTACTS), version)
+        second.forget([self.user.pk], versions.CONTACTS)
+        self.assertNotEqual(first.get(self.user.pk, versions.CONTACTS), version)
+
+    def test_friend_request_changes_notifications_then_contacts(self):
+        contacts = self.client.get('/chat/contacts/')['ETag']
+        notifications = self.client.get('/chat/notifications/')['ETag']
+        self.assertNotModified('/chat/contacts/', contacts)
+        self.assertNotModified('/chat/notifications/', notifications)
+
+        request = create_friend_request(self.user.notifications.get(), self.friend)
+        self.assertNotModified('/chat/contacts/', contacts)
+        notifications = self.assertModified('/chat/notifications/', notifications)
+
+        accept_friend(self.user, self.friend, request)
+        self.assertModified('/chat/contacts/', contacts)
+        self.assertModified('/chat/notifications/', notifications)
+
+    def test_messages_change_conversations_of_all_participants(self):
+        conversation = create_new_conversation('user, friend', self.user)
+        add_user_to_conversation(self.friend, conversation)
+        etag = self.client.get('/chat/conversations/')['ETag']
+        self.assertNotModified('/chat/conversations/', etag)
+
+        create_message(self.friend, conversation, 'hello')
+        etag = self.assertModified('/chat/conversations/', etag)
+        mark_conversation_read(self.user, conversation.pk)
+        self.assertModified('/chat/conversations/', etag)
+
+
+@local_services
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.conversation = create_new_conversation('conversation', self.user)
+        for i in range(3):
+            friend = create_user(f'friend{i}')
+            self.user.contact.get().friends.add(friend)
+            create_friend_request(self.user.notifications.get(), friend)
+            create_message(friend, self.conversation, f'message {i}')
+
+    def test_same_output_as_model_serializers(self):
+        messages = self.conversation.get_newest_messages(10)
+        self.assertEqual(serializers.serialize_messages(messages),
+                         serializers.MessageSerializer(messages, many=True).data)
+        self.assertEqual(serializers.serialize_message(messages[0]),
+                         serializers.MessageSerializer(messages[0]).data)
+        self.assertEqual(serializers.serialize_contact(self.user),
+                         serializers.ContactSerializer(self.user.contact.get()).data)
+        self.assertEqual(serializers.serialize_friend_requests(self.user),
+                         serializers.FriendRequestsSerializer(
+                             self.user.notifications.get().get_all_notifications(), many=True).data)
+
+    def test_one_query_for_a_page_of_messages(self):
+        with self.assertNumQueries(1):
+            serializers.serialize_messages(self.conversation.get_last_messages(0, 10))
+
+
+@local_services
+class RenderingTests(TestCase):
+    def test_orjson_renderer_output_matches_json_renderer(self):
+        data = {'timestamp': timezone.now(), 'content': 'zażółć \u2028 ✓', 'sequence': 3, 'author': None,
+                'dh_key': 3 ** 200}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        del data['dh_key']
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_accepted_encoding(self):
+        self.assertEqual(accepted_encoding('gzip, deflate, br'), 'br')
+        self.assertEqual(accepted_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(accepted_encoding('br;q=0, *'), 'gzip')
+        self.assertIsNone(accepted_encoding('deflate'))
+        self.assertIsNone(accepted_encoding(''))
+
+    def test_long_responses_are_compressed(self):
+        user = create_user('user')
+        for i in range(100):
+            user.contact.get().friends.add(create_user(f'friend{i}'))
+        client = APIClient()
+        client.force_authenticate(user)
+        plain = client.get('/chat/contacts/')
+        self.assertNotIn('Content-Encoding', plain)
+        compressed = client.get('/chat/contacts/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(compressed.content), plain.content)
+        self.assertEqual(compressed['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(client.get('/chat/contacts/', HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 304)
+        short = client.get('/chat/notifications/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', short)
+
+
+@local_services
+class SearchViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        for username in ['annabel', 'hanna', 'anna', 'bob', 'joanna', 'Ann']:
+            create_user(username)
+        self.user.contact.get().friends.add(User.objects.get(username='hanna'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, key, **params):
+        response = self.client.get('/chat/search/', dict(params, key=key))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_exact_then_prefix_then_substring_matches(self):
+        content = self.search('anna')['content']
+        self.assertEqual([u['username'] for u in content], ['anna', 'annabel', 'hanna', 'joanna'])
+        self.assertEqual([u['is_friend'] for u in content], [False, False, True, False])
+
+    def test_short_key_matches_username_prefix(self):
+        content = self.search('AN')['content']
+        self.assertEqual([u['username'] for u in content], ['Ann', 'anna', 'annabel'])
+
+    def test_limit_and_offset(self):
+        data = self.search('ann', limit=2, offset=1)
+        self.assertEqual([u['username'] for u in data['content']], ['anna', 'annabel'])
+        self.assertTrue(data['has_more'])
+        self.assertFalse(self.search('ann', limit=2, offset=3)['has_more'])
+
+    def test_renamed_user_is_found_by_new_name(self):
+        user = User.objects.get(username='bob')
+        user.username = 'robert'
+        user.save()
+        self.assertEqual([u['username'] for u in self.search('bob')['content']], [])
+        self.assertEqual([u['username'] for u in self.search('rob')['content']], ['robert'])
+
+    def test_accepting_a_friend_does_not_reindex_usernames(self):
+        bob = User.objects.get(username='bob')
+        request = create_friend_request(self.user.notifications.get(), bob)
+        with CaptureQueriesContext(connection) as queries:
+            accept_friend(self.user, bob, request)
+        self.assertFalse([query for query in queries if 'usernamegram' in query['sql'].lower()])
+        self.assertTrue(self.search('bob')['content'][0]['is_friend'])
+
+
+@local_services
+class MessageCacheTests(TransactionTestCase):
+    # messages are cached when their transaction commits
+    backend = 'chat.message_cache.LocalMessageCache'
+
+    def setUp(self):
+        # every test starts with an empty cache, conversation pks are reused after tables are flushed
+        cache_settings = override_settings(MESSAGE_CACHE={'BACKEND': self.backend, 'SIZE': 5})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.user = create_user('user')
+        self.conversation = create_new_conversation('conversation', self.user)
+        add_user_to_conversation(self.user, self.conversation)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_messages(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/chat/messages/{self.conversation.pk}', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_invalid_requests_are_rejected(self):
+        create_message(self.user, self.conversation, 'message')
+        path = f'/chat/messages/{self.conversation.pk}'
+        for params in ({'count': 'abc'}, {'count': -1}, {'count': 0}, {'count': -1, 'before': 'abc'}):
+            self.assertEqual(self.client.get(path, params).status_code, 400, params)
+        self.assertEqual(self.client.get(f'/chat/messages/{self.conversation.pk + 1}').status_code, 404)
+
+    def test_newest_page_is_served_from_cache(self):
+        for i in range(7):
+            create_message(self.user, self.conversation, f'message {i}')
+        hits = metrics.message_cache_requests.values.get(('hit',), 0)
+
+        data, queries = self.get_messages(count=3)
+        self.assertEqual([m['content'] for m in data['content']], ['message 6', 'message 5', 'message 4'])
+        self.assertTrue(data['has_more'])
+        self.assertEqual(queries, 1)  # the conversation
+        self.assertEqual(metrics.message_cache_requests.values[('hit',)], hits + 1)
+
+        older, _ = self.get_messages(count=3, before=data['before'])
+        self.assertEqual([m['content'] for m in older['content']], ['message 3', 'message 2', 'message 1'])
+
+    def test_pages_beyond_cached_window_are_read_from_database(self):
+        for i in range(7):
+            create_message(self.user, self.conversation, f'message {i}')
+        misses = metrics.message_cache_requests.values.get(('miss',), 0)
+
+        data, _ = self.get_messages(count=7)
+        self.assertEqual([m['content'] for m in data['content']], [f'message {i}' for i in range(6, -1, -1)])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(metrics.message_cache_requests.values[('miss',)], misses + 1)
+
+    def test_messages_missing_in_cache_are_read_from_database(self):
+        create_message(self.user, self.conversation, 'cached')
+        # stored by another node, never cached here
+        Conversation.objects.filter(pk=self.conversation.pk).update(last_sequence=2)
+        Message.objects.create(author=self.user, conversation=self.conversation, content='not cached', sequence=2)
+
+        data, _ = self.get_messages(count=2)
+        self.assertEqual([m['content'] for m in data['content']], ['not cached', 'cached'])
+        # the database read filled the cache
+        data, queries = self.get_messages(count=2)
+        self.assertEqual([m['content'] for m in data['content']], ['not cached', 'cached'])
+        self.assertEqual(queries, 1)
+
+
+class SharedMessageCacheTests(MessageCacheTests):
+    backend = 'chat.message_cache.SharedMessageCache'
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(message_cache().cache.clear)
+
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   MAILBOX={'BACKEND': 'chat.mailbox.LocalMailbox'})
+class ShardedChannelLayerTests(SimpleTestCase):
+    groups = [f'chat_{pk}' for pk in range(10000)]
+
+    def placement(self, hosts):
+        layer = ShardedRedisChannelLayer(hosts=hosts)
+        return {group: layer.hosts[layer.consistent_hash(group)]['address'] for group in self.groups}
+
+    def test_adding_a_host_moves_only_groups_it_takes(self):
+        hosts = [('redis1', 6379), ('redis2', 6379), ('redis3', 6379)]
+        before = self.placement(hosts)
+        after = self.placement(hosts + [('redis4', 6379)])
+        moved = [group for group in self.groups if before[group] != after[group]]
+        self.assertTrue(all(after[group] == ('redis4', 6379) for group in moved))
+        self.assertLess(len(moved), len(self.groups) * 0.35)
+        # removing it again puts every group back
+        self.assertEqual(self.placement(hosts), before)
+
+    def test_process_channel_is_sent_and_received_on_one_host(self):
+        layer = ShardedRedisChannelLayer(hosts=[f'redis://redis{index}:6379' for index in range(8)])
+        for client in range(100):
+            channel = f'specific.client{client}!'
+            self.assertEqual(layer.consistent_hash(channel + 'socket'), layer.consistent_hash(channel))
+
+
+CLIENT_WIRE = os.path.join(os.path.dirname(settings.BASE_DIR), 'Frontend', 'Main', 'GuiClasses', 'wire.py')
+
+
+class WireTests(SimpleTestCase):
+    event = {
+        'type': 'key_response',
+        'conversation_id': 3,
+        'dh_key': str(3 ** 200),
+        'flag': '-17843',
+        'rsa_key': {'n': str(7 ** 300), 'e': '65537'},
+        'content': wire.AES_PREFIX + base64.b64encode(bytes(range(256))).decode(),
+    }
+
+    def test_json_round_trip(self):
+        self.assertEqual(wire.decode_json(wire.encode_json(self.event)), self.event)
+
+    def test_msgpack_round_trip(self):
+        frame = wire.encode_msgpack(self.event)
+        self.assertIsInstance(frame, bytes)
+        self.assertLess(len(frame), len(wire.encode_json(self.event)))
+        # integer fields come as integers, everything else as JSON has it
+        self.assertEqual(wire.decode_msgpack(frame), dict(self.event, dh_key=3 ** 200, flag=-17843))
+        # only parts of the key go as integers
+        key = {'n': str(7 ** 300), 'version': '2'}
+        self.assertEqual(msgpack.unpackb(wire.encode_msgpack({'rsa_key': key}), raw=False,
+                                         ext_hook=wire.unpack_ext)['rsa_key'], {'n': 7 ** 300, 'version': '2'})
+        plain = {'type': 'message', 'content': 'not encrypted', 'conversation_id': 1}
+        self.assertEqual(wire.decode_msgpack(wire.encode_msgpack(plain)), plain)
+
+    def test_select_protocol(self):
+        self.assertEqual(wire.select_protocol([wire.MSGPACK_PROTOCOL, wire.JSON_PROTOCOL]), wire.MSGPACK_PROTOCOL)
+        self.assertEqual(wire.select_protocol(['justchat.unknown', wire.JSON_PROTOCOL]), wire.JSON_PROTOCOL)
+        self.assertIsNone(wire.select_protocol(['justchat.unknown']))
+        self.assertIsNone(wire.select_protocol([]))
+
+    @skipUnless(os.path.exists(CLIENT_WIRE), 'client is not checked out')
+    def test_client_codec_speaks_server_codec(self):
+        spec = importlib.util.spec_from_file_location('client_wire', CLIENT_WIRE)
+        client_wire = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(client_wire)
+
+        self.assertEqual(wire.select_protocol(client_wire.offered_protocols()), wire.MSGPACK_PROTOCOL)
+        self.assertEqual(wire.decode_msgpack(client_wire.encode_msgpack(self.event)),
+                         client_wire.decode_msgpack(wire.encode_msgpack(self.event)))
+
+
+@local_services
+class ConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user('user')
+        self.friend = create_user('friend')
+        self.tokens = {user: Token.objects.create(user=user).key for user in (self.user, self.friend)}
+
+    async def connect(self, user, query='', subprotocols=None, subprotocol=None):
+        """ connected communicator of the user, which asked for 'subprotocols' and got 'subprotocol' """
+        communicator = WebsocketCommunicator(ChatConsumer, '/ws/chat/' + query,
+                                             headers=[(b'authorization', f'Token {self.tokens[user]}'.encode())],
+                                             subprotocols=subprotocols)
+        connected, accepted = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(accepted, subprotocol)
+        return communicator
+
+
+class MailboxTests(ConsumerTestCase):
+    async def invite_friend(self):
+        communicator = await self.connect(self.user)
+        await communicator.send_json_to({'type': 'invite_friend', 'friend_id': self.friend.pk})
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_events_sent_while_offline_are_replayed_on_connect(self):
+        await self.invite_friend()
+        communicator = await self.connect(self.friend)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'friend_request')
+        self.assertEqual(event['sender'], 'user')
+        self.assertIn('mailbox_id', event)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_acked_events_are_not_replayed(self):
+        await self.invite_friend()
+        communicator = await self.connect(self.friend)
+        event = await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'ack', 'mailbox_id': event['mailbox_id']})
+        await communicator.disconnect()
+
+        communicator = await self.connect(self.friend)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_malformed_ids_are_ignored(self):
+        await self.invite_friend()
+        communicator = await self.connect(self.friend)
+        event = await communicator.receive_json_from()
+        for mailbox_id in ('garbage', '1-2-3', None, 12):
+            await communicator.send_json_to({'type': 'ack', 'mailbox_id': mailbox_id})
+        await communicator.disconnect()
+
+        # nothing was acked, the event comes again
+        communicator = await self.connect(self.friend, '?last_id=garbage')
+        self.assertEqual((await communicator.receive_json_from())['mailbox_id'], event['mailbox_id'])
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_replay_starts_after_last_id(self):
+        await self.invite_friend()
+        communicator = await self.connect(self.friend)
+        first = await communicator.receive_json_from()
+        await communicator.disconnect()
+        await self.invite_friend()
+
+        communicator = await self.connect(self.friend, '?last_id=' + first['mailbox_id'])
+        event = await communicator.receive_json_from()
+        self.assertNotEqual(event['mailbox_id'], first['mailbox_id'])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class MessageSequenceTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = create_new_conversation('user, friend', self.user)
+        add_user_to_conversation(self.friend, self.conversation)
+
+    def test_messages_are_numbered_in_conversation(self):
+        other = create_new_conversation('other', self.user)
+        sequences = [create_message(self.user, self.conversation, 'a').sequence,
+                     create_message(self.friend, self.conversation, 'b').sequence,
+                     create_message(self.user, other, 'c').sequence]
+        self.assertEqual(sequences, [1, 2, 1])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_sequence, 2)
+
+    @async_to_sync
+    async def test_resume_sends_missed_messages_before_live_ones(self):
+        for content in ('seen', 'missed 1', 'missed 2'):
+            await database_sync_to_async(create_message)(self.friend, self.conversation, content)
+
+        resume = quote(json.dumps({self.conversation.pk: 1}))
+        communicator = await self.connect(self.user, '?resume=' + resume)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'missed_messages')
+        self.assertEqual([m['content'] for m in event['messages']], ['missed 2', 'missed 1'])
+        self.assertFalse(event['has_more'])
+
+        await communicator.send_json_to({'type': 'message', 'content': 'live',
+                                         'conversation_id': self.conversation.pk})
+        event = await communicator.receive_json_from()
+        self.assertEqual((event['type'], event['content'], event['sequence']), ('new_message', 'live', 4))
+        await communicator.disconnect()
+
+
+class UnreadCounterTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.third = create_user('third')
+        self.conversation = create_new_conversation('group', self.user, False)
+        for member in (self.friend, self.third):
+            add_user_to_conversation(member, self.conversation)
+
+    def unread(self):
+        return dict(UserConversation.objects.filter(conversation=self.conversation)
+                    .values_list('user__username', 'unread_count'))
+
+    def test_message_is_unread_for_everyone_but_its_author(self):
+        create_message(self.user, self.conversation, 'first')
+        create_message(self.user, self.conversation, 'second')
+        create_message(self.friend, self.conversation, 'third')
+        self.assertEqual(self.unread(), {'user': 1, 'friend': 2, 'third': 3})
+
+    @async_to_sync
+    async def test_mark_read_resets_only_the_callers_counter(self):
+        for author in (self.user, self.third):
+            await database_sync_to_async(create_message)(author, self.conversation, 'hi')
+        communicator = await self.connect(self.friend)
+        await communicator.send_json_to({'type': 'mark_read', 'conversation_id': self.conversation.pk})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        self.assertEqual(await database_sync_to_async(self.unread)(), {'user': 1, 'friend': 0, 'third': 1})
+
+
+class ConversationGroupTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stranger = create_user('stranger')
+        self.tokens[self.stranger] = Token.objects.create(user=self.stranger).key
+        self.conversation = create_new_conversation('user, friend', self.user)
+        add_user_to_conversation(self.friend, self.conversation)
+
+    def group_size(self, conversation_id):
+        return len(get_channel_layer().groups.get(conversation_group_name(conversation_id), {}))
+
+    async def receive_type(self, communicator, event_type):
+        """ next frame of the type, frames before it are skipped """
+        while True:
+            event = await communicator.receive_json_from()
+            if event['type'] == event_type:
+                return event
+
+    @async_to_sync
+    async def test_only_members_join_conversation_group(self):
+        user, friend, stranger = [await self.connect(member) for member in (self.user, self.friend, self.stranger)]
+        self.assertEqual(self.group_size(self.conversation.pk), 2)
+
+        await stranger.send_json_to({'type': 'join_conversation', 'conversation_id': self.conversation.pk})
+        self.assertTrue(await stranger.receive_nothing())
+        self.assertEqual(self.group_size(self.conversation.pk), 2)
+
+        await user.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': self.conversation.pk})
+        self.assertEqual((await self.receive_type(friend, 'new_message'))['content'], 'hi')
+        self.assertTrue(await stranger.receive_nothing())
+        for communicator in (user, friend, stranger):
+            await communicator.disconnect()
+
+    @async_to_sync
+    async def test_message_is_published_once_to_conversation_group(self):
+        await database_sync_to_async(add_user_to_conversation)(self.stranger, self.conversation)
+        user, friend, stranger = [await self.connect(member) for member in (self.user, self.friend, self.stranger)]
+        layer = get_channel_layer()
+        sent = []
+        group_send = layer.group_send
+
+        async def record(group, message):
+            sent.append((group, message['type']))
+            await group_send(group, message)
+
+        with mock.patch.object(layer, 'group_send', record):
+            await user.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': self.conversation.pk})
+            for communicator in (user, friend, stranger):
+                self.assertEqual((await communicator.receive_json_from())['content'], 'hi')
+        self.assertEqual(sent, [(conversation_group_name(self.conversation.pk), 'message')])
+        for communicator in (user, friend, stranger):
+            await communicator.disconnect()
+
+    @async_to_sync
+    async def test_accepted_friend_joins_new_conversation_group(self):
+        user, friend = await self.connect(self.user), await self.connect(self.stranger)
+        await user.send_json_to({'type': 'invite_friend', 'friend_id': self.stranger.pk})
+        invite = await self.receive_type(friend, 'friend_request')
+        await friend.send_json_to({'type': 'response_friend_req', 'id': invite['request_id'], 'response': 'True'})
+        # the one who accepted is the admin of the conversation
+        conversation_id = (await self.receive_type(friend, 'new_conversation'))['conversation_id']
+        await self.receive_type(user, 'response_f_request')
+        # joining is an event after new_conversation, let the friend's socket handle it
+        await friend.receive_nothing()
+
+        await user.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': conversation_id})
+        self.assertEqual((await self.receive_type(friend, 'new_message'))['content'], 'hi')
+        self.assertEqual(self.group_size(conversation_id), 2)
+        await user.disconnect()
+        await friend.disconnect()
+
+    @async_to_sync
+    async def test_created_group_members_join_its_conversation_group(self):
+        user, friend, stranger = [await self.connect(member) for member in (self.user, self.friend, self.stranger)]
+        await user.send_json_to({'type': 'create_group', 'title': 'group', 'admin_id': self.user.pk,
+                                 'users_ids': [self.friend.pk, self.stranger.pk]})
+        conversation_id = (await self.receive_type(user, 'new_conversation'))['conversation_id']
+        for communicator in (friend, stranger):
+            await self.receive_type(communicator, 'create_group_notify')
+        self.assertEqual(self.group_size(conversation_id), 3)
+
+        await friend.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': conversation_id})
+        for communicator in (user, stranger):
+            self.assertEqual((await self.receive_type(communicator, 'new_message'))['content'], 'hi')
+        for communicator in (user, friend, stranger):
+            await communicator.disconnect()
+
+
+class WireProtocolTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = create_new_conversation('user, friend', self.user)
+        add_user_to_conversation(self.friend, self.conversation)
+
+    @async_to_sync
+    async def test_msgpack_subprotocol_gets_binary_frames(self):
+        communicator = await self.connect(self.user, subprotocols=[wire.MSGPACK_PROTOCOL, wire.JSON_PROTOCOL],
+                                          subprotocol=wire.MSGPACK_PROTOCOL)
+        content = wire.AES_PREFIX + base64.b64encode(b'ciphertext').decode()
+        await communicator.send_to(bytes_data=wire.encode_msgpack(
+            {'type': 'message', 'content': content, 'conversation_id': self.conversation.pk}))
+        frame = await communicator.receive_from()
+        self.assertIsInstance(frame, bytes)
+        event = wire.decode_msgpack(frame)
+        self.assertEqual((event['type'], event['content']), ('new_message', content))
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_unknown_subprotocol_falls_back_to_json(self):
+        communicator = await self.connect(self.user, subprotocols=['justchat.unknown'])
+        await communicator.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': self.conversation.pk})
+        event = json.loads(await communicator.receive_from())
+        self.assertEqual((event['type'], event['content']), ('new_message', 'hi'))
+        await communicator.disconnect()
+
+
+class MetricsTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = create_new_conversation('user, friend', self.user)
+        add_user_to_conversation(self.friend, self.conversation)
+
+    @async_to_sync
+    async def test_socket_events_are_counted_with_their_queries(self):
+        sent = metrics.inbound_events.values.get(('message',), 0)
+        delivered = metrics.outbound_events.values.get(('message',), 0)
+        queries = metrics.event_queries.values.get(('message',), [None, 0, 0])[1]
+        connections = metrics.open_connections.values[()]
+
+        communicator = await self.connect(self.user)
+        self.assertEqual(metrics.open_connections.values[()], connections + 1)
+        await communicator.send_json_to({'type': 'message', 'content': 'hi', 'conversation_id': self.conversation.pk})
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'no_such_event'})
+        await communicator.disconnect()
+
+        self.assertEqual(metrics.inbound_events.values[('message',)], sent + 1)
+        self.assertEqual(metrics.outbound_events.values[('message',)], delivered + 1)
+        self.assertGreater(metrics.event_queries.values[('message',)][1], queries)
+        self.assertEqual(metrics.open_connections.values[()], connections)
+
+    def test_metrics_endpoint(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE chat_inbound_event_seconds histogram', body)
+        self.assertIn('chat_channel_layer_queue_depth{location="local"} 0', body)
+
+    @override_settings(METRICS={'ALLOWED_NETWORKS': ['10.0.0.0/8'], 'TOKEN': 'scraper'})
+    def test_metrics_endpoint_is_internal(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7',
+                                         HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7',
+                                         HTTP_AUTHORIZATION='Bearer guess').status_code, 403)
+
+    @override_settings(METRICS={'DEPTH_INTERVAL': 60})
+    def test_queue_depth_is_measured_once_per_interval(self):
+        layer = get_channel_layer()
+        self.assertEqual(metrics.collect_channel_layer_depth(), {('local',): 0})
+        async_to_sync(layer.send)('metrics.test', {'type': 'test'})
+        self.assertEqual(metrics.collect_channel_layer_depth(), {('local',): 0})
+        with self.settings(METRICS={'DEPTH_INTERVAL': 0}):
+            self.assertEqual(metrics.collect_channel_layer_depth(), {('local',): 1})
+        async_to_sync(layer.flush)()
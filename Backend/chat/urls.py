@@ -28,6 +28,7 @@ urlpatterns = [
    path('contacts/', views.ContactsView.as_view(), name='contacts'),
    path('conversations/',views.ConversationsView.as_view(), name='conversations'),
    path('messages/<pk>', views.ConversationMessagesView.as_view(), name='messages'),
+   path('sync/', views.SyncView.as_view(), name='sync'),
    path('search/', views.SearchView.as_view(), name='search'),
    path('notifications/', views.NotificationsView.as_view(), name='notifications'),
    path('friends/remove/', views.ContactsView.as_view(), name='remove_friend'),
@@ -1,25 +1,59 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from .models import *
+from .message_cache import message_cache, cached_messages
+from .versions import changed, CONTACTS, CONVERSATIONS, NOTIFICATIONS
+
+logger = logging.getLogger(__name__)
 
 
 def create_message(author, conversation, content):
     try:
-        new_message = Message.objects.create(author=author, content=content, conversation=conversation)
-
-        for participant in conversation.participants.all():
-            userConversation = UserConversation.objects.get(user=participant, conversation=conversation)
-            userConversation.unread = True
-        new_message.save()
+        with transaction.atomic():
+            # UPDATE locks the conversation row until commit, so concurrent senders get consecutive sequences
+            Conversation.objects.filter(pk=conversation.pk).update(last_sequence=F('last_sequence') + 1)
+            sequence = Conversation.objects.values_list('last_sequence', flat=True).get(pk=conversation.pk)
+            new_message = Message.objects.create(author=author, content=content, conversation=conversation,
+                                                 sequence=sequence)
+
+            # one UPDATE for all other participants, counters are incremented in the database
+            UserConversation.objects.filter(conversation=conversation).exclude(user=author).update(
+                unread=True, unread_count=F('unread_count') + 1)
+            # last message (and unread count of the others) changed on conversation lists of all participants
+            changed(CONVERSATIONS, *UserConversation.objects.filter(conversation=conversation)
+                    .values_list('user_id', flat=True))
+            # write-through, a rolled back message never gets cached
+            transaction.on_commit(lambda: cache_message(conversation.pk, new_message))
+        conversation.last_sequence = sequence
         return new_message
 
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('storing a message failed')
         return None
 
 
+def cache_message(conversation_id, message):
+    # message is stored already, failing cache only costs a database read later
+    try:
+        message_cache().add(conversation_id, cached_messages([message]))
+    except Exception:
+        logger.exception('caching a message failed')
+
+
+def mark_conversation_read(user, conversation_id):
+    UserConversation.objects.filter(user=user, conversation_id=conversation_id).update(
+        unread=False, unread_count=0, last_read_timestamp=timezone.now())
+    changed(CONVERSATIONS, user.pk)
+
+
 def add_user_to_conversation(user, conversation):
     conversation.participants.add(user)
     user_conversation = UserConversation.objects.get_or_create(user=user, conversation=conversation)
     conversation.save()
+    changed(CONVERSATIONS, user.pk)
     return user_conversation[0]
 
 
@@ -29,11 +63,12 @@ def create_friend_request(notifications_set: Notifications, sender: User):
 
         notifications_set.unseen = True
         new_request.save()
+        changed(NOTIFICATIONS, notifications_set.user_id)
 
         return new_request
 
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('creating a friend request failed')
         return None
 
 
@@ -41,8 +76,8 @@ def accept_friend(user: User, friend: User, request: FriendRequest):
     try:
         user.contact.get().friends.add(friend)
         friend.contact.get().friends.add(user)
-        user.save()
-        friend.save()
+        changed(CONTACTS, user.pk, friend.pk)
+        # friends are rows of the contacts' m2m table, the users themselves do not change
         # check if that two users were friends in past
         sorted_names = sorted([user.username, friend.username])
         title = f"{sorted_names[0]}, {sorted_names[1]}"
@@ -50,9 +85,10 @@ def accept_friend(user: User, friend: User, request: FriendRequest):
         if conversation is not None:
             add_user_to_conversation(friend, conversation)
         request.delete()
+        changed(NOTIFICATIONS, request.user.user_id)
         return conversation
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception('accepting a friend request failed')
         return None
 
 
@@ -69,3 +105,4 @@ def create_new_conversation(title, admin: User, typ=True):
 
 def reject_friend(request: FriendRequest):
     request.delete()
+    changed(NOTIFICATIONS, request.user.user_id)
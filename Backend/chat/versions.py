@@ -0,0 +1,95 @@
+"""
+Versions of what a user sees in contacts, conversations and notifications views, used as their ETags.
+
+A version is a random token, not a counter: changing a resource forgets its token and the next read makes
+a new one, so versions lost with a restarted process or an evicted cache entry can never come back and
+match an ETag a client still holds. Tokens are forgotten after the changing transaction commits, otherwise
+a read between the change and the commit could tag old data with the new version.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+CONTACTS = 'contacts'
+CONVERSATIONS = 'conversations'
+NOTIFICATIONS = 'notifications'
+
+DEFAULT_VERSIONS = {
+    'BACKEND': 'chat.versions.SharedVersions',
+    'CACHE': 'default',
+    'TTL': 7 * 24 * 60 * 60,
+}
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+class SharedVersions:
+    """
+    versions stored in a django cache (CACHES[CACHE]), so all nodes answer with the same ETags.
+    Point that cache at redis, versions of users who do not come back expire after TTL seconds.
+    There is no backend keeping versions in process memory: a process which did not run the change would
+    keep answering 304 with its old version, a local memory cache is fine for a single process only
+    """
+
+    prefix = 'version'
+
+    def __init__(self, ttl, cache='default', **kwargs):
+        self.ttl = ttl
+        self.alias = cache
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, user_pk, resource):
+        """ version of the resource, None (no ETag, so no 304 either) when the cache cannot keep it """
+        key = f'{self.prefix}:{resource}:{user_pk}'
+        version = self.cache.get(key)
+        if version is None:
+            # add is atomic, of two nodes making a version at once both use the one stored first
+            self.cache.add(key, new_version(), self.ttl)
+            version = self.cache.get(key)
+        return version
+
+    def forget(self, user_pks, resource):
+        self.cache.delete_many([f'{self.prefix}:{resource}:{user_pk}' for user_pk in user_pks])
+
+
+_versions = None
+
+
+def versions():
+    global _versions
+    if _versions is None:
+        config = {**DEFAULT_VERSIONS, **getattr(settings, 'VERSIONS', {})}
+        backend = import_string(config.pop('BACKEND'))
+        _versions = backend(**{name.lower(): value for name, value in config.items()})
+    return _versions
+
+
+@receiver(setting_changed)
+def reset_versions(setting, **kwargs):
+    global _versions
+    if setting == 'VERSIONS':
+        _versions = None
+
+
+def changed(resource, *user_pks):
+    """ 'resource' of these users changed in the current transaction """
+    user_pks = list(user_pks)
+    transaction.on_commit(lambda: versions().forget(user_pks, resource))
+
+
+def etag(resource):
+    """ etag_func of django's condition decorator for views showing 'resource' of the requesting user """
+    def etag_func(request, *args, **kwargs):
+        return versions().get(request.user.pk, resource)
+    return etag_func
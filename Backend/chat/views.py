@@ -1,14 +1,30 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .models import User, Contact, Conversation, UserConversation
+from rest_framework import status
+from django.db.models import F, Q, OuterRef, Subquery
+from django.utils import timezone
+from .models import User, Contact, Conversation, UserConversation, Message
 import json
+import logging
+from datetime import timedelta
 from django.core import serializers
-from .serializers import ContactSerializer, UserSerializer, UserConversationSerializer, MessageSerializer, \
-    FriendRequestsSerializer
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .serializers import UserConversationSerializer, UserSearchSerializer, message_values, serialize_contact, \
+    serialize_friends, serialize_friend_requests, serialize_message_row, serialize_messages
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .pagination import encode_cursor, decode_cursor, encode_watermark, decode_watermark
+from .message_cache import cached_messages, newest_messages
+from .search import search_users, SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from . import metrics as chat_metrics
+from . import versions
+
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -21,11 +37,52 @@ def room(request):
     })
 
 
+def metrics(request):
+    """ counters of this process in Prometheus text format, for internal scrapers only """
+    if not chat_metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(chat_metrics.render(), content_type=chat_metrics.CONTENT_TYPE)
+
+
+def user_conversations(user):
+    """ one query: conversations of user with their last message, most recent first """
+    last_message = Message.objects.filter(conversation=OuterRef('conversation')).order_by('-timestamp', '-pk')
+    return UserConversation.objects.filter(user=user) \
+        .select_related('conversation') \
+        .annotate(last_message_timestamp=Subquery(last_message.values('timestamp')[:1]),
+                  last_message=Subquery(last_message.values('content')[:1])) \
+        .order_by(F('last_message_timestamp').desc(nulls_last=True), '-conversation_id')
+
+
+def last_messages(conversations, count, known):
+    """
+    one query: newest 'count' messages of every conversation of UserConversations 'conversations' after
+    sequences of 'known', {conversation pk: sequence} (all for conversations it lacks), serialized and keyed by
+    str(conversation id). Messages are numbered from 1 in every conversation, the newest ones have sequence
+    above last_sequence - count. Ones stored after conversations were read are left for the next call
+    """
+    newest = Q()
+    for conversation in conversations:
+        last_sequence = conversation.conversation.last_sequence
+        newest |= Q(conversation_id=conversation.conversation_id,
+                    sequence__gt=max(last_sequence - count, known.get(conversation.conversation_id, 0)),
+                    sequence__lte=last_sequence)
+    if not newest:
+        return {}
+    content = {}
+    for row in message_values(Message.objects.filter(newest).order_by('conversation_id', '-sequence'),
+                              'conversation_id'):
+        content.setdefault(str(row['conversation_id']), []).append(serialize_message_row(row))
+    return content
+
+
 class ContactsView(APIView):
     permission_classes = (IsAuthenticated,)
 
+    # 304 Not Modified, without reading the database, when If-None-Match has the current version
+    @method_decorator(condition(etag_func=versions.etag(versions.CONTACTS)))
     def get(self, request):
-        content = {'content': ContactSerializer(request.user.contact.get()).data}
+        content = {'content': serialize_contact(request.user)}
         return Response(content)
 
     def post(self, request):
@@ -33,34 +90,136 @@ class ContactsView(APIView):
             friend = User.objects.get(username=request.data['username'])
             request.user.contact.get().friends.remove(friend)
             friend.contact.get().friends.remove(request.user)
+            versions.changed(versions.CONTACTS, request.user.pk, friend.pk)
             return Response({'content': True})
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception('removing a friend failed')
             return Response({'content': False})
 
 
 class ConversationsView(APIView):
     permission_classes = (IsAuthenticated,)
 
+    @method_decorator(condition(etag_func=versions.etag(versions.CONVERSATIONS)))
     def get(self, request):
-        conversations_data = []
-        for conversation in request.user.conversations.all():
-            conversations_data.append(UserConversation.objects.get(user=request.user, conversation=conversation))
-        content = {'content': UserConversationSerializer(conversations_data, many=True).data}
+        content = {'content': UserConversationSerializer(user_conversations(request.user), many=True).data}
         return Response(content)
 
 
 class ConversationMessagesView(APIView):
     permission_classes = (IsAuthenticated,)
+    page_size = 20
+    max_page_size = 100
 
+    # returns messages newest first, paged with 'before'/'after' cursors and 'count' query params
     def get(self, request, pk):
-        start = int(request.data['start'])
-        end = int(request.data['end'])
-        conversation = Conversation.objects.get(id=pk)
-        content = {'content': MessageSerializer(conversation.get_last_messages(start, end), many=True).data}
+        conversation = get_object_or_404(Conversation, id=pk)
+        if 'start' in request.data:  # old offset paging, kept for older clients
+            try:
+                start = int(request.data['start'])
+                end = int(request.data['end'])
+            except (KeyError, ValueError):
+                return Response({'content': 'Invalid start or end'}, status=status.HTTP_400_BAD_REQUEST)
+            if start < 0 or end < 1:
+                return Response({'content': 'Invalid start or end'}, status=status.HTTP_400_BAD_REQUEST)
+            if start == 0:
+                return Response({'content': [message.data for message in newest_messages(conversation, end)]})
+            content = {'content': serialize_messages(conversation.get_last_messages(start, end))}
+            return Response(content)
+
+        try:
+            count = int(request.query_params.get('count', self.page_size))
+        except ValueError:
+            return Response({'content': 'Invalid count'}, status=status.HTTP_400_BAD_REQUEST)
+        if count < 1:
+            return Response({'content': 'Invalid count'}, status=status.HTTP_400_BAD_REQUEST)
+        count = min(count, self.max_page_size)
+        try:
+            if 'after' in request.query_params:
+                timestamp, message_pk = decode_cursor(request.query_params['after'])
+                messages = cached_messages(conversation.get_messages_after(timestamp, message_pk, count + 1))
+                has_more = len(messages) > count
+                messages = messages[:count][::-1]
+                older_exist = True
+            elif 'before' in request.query_params:
+                timestamp, message_pk = decode_cursor(request.query_params['before'])
+                messages = cached_messages(conversation.get_messages_before(timestamp, message_pk, count + 1))
+                has_more = len(messages) > count
+                messages = messages[:count]
+                older_exist = has_more
+            else:
+                # newest page, from the recent messages cache when it has it
+                messages = newest_messages(conversation, count)
+                # messages are numbered from 1, older ones exist unless the page ends with the first one
+                has_more = older_exist = bool(messages) and messages[-1].sequence > 1
+        except ValueError:
+            return Response({'content': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        content = {
+            'content': [message.data for message in messages],
+            # pass as 'before' to get older messages, None when there are no more
+            'before': encode_cursor(messages[-1]) if messages and older_exist else None,
+            # pass as 'after' to get messages newer than this page
+            'after': encode_cursor(messages[0]) if messages else request.query_params.get('after'),
+            'has_more': has_more,
+        }
         return Response(content)
 
 
+class SyncView(APIView):
+    permission_classes = (IsAuthenticated,)
+    messages_count = 20
+    max_messages_count = 100
+
+    # read states changed this long before a call are sent again by the next one, they may commit after it
+    read_overlap = timedelta(seconds=10)
+
+    # everything client needs after login in one response. With 'since' (watermark returned by previous call)
+    # only conversations and messages changed after it are returned, friends and friend requests are always complete
+    def get(self, request):
+        read_since = timezone.now() - self.read_overlap
+        try:
+            count = int(request.query_params.get('count', self.messages_count))
+        except ValueError:
+            return Response({'content': 'Invalid count'}, status=status.HTTP_400_BAD_REQUEST)
+        if count < 1:
+            return Response({'content': 'Invalid count'}, status=status.HTTP_400_BAD_REQUEST)
+        count = min(count, self.max_messages_count)
+        since, known = None, {}
+        if 'since' in request.query_params:
+            try:
+                since, known = decode_watermark(request.query_params['since'])
+            except ValueError:
+                return Response({'content': 'Invalid since'}, status=status.HTTP_400_BAD_REQUEST)
+
+        conversations = list(user_conversations(request.user))
+        # messages are watermarked by sequences read here, not by time: a message committed after this read
+        # has a higher sequence than its conversation had, however old its timestamp is, and comes next call
+        sequences = {conversation.conversation_id: conversation.conversation.last_sequence
+                     for conversation in conversations}
+        watermark = encode_watermark(read_since, sequences)
+        if since is not None:
+            # new ones, ones with new messages and ones read meanwhile
+            conversations = [conversation for conversation in conversations
+                             if conversation.conversation_id not in known
+                             or sequences[conversation.conversation_id] > known[conversation.conversation_id]
+                             or (conversation.last_read_timestamp is not None
+                                 and conversation.last_read_timestamp > since)]
+
+        with_messages = [conversation for conversation in conversations
+                         if sequences[conversation.conversation_id] > known.get(conversation.conversation_id, 0)]
+
+        content = {
+            'watermark': watermark,
+            'conversations': UserConversationSerializer(conversations, many=True).data,
+            # keys are strings, JSON objects have no other
+            'messages': last_messages(with_messages, count, known),
+            'notifications': serialize_friend_requests(request.user),
+            'friends': serialize_friends(request.user),
+        }
+        return Response({'content': content})
+
+
 class CustomObtainAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
         response = super(CustomObtainAuthToken, self).post(request, *args, **kwargs)
@@ -71,17 +230,23 @@ class CustomObtainAuthToken(ObtainAuthToken):
 class SearchView(APIView):
     permission_classes = (IsAuthenticated,)
 
-    # return users who's username contains key
+    # return users whose username contains 'key', best matches first, paged with 'limit' and 'offset' query params
     def get(self, request):
-        key = request.data['key']
-
-        matching_friends = request.user.contact.get().friends.filter(username__icontains=key)
-        friends = [x.username for x in matching_friends]
-        # getting users who are not your friends
-        users = User.objects.filter(username__icontains=key).exclude(username__in=friends).exclude(pk=request.user.pk)
-        matching_friends = UserSerializer(matching_friends, many=True).data
-        strangers = UserSerializer(users, many=True).data
-        content = {'content': matching_friends + strangers}
+        # older clients send the key in request body
+        key = request.query_params.get('key', request.data.get('key', ''))
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({'content': 'Invalid limit or offset'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 0 or offset < 0:
+            return Response({'content': 'Invalid limit or offset'}, status=status.HTTP_400_BAD_REQUEST)
+
+        users = list(search_users(request.user, key, limit + 1, offset))
+        content = {
+            'content': UserSearchSerializer(users[:limit], many=True).data,
+            'has_more': len(users) > limit,
+        }
         return Response(content)
 
 
@@ -89,9 +254,9 @@ class NotificationsView(APIView):
     permission_classes = (IsAuthenticated,)
 
     # return all user friend requests
+    @method_decorator(condition(etag_func=versions.etag(versions.NOTIFICATIONS)))
     def get(self, request):
-        notifications = request.user.notifications.get()
-        content = {'content': FriendRequestsSerializer(notifications.get_all_notifications(), many=True).data}
+        content = {'content': serialize_friend_requests(request.user)}
         return Response(content)
 
 
@@ -102,6 +267,7 @@ class PasswordChangeView(APIView):
         new_password = request.data['new_passw']
         request.user.set_password(new_password)
         request.user.save()
+        token_cache().delete_user(request.user.pk)
         return Response({'content': True})
 
 class UsernameAvailableView(APIView):
@@ -54,12 +54,46 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',  # <-- And here
+        'chat.authentication.CachedTokenAuthentication',  # <-- And here
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'chat.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'chat.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# brotli or gzip, as the client prefers, for responses of at least MIN_SIZE bytes
+RESPONSE_COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+# shared by all nodes, token cache and ETag versions have to be the same for every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    },
+}
+
+# token -> user cache shared by REST authentication and websocket connect
+# 'chat.authentication.LocalTokenCache' keeps it in memory of one process, other processes accept
+# deleted tokens for up to TTL seconds, use it only with a single process server
+TOKEN_CACHE = {
+    'BACKEND': 'chat.authentication.SharedTokenCache',
+    'TTL': 300,
 }
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # before everything else that reads or changes response bodies
+    'chat.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -103,15 +137,51 @@ DATABASES = {
     }
 }
 
+# groups are spread over all hosts by consistent hashing, every node needs the same list
+# after adding or removing a host run manage.py rebalance_channel_layer [--old-host <removed address>]
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'chat.channel_layers.ShardedRedisChannelLayer',
         'CONFIG': {
             "hosts": [('redis', 6379)],
         },
     },
 }
 
+# events sent to a user's sockets are kept here too and replayed when the user connects
+# 'chat.mailbox.LocalMailbox' keeps them in memory of one process
+MAILBOX = {
+    'BACKEND': 'chat.mailbox.RedisMailbox',
+    'ADDRESS': 'redis://redis:6379',
+    'MAX_LENGTH': 1000,
+    'TTL': 7 * 24 * 60 * 60,
+}
+
+# newest messages of every conversation, first history pages are read from here instead of the database
+# 'CACHE' is shared by all nodes, 'chat.message_cache.LocalMessageCache' keeps them in memory of one process
+MESSAGE_CACHE = {
+    'BACKEND': 'chat.message_cache.SharedMessageCache',
+    'CACHE': 'default',
+    'SIZE': 50,
+    'TTL': 24 * 60 * 60,
+}
+
+# /metrics answers scrapers from these networks, or anywhere with 'Authorization: Bearer <TOKEN>'
+# the channel layer queue depth is measured at most once per DEPTH_INTERVAL seconds
+METRICS = {
+    'ALLOWED_NETWORKS': ['127.0.0.0/8', '::1/128', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'],
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+    'DEPTH_INTERVAL': 15,
+}
+
+# versions of contacts, conversations and notifications of every user, sent as ETags of their views
+# 'CACHE' has to be shared by all nodes, otherwise a node which did not see a change answers 304 with old data
+VERSIONS = {
+    'BACKEND': 'chat.versions.SharedVersions',
+    'CACHE': 'default',
+    'TTL': 7 * 24 * 60 * 60,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
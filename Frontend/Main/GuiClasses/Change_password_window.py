@@ -1,4 +1,4 @@
-import requests
+import asyncio
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtWidgets import QMessageBox
 from SidePackage.Validation import validate_password
@@ -48,7 +48,7 @@ class ChangePasswordWindow(QtWidgets.QMainWindow):
             pop_alert(f"Hasło nie spełnia warunków.\nPowinno składać się \nz minimum {self.minimum_pass_len} znaków")
             return
 
-        self.send_request()
+        asyncio.ensure_future(self.send_request())
         self.close()
 
     def check_old_password(self):
@@ -64,12 +64,10 @@ class ChangePasswordWindow(QtWidgets.QMainWindow):
         # Another conditions
         return True
 
-    def send_request(self):
+    async def send_request(self):
         new_password = self.lineEdit_new_pass2.text()
 
-        url = self.URLs[0] + '/chat/password/change/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.post(url, headers=headers, data={'new_passw': new_password})
+        r = await self.MainWindow.rest_client.post('/chat/password/change/', data={'new_passw': new_password})
 
     def pop_alert(self, text):
         msg = QMessageBox()
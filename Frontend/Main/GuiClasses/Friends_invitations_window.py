@@ -1,4 +1,4 @@
-import requests
+import asyncio
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtWidgets import QMessageBox, QDialogButtonBox, QSizePolicy
 from random import randint
@@ -16,7 +16,7 @@ class FriendsInvitationsWindows(QtWidgets.QMainWindow):
 
         self.initUI()
         self.key_manager = self.MainWindow.key_manager
-        self.get_invitations()
+        asyncio.ensure_future(self.get_invitations())
         self.show()
 
     def initUI(self):
@@ -62,12 +62,10 @@ class FriendsInvitationsWindows(QtWidgets.QMainWindow):
         self.listWidget_invitations.takeItem(row)
         del self.invitations_list[row]
 
-    def get_invitations(self):
-        self.listWidget_invitations.clear()
-        url = self.URLs[0] + '/chat/notifications/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.get(url, headers=headers)
+    async def get_invitations(self):
+        r = await self.MainWindow.rest_client.get('/chat/notifications/')
         respond = r.json()['content']
+        self.listWidget_invitations.clear()
 
         self.invitations_list = respond
         self.invitations_list.sort(key=lambda f: f['timestamp'])
@@ -106,12 +104,10 @@ class FriendsInvitationsWindows(QtWidgets.QMainWindow):
 
         id = self.invitations_list[index]['id']
         self.MainWindow.send_friend_req_response(id, 'True')
-        self.get_invitations()
         self.close()
 
     def remove_invitation(self, index):
 
         id = self.invitations_list[index]['id']
         self.MainWindow.send_friend_req_response(id, 'False')
-        self.get_invitations()
         self.close()
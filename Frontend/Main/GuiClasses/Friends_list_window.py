@@ -1,4 +1,4 @@
-import requests
+import asyncio
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtWidgets import QMessageBox
 from random import randint
@@ -13,7 +13,7 @@ class FriendsListWindow(QtWidgets.QMainWindow):
         self.friends_list = []
 
         self.initUI()
-        self.get_friends()
+        asyncio.ensure_future(self.get_friends())
         self.show()
 
     def initUI(self):
@@ -34,13 +34,11 @@ class FriendsListWindow(QtWidgets.QMainWindow):
         self.listWidget_friends.takeItem(row)
         del self.friends_list[row]
 
-    def get_friends(self):
+    async def get_friends(self):
+        r = await self.MainWindow.rest_client.get('/chat/contacts/')
+        respond = r.json()['content']
         self.friends_list = []
         self.listWidget_friends.clear()
-        url = self.URLs[0] + '/chat/contacts/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.get(url, headers=headers)
-        respond = r.json()['content']
         self.friends_list = respond['friends']
         self.friends_list.sort(key=lambda f: f['username'])
 
@@ -61,16 +59,14 @@ class FriendsListWindow(QtWidgets.QMainWindow):
         msg.show()
 
         if respond == 16384:
-            self.remove_friend(item)
+            asyncio.ensure_future(self.remove_friend(item))
 
-    def remove_friend(self, item):
+    async def remove_friend(self, item):
         row = self.listWidget_friends.row(self.listWidget_friends.currentItem())
         username = self.friends_list[row]['username']
 
-        url = self.URLs[0] + '/chat/friends/remove/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.post(url, headers=headers, data={'username': username})
+        r = await self.MainWindow.rest_client.post('/chat/friends/remove/', data={'username': username})
 
         if r:
-            self.get_friends()
+            await self.get_friends()
 
@@ -1,4 +1,4 @@
-import requests
+import asyncio
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtWidgets import QMessageBox
 from SidePackage.Error import pop_alert
@@ -11,7 +11,6 @@ class FriendsSearchWindow(QtWidgets.QMainWindow):
         self.MainWindow = MainWindow
         self.URLs = URLs
         self.users = []
-        self.friends_list = []
 
         self.initUI()
         self.show()
@@ -21,7 +20,7 @@ class FriendsSearchWindow(QtWidgets.QMainWindow):
         self.button_search = self.findChild(QtWidgets.QPushButton, 'button_search')
         self.lineEdit_to_search = self.findChild(QtWidgets.QLineEdit, 'lineEdit_to_search')
 
-        self.button_search.pressed.connect(self.search_friends)
+        self.button_search.pressed.connect(lambda: asyncio.ensure_future(self.search_friends()))
         self.listWidget_users.itemClicked.connect(self.user_clicked)
         self.listWidget_users.itemDoubleClicked.connect(self.user_double_clicked)
 
@@ -32,25 +31,14 @@ class FriendsSearchWindow(QtWidgets.QMainWindow):
     def add_element(self, text):
         self.listWidget_users.addItem(text)
 
-    def search_friends(self):
-        self.users = []
-        self.listWidget_users.clear()
+    async def search_friends(self):
         string = self.lineEdit_to_search.text()
-        url = self.URLs[0] + '/chat/search/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.get(url, headers=headers, data={'key': string})
-        respond = r.json()['content']
-        self.users = respond
-
-        # Get your frieds list
-        self.friends_list = []
-        url = self.URLs[0] + '/chat/contacts/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.get(url, headers=headers)
-        respond1 = r.json()['content']
-        self.friends_list = respond1['friends']
+        rest_client = self.MainWindow.rest_client
+        r = await rest_client.get('/chat/search/', params={'key': string})
+        self.listWidget_users.clear()
 
-        self.users = [x for x in self.users if x['id'] not in list(map(lambda x: x['id'], self.friends_list))]
+        # server tells which of found users are your friends already
+        self.users = [x for x in r.json()['content'] if not x['is_friend']]
 
         for f in self.users:
             self.add_element(f['username'])
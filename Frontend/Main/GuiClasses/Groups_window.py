@@ -1,4 +1,4 @@
-import requests
+import asyncio
 from PyQt5 import QtWidgets, uic, QtGui, QtCore
 from PyQt5.QtWidgets import QMessageBox, QDialogButtonBox, QSizePolicy
 from random import randint
@@ -14,8 +14,9 @@ class GroupsWindow(QtWidgets.QMainWindow):
         self.user_id = self.MainWindow.user_id
         self.initUI()
         self.key_manager = self.MainWindow.key_manager
-        self.get_friends()
+        self.friends_list = []
         self.listView_friends.setModel(self.model)
+        asyncio.ensure_future(self.get_friends())
         self.show()
 
     def initUI(self):
@@ -44,11 +45,8 @@ class GroupsWindow(QtWidgets.QMainWindow):
         self.MainWindow.messenger.create_group(conversation_name, self.user_id, checked_ids)
         self.close()
 
-    def get_friends(self):
-        self.friends_list = []
-        url = self.URLs[0] + '/chat/contacts/'
-        headers = {'Authorization': 'Token ' + self.MainWindow.token_id}
-        r = requests.get(url, headers=headers)
+    async def get_friends(self):
+        r = await self.MainWindow.rest_client.get('/chat/contacts/')
         respond = r.json()['content']
         self.friends_list = respond['friends']
         self.friends_list.sort(key=lambda f: f['username'])
@@ -5,7 +5,8 @@ from GuiClasses.Forgot_password_window import ForgotWindow
 from GuiClasses.Register_window import RegisterWindow
 from SidePackage.Error import pop_alert
 import time
-import requests
+import asyncio
+from GuiClasses.Managers.RestClient import RestClient, RestError
 
 
 class LoginWindow(QtWidgets.QMainWindow):
@@ -13,6 +14,9 @@ class LoginWindow(QtWidgets.QMainWindow):
         super(LoginWindow, self).__init__()
         uic.loadUi('UiFiles/Login_window.ui', self)
         self.URLs = URLs
+        # login window lives through logouts, so does the connection pool
+        if not hasattr(self, 'rest_client'):
+            self.rest_client = RestClient(URLs[0])
 
         self.initUi()
 
@@ -33,6 +37,9 @@ class LoginWindow(QtWidgets.QMainWindow):
         self.load_users_credentials()
 
     def login_button_pressed(self):
+        asyncio.ensure_future(self.login())
+
+    async def login(self):
         username = self.lineEdit_username.text()
         password = self.lineEdit_password.text()
 
@@ -49,9 +56,8 @@ class LoginWindow(QtWidgets.QMainWindow):
 
         # try for present server
         try:
-            url = self.URLs[0] + '/chat/api-token-auth/'
             payload = {'username': username, 'password': password}
-            r = requests.post(url, data=payload)
+            r = await self.rest_client.post('/chat/api-token-auth/', data=payload)
             if r.status_code == 200:
                 self.close()
                 data = r.json()
@@ -63,7 +69,7 @@ class LoginWindow(QtWidgets.QMainWindow):
 
             else:
                 pop_alert("Niepoprawne dane logowania!")
-        except requests.ConnectionError:
+        except RestError:
 
             # Todo okienko z bledem sieci
             print("Błąd serwera")
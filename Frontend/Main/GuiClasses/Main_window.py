@@ -2,47 +2,48 @@ from PyQt5 import QtWidgets, uic, QtCore
 from PyQt5.QtGui import QFont
 from SidePackage.Error import pop_alert
 import time
+import asyncio
 from .Change_password_window import ChangePasswordWindow
 from .Friends_list_window import FriendsListWindow
 from .Friends_search_window import FriendsSearchWindow
 from .Friends_invitations_window import FriendsInvitationsWindows
 from .Groups_window import GroupsWindow
 
-import requests
 from .messaging import Messenger
-from .Managers.KeyManager import KeyManager
+from .Managers.KeyManager import KeyManager, KeyRequestTimeout
+from .Managers.MessageStore import MessageStore
+from .Managers.RestClient import RestError
+from .Messages_list import Message, MessagesModel, MessagesView, MessageDelegate
 
-# TODO kluczami messages powinny być id konwersacji
-messages = {}
 username = "Ty"
 flag = 17843
 
 
-def split_message(message, count=26):
-    """split words to have at maximum 'count' characters """
-    return_message = ''
-    words = message.split(' ')
-    for w in words:
-        if len(w) <= count:
-            return_message = return_message + w + ' '
-        else:
-            while len(w) > count:
-                return_message = return_message + w[0:count] + ' '
-                w = w[count:]
-            return_message = return_message + w
-    return return_message
-
-
 class MainWindow(QtWidgets.QMainWindow):
+    # newest messages per conversation fetched by sync
+    sync_count = 100
+    # messages loaded at once when scrolling the history, and how many of them are kept in the list
+    page_size = 50
+    history_rows = 4 * page_size
+
     def __init__(self, token_id, user_id, URLs, login_window):
         super(MainWindow, self).__init__()
         self.token_id = token_id
         self.user_id = user_id
         self.URLs = URLs
         self.conversation_ids = dict()
+        # history kept on disk, conversations by id and watermark of the last /chat/sync/
+        self.message_store = MessageStore(user_id)
+        self.conversations = self.message_store.get_conversations()
+        self.sync_watermark = self.message_store.get_watermark()
+        # conversations whose oldest message is stored already
+        self.server_exhausted = set()
 
         self.login_window = login_window
-        self.initialised_conversations = []
+        self.history_generation = 0
+        # connection pool of the login window, requests of this session are sent with our token
+        self.rest_client = login_window.rest_client
+        self.rest_client.token = token_id
 
         self.connect_to_socket()
         self.current_contact = None
@@ -52,13 +53,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.key_manager = KeyManager(user_id)
 
-        self.setup_contacts()
+        # render what is stored on disk right away, fetch what is newer once the window is shown
+        self.show_contacts()
         self.show()
+        QtCore.QTimer.singleShot(0, self.setup_contacts)
 
     def connect_to_socket(self):
         address = self.URLs[1] + "/ws/chat/xd/"
         self.messenger = Messenger()
-        self.messenger.subscribe_to_socket(address, self.token_id)
+        self.messenger.subscribe_to_socket(address, self.token_id, self.message_store.get_sequences)
         self.messenger.message_signal.connect(self.refresh_messages)
         self.messenger.refresh_conversations.connect(self.setup_contacts)
         self.messenger.key_received_signal.connect(self.on_key_receive)
@@ -70,6 +73,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.messenger.add_callback_friend_req_response(self.friend_req_repsponse)
         self.messenger.add_callback_conversation_created(self.new_conversation_created)
         self.messenger.add_callback_new_group_created(self.handle_responses)
+        self.messenger.add_callback_missed_messages(self.store_missed_messages)
 
     def initUi(self):
         self.button_send_message = self.findChild(QtWidgets.QPushButton, 'button_send_message')
@@ -80,9 +84,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.centralwidget = self.findChild(QtWidgets.QWidget, 'centralwidget')
         self.list_contacts = self.findChild(QtWidgets.QListWidget, 'list_contacts')
         self.list_contacts.itemClicked.connect(self.show_messages)
-        self.list_messages = self.findChild(QtWidgets.QListWidget, 'list_messages')
-        self.list_messages.setWordWrap(True)
-        self.list_messages.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.list_messages = self.findChild(MessagesView, 'list_messages')
+        self.list_messages.setItemDelegate(MessageDelegate(self.list_messages))
+        self.messages_model = MessagesModel(self)
+        self.list_messages.setModel(self.messages_model)
+        self.list_messages.verticalScrollBar().valueChanged.connect(self.check_prefetch)
+        self.button_load_messages = self.findChild(QtWidgets.QPushButton, 'button_load_messages')
+        self.button_load_messages.clicked.connect(lambda: asyncio.ensure_future(self.load_older()))
+        self.button_load_messages.setEnabled(False)
+        self.reset_history()
 
         # logout button
         self.button_logout = self.findChild(QtWidgets.QPushButton, 'button_Logout')
@@ -105,6 +115,13 @@ class MainWindow(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot()
     def setup_contacts(self):
+        asyncio.ensure_future(self.update_contacts())
+
+    async def update_contacts(self):
+        await self.sync()
+        self.show_contacts()
+
+    def show_contacts(self):
         " show all contacs and groups of yours "
         self.list_contacts.clear()
         for contact in self.get_contacts():
@@ -118,90 +135,150 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def show_messages(self, item=None):
         """make sending message possible"""
-        self.list_messages.clear()
+        self.reset_history()
         self.button_send_message.setEnabled(True)
-        button_load_messages = QtWidgets.QPushButton("więcej wiadomości")
-        item_widget = QtWidgets.QListWidgetItem()
-        widget = QtWidgets.QWidget()
-        widget_layout = QtWidgets.QVBoxLayout()
-        widget_layout.addWidget(button_load_messages)
-        widget_layout.addStretch()
-        widget_layout.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
-        widget.setLayout(widget_layout)
-        item_widget.setSizeHint(widget.sizeHint())
-        self.list_messages.addItem(item_widget)
-        self.list_messages.setItemWidget(item_widget, widget)
+        self.button_load_messages.setEnabled(True)
 
         """show messages between you and given contact named 'item'"""
         contact = item.text() if item is not None else self.current_contact
-        if item is not None:
-            messages.pop(self.current_contact, None)
-            if self.current_contact in self.initialised_conversations:
-                self.initialised_conversations.remove(self.current_contact)
-        button_load_messages.clicked.connect(self.get_more_messages)
-
         self.current_contact = contact
 
         conversation_id = self.conversation_ids[contact]
-        self.request_key(conversation_id)
+        if item is not None:
+            self.messenger.send_mark_read(conversation_id)
         if not self.key_manager.contains_conversation(conversation_id):  # send a request for the RSA key
-            self.request_key(conversation_id)
+            asyncio.ensure_future(self.open_history_with_key(conversation_id))
             pop_alert("Poczekaj na wygenerowanie")
             return
-            # TODO we must wait for the key from conversation admin, leave this function/tell user about it
-
-        if contact not in self.initialised_conversations:
-            self.get_messages(contact)
-            contact_messages = messages[contact]
-            self.initialised_conversations.append(contact)
-        contact_messages = messages.get(contact, [])
-        for message_info in contact_messages:
-            sender = message_info.split(':')[0]
-            message = message_info[len(sender) + 2:]
-            message = split_message(message, 26)
-            item_widget = QtWidgets.QListWidgetItem()
-            widget_message = QtWidgets.QLabel(message)
-            widget_message.setWordWrap(True)
-            widget = QtWidgets.QWidget()
-            if sender != username:
-                widget_message.setStyleSheet(
-                    "max-width: 225px;\n"
-                    "border-radius: 10px;\n"
-                    "background: #ffcccc;\n"
-                    "border: 5px solid #ffcccc;\n"
-                    "font-size: 11px;"
-                )
-                sender_label = QtWidgets.QLabel(sender)
-                widget_layout = QtWidgets.QVBoxLayout()
-                widget_layout.addWidget(sender_label)
-                widget_layout.addWidget(widget_message)
-                widget_layout.addStretch()
-                widget_layout.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
-                widget.setLayout(widget_layout)
-                item_widget.setSizeHint(widget.sizeHint())
-                self.list_messages.addItem(item_widget)
-                self.list_messages.setItemWidget(item_widget, widget)
-            else:
-                widget_message.setStyleSheet(
-                    "border-radius: 10px;\n"
-                    "background: lightgray;\n"
-                    "border: 5px solid lightgray;\n"
-                    "margin-left: 200px;"
-                    "font-size: 11px;"
-                )
-                widget_layout = QtWidgets.QHBoxLayout()
-                widget_layout.addWidget(widget_message)
-                widget_layout.addStretch()
-                widget_layout.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
-                widget.setLayout(widget_layout)
-                item_widget.setSizeHint(widget.sizeHint())
-                self.list_messages.addItem(item_widget)
-                self.list_messages.setItemWidget(item_widget, widget)
-            self.list_messages.scrollToBottom()
+
+        asyncio.ensure_future(self.open_history())
+
+    def request_key(self, conversation_id):
+        """ awaitable key of the conversation, asked from its admin once however many times it is awaited """
+        return asyncio.wrap_future(self.key_manager.request_key(conversation_id, self.messenger.send_key_request))
+
+    async def open_history_with_key(self, conversation_id):
+        """ show the conversation when its key comes, if it is still the open one """
+        try:
+            await self.request_key(conversation_id)
+        except KeyRequestTimeout:
+            return
+        if self.conversation_ids.get(self.current_contact) == conversation_id:
+            self.reset_history()
+            await self.open_history()
+
+    def reset_history(self):
+        """ forget the messages of previous conversation, pages still loading for it are dropped when they come """
+        self.history_generation += 1
+        self.messages_model.clear()
+        self.history_oldest = None
+        self.history_newest = None
+        # oldest message of the conversation is in the list / newest one is
+        self.history_complete = False
+        self.history_at_newest = True
+        self.loading_older = False
+        self.loading_newer = False
+
+    async def open_history(self):
+        await self.load_older()
+        self.list_messages.scrollToBottom()
+
+    @QtCore.pyqtSlot()
+    def check_prefetch(self):
+        """ load next page before the user scrolls to the end of what is loaded """
+        if self.current_contact is None:
+            return
+        scroll_bar = self.list_messages.verticalScrollBar()
+        margin = self.list_messages.viewport().height()
+        if scroll_bar.value() <= margin and not self.history_complete:
+            asyncio.ensure_future(self.load_older())
+        if scroll_bar.maximum() - scroll_bar.value() <= margin and not self.history_at_newest:
+            asyncio.ensure_future(self.load_newer())
+
+    async def load_older(self):
+        """ prepend page of messages older than the oldest one in the list """
+        if self.loading_older or self.history_complete or self.current_contact not in self.conversation_ids:
+            return
+        conversation_id = self.conversation_ids[self.current_contact]
+        generation = self.history_generation
+        self.loading_older = True
+        try:
+            data, contents = await self.fetch_older(conversation_id, self.history_oldest)
+        except RestError:
+            return
+        finally:
+            if generation == self.history_generation:
+                self.loading_older = False
+        if generation != self.history_generation:
+            return
+
+        self.history_complete = len(data) < self.page_size and conversation_id in self.server_exhausted
+        if data:
+            self.history_oldest = data[-1]['timestamp']
+            if self.history_newest is None:
+                self.history_newest = data[0]['timestamp']
+            self.messages_model.prepend_messages(self.to_list_messages(data, contents))
+            self.trim_history(from_top=False)
+        self.check_prefetch()
+
+    async def load_newer(self):
+        """ append page of messages newer than the newest one in the list, all of them are on disk """
+        # nothing to append to before the first page came, unless conversation is empty
+        if self.loading_newer or self.history_newest is None and not self.history_complete:
+            return
+        conversation_id = self.conversation_ids[self.current_contact]
+        generation = self.history_generation
+        self.loading_newer = True
+        try:
+            data = self.message_store.get_messages(conversation_id, self.page_size, after=self.history_newest)
+            contents = await asyncio.get_event_loop().run_in_executor(None, self.decrypt_stored, conversation_id, data)
+        finally:
+            if generation == self.history_generation:
+                self.loading_newer = False
+        if generation != self.history_generation:
+            return
+
+        scroll_bar = self.list_messages.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
+        self.history_at_newest = len(data) < self.page_size
+        if data:
+            self.history_newest = data[0]['timestamp']
+            if self.history_oldest is None:
+                self.history_oldest = data[-1]['timestamp']
+            self.messages_model.append_messages(self.to_list_messages(data, contents))
+            self.trim_history(from_top=True)
+            if at_bottom and self.history_at_newest:
+                self.list_messages.scrollToBottom()
+        self.check_prefetch()
+
+    def trim_history(self, from_top):
+        """ keep at most history_rows messages in the list, the ones far from what was just loaded go """
+        extra = self.messages_model.rowCount() - self.history_rows
+        if extra <= 0:
+            return
+        if from_top:
+            self.messages_model.remove_first(extra)
+            self.history_oldest = self.messages_model.messages[0].timestamp
+            self.history_complete = False
+        else:
+            self.messages_model.remove_last(extra)
+            self.history_newest = self.messages_model.messages[-1].timestamp
+            self.history_at_newest = False
+
+    def to_list_messages(self, data, contents):
+        """ rows of the messages list, oldest first, from messages newest first """
+        rows = []
+        for message, content in zip(reversed(data), reversed(contents)):
+            own = message['author']['id'] == self.user_id
+            sender = username if own else message['author']['username']
+            rows.append(Message(sender, content, own, message['timestamp']))
+        return rows
 
     @QtCore.pyqtSlot()
     def refresh_messages(self):
-        self.show_messages()
+        """ new message is on disk already, show it if the newest messages are shown """
+        if self.history_at_newest:
+            asyncio.ensure_future(self.load_newer())
 
     @QtCore.pyqtSlot()
     def on_key_receive(self):
@@ -214,8 +291,28 @@ class MainWindow(QtWidgets.QMainWindow):
         pass
 
     def handle_key_request(self, data):  # current user is an admin, and we should send the key
-        global flag
         # TODO notify user about it and let him decide
+        conversation_id = data['conversation_id']
+        if self.key_manager.contains_conversation(conversation_id):
+            self.send_key(data)
+        else:  # serious error, rsa keys should be added just after creating the new conversation
+            # answered once a key is stored, the websocket thread does not wait for it
+            self.key_manager.create_key(conversation_id).add_done_callback(
+                lambda stored: self.send_stored_key(data, stored))
+
+    def send_stored_key(self, data, stored):
+        # without a key there is nothing to answer, the requester asks again and gives up after its timeout
+        if stored.exception() is not None:
+            print(f"Key for conversation {data['conversation_id']} not created: {stored.exception()!r}")
+            return
+        try:
+            self.send_key(data)
+        except Exception as e:
+            # runs in a key pool thread, an exception here would only be swallowed by the future
+            print(e)
+
+    def send_key(self, data):
+        global flag
         # request data
         conversation_id = data['conversation_id']
         dh_external_key = int(data['dh_key'])
@@ -226,40 +323,14 @@ class MainWindow(QtWidgets.QMainWindow):
         dh_local.gen_private_key(dh_external_key)  # dh_local can now encrypt our rsa key
 
         rsa_key = self.key_manager.get_key(conversation_id)
-        if rsa_key == None and conversation_id not in self.key_manager.currently_generating_keys:  # serious error, rsa keys should be added just after creating the new conversation
-            # raise Exception("Admin doesn't have key!")
-            # TODO delete code below
-            self.key_manager.start_generating_key(conversation_id)
-            new_key = self.key_manager.generate_key()
-            self.key_manager.add_key(conversation_id, new_key)
-            rsa_key = self.key_manager.get_key(conversation_id)
-            # self.setup_contacts()
-
         encrypted_rsa_key = dh_local.encrypt_key(rsa_key['rsa_key'])  # this is a dictionary    
         encrypted_flag = dh_local.encrypt_message(flag)
         self.messenger.send_key_response(conversation_id, user_id, dh_local_key, encrypted_rsa_key, encrypted_flag)
 
     def handle_key_response(self, data):
         global flag
-        conversation_id = data['conversation_id']
-        if not self.key_manager.contains_conversation(conversation_id):
-            dh_key = int(data['dh_key'])
-            encrypted_rsa_key = data['rsa_key']
-
-            dh = self.key_manager.get_dh(conversation_id)
-            dh.gen_private_key(dh_key)  # now dh can decrypt RSA key
-
-            encrypted_flag = int(data['flag'])
-            decrypted_flag = dh.decrypt_message(encrypted_flag)
-            if flag == decrypted_flag:
-                decrypted_rsa_key = dh.decrypt_key(encrypted_rsa_key)  # this is rsa.PrivateKey object
-                self.key_manager.add_key(conversation_id, decrypted_rsa_key)
-                # self.setup_contacts()
-
-    def request_key(self, conversation_id):
-        dh = self.key_manager.initialise_dh(conversation_id)
-        dh_key = dh.gen_public_key()
-        self.messenger.send_key_request(conversation_id, dh_key)
+        self.key_manager.receive_key(data['conversation_id'], int(data['dh_key']), data['rsa_key'], int(data['flag']),
+                                     flag)
 
     def send_new_message(self):
         """send new message to contact. Usage: 'Ty: <message>' or '<contact_name>: <message>' for test purposes only"""
@@ -275,83 +346,82 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def get_contacts(self):
         self.conversation_ids.clear()
-        url = self.URLs[0] + '/chat/conversations/'
-        headers = {'Authorization': 'Token ' + self.token_id}
-        r = requests.get(url, headers=headers)
         e = []
-        data = r.json()['content']
+        data = sorted(self.conversations.values(), key=lambda c: c['last_message_timestamp'] or '', reverse=True)
         for x in data:
             self.conversation_ids[x['title']] = x['id']
             e.append(x['title'])
 
         return e
 
-    def get_messages(self, contact, start=0, end=2):
-        if start == 0 and end == 2:
-            messages.pop(contact, None)
-
-        conversation_id = self.conversation_ids[contact]
-        rsa_manager = self.key_manager.get_rsa_manager(conversation_id)
-
-        url = self.URLs[0] + '/chat/messages/' + str(conversation_id)
-        headers = {'Authorization': 'Token ' + self.token_id}
-        r = requests.get(url, headers=headers, data={'start': start, 'end': end})
-        d = list()
-        data = r.json()['content']
-        if contact not in messages:
-            messages[contact] = []
-        for message in data:
-            content = str(message['content'])
-
-            if rsa_manager != None:
-                content = rsa_manager.decrypt(content)
-
-            author_id = message['author']['id']
-            if author_id == self.user_id:
-                message_prefix = "Ty: "
-            else:
-                author_name = message['author']['username']
-                message_prefix = author_name + ": "
-
-            messages[contact].append(message_prefix + content)
-            d.append((author_id, content))
-        """return all messages between you and given contact"""
-        messages[contact].reverse()
-        return messages[contact]
-
-    def get_more_messages(self, e=1):
-        """ get 'e' more messages from current conversation.   """
-        contact = self.current_contact
-
-        starting_pos = len(messages[contact]) or 0
-        conversation_id = self.conversation_ids[contact]
-        url = self.URLs[0] + '/chat/messages/' + str(conversation_id)
-        headers = {'Authorization': 'Token ' + self.token_id}
-        r = requests.get(url, headers=headers, data={'start': starting_pos, 'end': 1})
-        d = list()
-        temp_messages = list()
+    async def sync(self):
+        """ fetch conversations, newest messages, friends and invitations changed since last sync in one request """
+        params = {'count': self.sync_count}
+        if self.sync_watermark:
+            params['since'] = self.sync_watermark
+        r = await self.rest_client.get('/chat/sync/', params=params)
+        if not r and 'since' in params:
+            # watermark of an older server, everything is sent again without it
+            del params['since']
+            r = await self.rest_client.get('/chat/sync/', params=params)
+        if not r:
+            raise RestError('sync failed with status {}'.format(r.status_code))
         data = r.json()['content']
-        if contact not in messages:
-            messages[contact] = []
-        for message in data:
-            content = self.decode_message(message, conversation_id)
-            author_id = message['author']['id']
-            if author_id == self.user_id:
-                message_prefix = "Ty: "
-            else:
-                author_name = message['author']['username']
-                message_prefix = author_name + ": "
-
-            temp_messages.append(message_prefix + content)
-            d.append((author_id, content))
-        """return e more messages between you and given contact"""
-        temp_messages.reverse()
-        temp_messages.extend(messages[contact])
-        """we need to create new cache and replace current one with it """
-        messages[contact] = temp_messages
-        self.show_messages()
-        """ we then refresh the chat and scroll messages to top """
-        self.list_messages.scrollToTop()
+        for conversation in data['conversations']:
+            self.conversations[conversation['id']] = conversation
+        self.message_store.save_conversations(data['conversations'])
+        for conversation_id, new_messages in data['messages'].items():
+            # full batch means there may be more messages between it and stored ones, drop stored ones then
+            replace_older = len(new_messages) >= self.sync_count
+            if replace_older:
+                self.server_exhausted.discard(int(conversation_id))
+            self.store_messages(int(conversation_id), new_messages, replace_older=replace_older)
+        self.sync_watermark = data['watermark']
+        self.message_store.set_watermark(self.sync_watermark)
+        self.friends = data['friends']
+        self.notifications = data['notifications']
+
+    def store_messages(self, conversation_id, data, replace_older=False):
+        """ decrypt server messages and save them on disk, returns decrypted contents """
+        contents = self.key_manager.decrypt_messages(conversation_id, [str(message['content']) for message in data])
+        decrypted = contents if self.key_manager.contains_conversation(conversation_id) else None
+        self.message_store.save_messages(conversation_id, data, decrypted, replace_older)
+        return contents
+
+    def decrypt_stored(self, conversation_id, data):
+        """ contents of messages read from disk, those stored before the key came are decrypted and saved now """
+        encrypted = [message for message in data if not message['decrypted']]
+        decrypted = iter(self.store_messages(conversation_id, encrypted))
+        return [message['content'] if message['decrypted'] else next(decrypted) for message in data]
+
+    async def fetch_older(self, conversation_id, before):
+        """
+        page of messages older than timestamp 'before' (all when None), newest first, with their contents.
+        Stored messages are read first, missing ones are fetched from the server and stored.
+        Decryption runs in a worker thread
+        """
+        loop = asyncio.get_event_loop()
+        data = self.message_store.get_messages(conversation_id, self.page_size, before)
+        while len(data) < self.page_size and conversation_id not in self.server_exhausted:
+            # disk keeps newest messages without holes, so the rest is on the server right before them.
+            # Without a cursor the newest page comes, it overlaps what is stored and brings the cursor
+            params = {'count': self.page_size}
+            cursor = self.message_store.get_cursor(conversation_id)
+            if cursor is not None:
+                params['before'] = cursor
+            r = await self.rest_client.get('/chat/messages/' + str(conversation_id), params=params)
+            if not r:
+                # next try starts again from the newest page, in case the server does not take the cursor
+                self.message_store.set_cursor(conversation_id, None)
+                raise RestError('history page failed with status {}'.format(r.status_code))
+            page = r.json()
+            if not page['has_more']:
+                self.server_exhausted.add(conversation_id)
+            await loop.run_in_executor(None, self.store_messages, conversation_id, page['content'])
+            self.message_store.set_cursor(conversation_id, page['before'])
+            data = self.message_store.get_messages(conversation_id, self.page_size, before)
+        contents = await loop.run_in_executor(None, self.decrypt_stored, conversation_id, data)
+        return data, contents
 
     def decode_message(self, message, conversation_id):
         content = message['content']
@@ -362,21 +432,16 @@ class MainWindow(QtWidgets.QMainWindow):
         return content
 
     def append_new_message(self, message):
-        author_id = int(message['author']['id'])
         conversation_id = int(message['conversation_id'])
-        content = self.decode_message(message, conversation_id)
-
-        contact = next((title for title, id in self.conversation_ids.items() if id == conversation_id), None)
-        if contact not in self.initialised_conversations:
-            return
-
-        if author_id == self.user_id:
-            message_prefix = "Ty: "
-        else:
-            author_name = message['author']['username']
-            message_prefix = author_name + ": "
+        # save on disk, refresh_messages shows it from there
+        self.store_messages(conversation_id, [message])
 
-        messages[contact].append(message_prefix + content)
+    def store_missed_messages(self, data):
+        """ messages sent while we were disconnected, all of them when 'has_more' is not set """
+        conversation_id = int(data['conversation_id'])
+        if data['has_more']:
+            self.server_exhausted.discard(conversation_id)
+        self.store_messages(conversation_id, data['messages'], replace_older=data['has_more'])
 
     def open_change_password_window(self):
         self.ui = ChangePasswordWindow(self, self.URLs)
@@ -432,13 +497,16 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def new_conversation_created(self, data):
         conversation_id = data['conversation_id']
-        self.key_manager.start_generating_key(conversation_id)
-        new_key = self.key_manager.generate_key()
-        self.key_manager.add_key(conversation_id, new_key)
+        # pre-generated key, or one which is being generated in the key pool
+        self.key_manager.create_key(conversation_id)
 
      #   self.setup_contacts()
 
     def logout(self):
         self.close()
-        self.messenger.sub_socket.close()
+        self.messenger.close()
+        self.message_store.close()
+        self.key_manager.close()
+        self.rest_client.token = None
+        self.rest_client.clear_cache()
         self.login_window.__init__(self.URLs)
@@ -1,12 +1,45 @@
 import json
-import rsa
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 
 
 from .diffie_hellman import DiffieHelman
 from .RSAManager import RSAManager
+from .KeyPool import KeyPool
+
+
+class KeyRequestTimeout(Exception):
+    """ admin of the conversation did not answer any of our key requests """
+
+
+class KeyRequest():
+    """ key of one conversation asked from its admin, retries reuse the same Diffie-Hellman key """
+
+    def __init__(self, send):
+        self.send = send
+        self.dh = DiffieHelman()
+        self.public_key = self.dh.gen_public_key()
+        # done with the stored key, or failed with KeyRequestTimeout
+        self.received = Future()
+        self.attempt = 0
+        self.timer = None
+
 
 class KeyManager():
+    # how many conversations keep ready to use RSAManager
+    rsa_managers_limit = 64
+    # size of RSA keys of conversations created by this user, and how many of them are generated in advance
+    key_bits = 512
+    key_pool_size = 4
+    # seconds to wait for an answer to a key request, doubled for every next attempt
+    key_request_timeout = 10
+    key_request_attempts = 4
+
+    # states of getting the key of a conversation we are not admin of
+    IDLE, REQUESTED, RECEIVED = 'idle', 'requested', 'received'
+
     def __init__(self, user_id):
         filename = '{}.txt'.format(user_id)
         self.filename = os.path.join('keys', filename)
@@ -18,17 +51,51 @@ class KeyManager():
             self.keys = json.load(infile)
 
         self.initialised_dh = {}
-        self.currently_generating_keys = []
+        # conversation id -> future done when its new key is stored
+        self.generating_keys = {}
+        self.keys_lock = threading.Lock()
+        self.key_pool = KeyPool(self.key_bits, self.key_pool_size)
+
+        # conversation id -> KeyRequest which was not answered yet
+        self.key_requests = {}
+        self.requests_lock = threading.Lock()
+
+        # conversation id -> RSAManager, least recently used first
+        self.rsa_managers = OrderedDict()
+        self.rsa_managers_lock = threading.Lock()
 
     def contains_conversation(self, conversation_id):
         return str(conversation_id) in self.keys
 
-    def start_generating_key(self, conversation_id):
-        if conversation_id not in self.currently_generating_keys:
-            self.currently_generating_keys.append(conversation_id)
+    def create_key(self, conversation_id):
+        """
+        give a new conversation a key from the pool. Returns a future done when the key is stored,
+        which is at once unless the pool ran dry
+        """
+        with self.keys_lock:
+            stored = self.generating_keys.get(conversation_id)
+            if stored is not None:
+                return stored
+            stored = self.generating_keys[conversation_id] = Future()
+
+        def store(generated):
+            try:
+                self.add_key(conversation_id, generated.result())
+                stored.set_result(self.get_key(conversation_id))
+            except Exception as e:
+                stored.set_exception(e)
+            finally:
+                with self.keys_lock:
+                    self.generating_keys.pop(conversation_id, None)
+
+        self.key_pool.take().add_done_callback(store)
+        return stored
 
     def add_key(self, conversation_id, key):
-        if str(conversation_id) not in self.keys:
+        # keys come from the websocket thread and from key pool callbacks
+        with self.keys_lock:
+            if str(conversation_id) in self.keys:
+                return
             key_json = {'rsa_key':
                             {
                             'n': key.n,
@@ -40,24 +107,101 @@ class KeyManager():
                         }
 
             self.keys[str(conversation_id)] = key_json
+            with self.rsa_managers_lock:
+                self.rsa_managers.pop(str(conversation_id), None)
 
             with open(self.filename, 'w') as outfile:
                 json.dump(self.keys, outfile)
 
-            if conversation_id in self.currently_generating_keys:
-                self.currently_generating_keys.remove(conversation_id)
-
     def get_key(self, conversation_id):
         return self.keys.get(str(conversation_id), None)
 
     def get_rsa_manager(self, conversation_id):
+        conversation_id = str(conversation_id)
+        with self.rsa_managers_lock:
+            rsa_manager = self.rsa_managers.get(conversation_id)
+            if rsa_manager is not None:
+                self.rsa_managers.move_to_end(conversation_id)
+                return rsa_manager
+
+        if not self.contains_conversation(conversation_id):
+            return None
+        rsa_manager = RSAManager(self.get_key(conversation_id)['rsa_key'])
+        with self.rsa_managers_lock:
+            self.rsa_managers[conversation_id] = rsa_manager
+            while len(self.rsa_managers) > self.rsa_managers_limit:
+                self.rsa_managers.popitem(last=False)
+        return rsa_manager
+
+    def decrypt_messages(self, conversation_id, contents):
+        """ decrypt many message contents of one conversation, contents without key are returned as they are """
+        rsa_manager = self.get_rsa_manager(conversation_id)
+        if rsa_manager is None:
+            return list(contents)
+        return [rsa_manager.decrypt(content) for content in contents]
+
+    def key_state(self, conversation_id):
         if self.contains_conversation(conversation_id):
-            return RSAManager(self.get_key(conversation_id)['rsa_key'])
-        return None
-
-    def generate_key(self, bits=512):
-        _, priv_key = rsa.newkeys(bits)
-        return priv_key
+            return self.RECEIVED
+        return self.REQUESTED if conversation_id in self.key_requests else self.IDLE
+
+    def request_key(self, conversation_id, send):
+        """
+        ask the conversation admin for its key with send(conversation_id, dh_public_key), unless we have the key
+        or asked for it already. Returns a future done with the key once it is stored
+        """
+        with self.requests_lock:
+            request = self.key_requests.get(conversation_id)
+            if request is None:
+                if self.contains_conversation(conversation_id):
+                    received = Future()
+                    received.set_result(self.get_key(conversation_id))
+                    return received
+                request = self.key_requests[conversation_id] = KeyRequest(send)
+                self.send_key_request(conversation_id, request)
+            return request.received
+
+    def send_key_request(self, conversation_id, request):
+        # requests_lock is held
+        request.attempt += 1
+        request.timer = threading.Timer(self.key_request_timeout * 2 ** (request.attempt - 1),
+                                        self.key_request_timed_out, (conversation_id, request))
+        request.timer.daemon = True
+        request.timer.start()
+        try:
+            request.send(conversation_id, request.public_key)
+        except Exception as e:
+            # socket is reconnecting, request is sent again after the timeout
+            print(e)
+
+    def key_request_timed_out(self, conversation_id, request):
+        with self.requests_lock:
+            if self.key_requests.get(conversation_id) is not request:
+                return  # answered meanwhile
+            if request.attempt < self.key_request_attempts:
+                self.send_key_request(conversation_id, request)
+                return
+            del self.key_requests[conversation_id]
+        request.received.set_exception(KeyRequestTimeout(conversation_id))
+
+    def receive_key(self, conversation_id, dh_key, encrypted_rsa_key, encrypted_flag, flag):
+        """ admin's answer to our key request, returns whether it gave us the key """
+        with self.requests_lock:
+            request = self.key_requests.get(conversation_id)
+            if request is None:
+                return False  # not asked for, answered already or given up
+            try:
+                request.dh.gen_private_key(dh_key)
+            except Exception as e:
+                print(e)
+                return False
+            if request.dh.decrypt_message(encrypted_flag) != flag:
+                return False
+            del self.key_requests[conversation_id]
+            request.timer.cancel()
+        self.add_key(conversation_id, request.dh.decrypt_key(encrypted_rsa_key))
+        request.received.set_result(self.get_key(conversation_id))
+        return True
 
     def initialise_dh(self, conversation_id):
         self.initialised_dh[conversation_id] = DiffieHelman()
@@ -69,4 +213,9 @@ class KeyManager():
     def get_dh(self, conversation_id):
         return self.initialised_dh.get(conversation_id, None)
 
-
+    def close(self):
+        with self.requests_lock:
+            for request in self.key_requests.values():
+                request.timer.cancel()
+            self.key_requests.clear()
+        self.key_pool.close()
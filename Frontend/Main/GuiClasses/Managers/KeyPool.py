@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import rsa
+
+
+def new_private_key(bits):
+    _, private_key = rsa.newkeys(bits)
+    return private_key
+
+
+def lower_priority():
+    # workers only fill the pool, they should not take CPU from the GUI
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+
+class KeyPool():
+    """
+    RSA private keys generated ahead of time in worker processes. take() hands out a key which is ready already
+    and orders a new one in the background, so neither the GUI nor the websocket thread waits for rsa.newkeys,
+    whatever the key size.
+    """
+
+    def __init__(self, bits=512, size=4, workers=1):
+        self.bits = bits
+        self.size = size
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=lower_priority)
+        self.lock = threading.Lock()
+        # futures of generated keys, oldest first, some may still be generating
+        self.keys = deque()
+        self.fill()
+
+    def fill(self):
+        with self.lock:
+            while len(self.keys) < self.size:
+                self.keys.append(self.executor.submit(new_private_key, self.bits))
+
+    def take(self):
+        """ future of an unused private key, done at once unless keys are taken faster than they are made """
+        with self.lock:
+            future = next((future for future in self.keys if future.done()), None)
+            if future is not None:
+                self.keys.remove(future)
+            elif self.keys:
+                future = self.keys.popleft()
+            else:
+                future = self.executor.submit(new_private_key, self.bits)
+        self.fill()
+        return future
+
+    def close(self):
+        with self.lock:
+            for future in self.keys:
+                future.cancel()
+            self.keys.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class MessageStore():
+    """
+    On-disk history of one user: conversations, messages (decrypted when key was known) and sync watermark.
+    For every conversation the store keeps a contiguous run of its newest messages, so history read from it
+    has no holes, and the server's 'before' cursor of the oldest of them to fetch older messages with.
+    """
+    directory = 'messages'
+
+    def __init__(self, user_id):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.filename = os.path.join(self.directory, '{}.sqlite3'.format(user_id))
+
+        # used from GUI thread and websocket thread
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS conversations '
+                                    '(id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS messages '
+                                    '(conversation_id INTEGER NOT NULL, timestamp TEXT NOT NULL, '
+                                    'author_id INTEGER NOT NULL, author_name TEXT NOT NULL, content TEXT NOT NULL, '
+                                    'decrypted INTEGER NOT NULL, '
+                                    'PRIMARY KEY (conversation_id, timestamp, author_id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # stores created before messages had sequence numbers
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(messages)')]
+            if 'sequence' not in columns:
+                self.connection.execute('ALTER TABLE messages ADD COLUMN sequence INTEGER')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_watermark(self):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, watermark):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (watermark,))
+
+    def get_conversations(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT id, data FROM conversations').fetchall()
+        return {conversation_id: json.loads(data) for conversation_id, data in rows}
+
+    def save_conversations(self, conversations):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO conversations (id, data) VALUES (?, ?)',
+                                        [(c['id'], json.dumps(c)) for c in conversations])
+
+    def has_messages(self, conversation_id):
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM messages WHERE conversation_id = ? LIMIT 1',
+                                          (conversation_id,)).fetchone()
+        return row is not None
+
+    def get_sequences(self):
+        """ {conversation_id: sequence of its newest stored message}, stored messages have no holes after it """
+        with self.lock:
+            rows = self.connection.execute('SELECT conversation_id, MAX(sequence) FROM messages '
+                                           'WHERE sequence IS NOT NULL GROUP BY conversation_id').fetchall()
+        return dict(rows)
+
+    def get_cursor(self, conversation_id):
+        """ server cursor of messages older than the stored ones, None when not known yet """
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?',
+                                          ('before:{}'.format(conversation_id),)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, conversation_id, cursor):
+        with self.lock, self.connection:
+            if cursor is None:
+                self.connection.execute('DELETE FROM meta WHERE key = ?', ('before:{}'.format(conversation_id),))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                        ('before:{}'.format(conversation_id), cursor))
+
+    def get_messages(self, conversation_id, count, before=None, after=None):
+        """
+        newest first, like the server. With 'before' the newest messages older than it,
+        with 'after' the oldest messages newer than it
+        """
+        query = 'SELECT timestamp, author_id, author_name, content, decrypted FROM messages WHERE conversation_id = ?'
+        params = [conversation_id]
+        if before is not None:
+            query += ' AND timestamp < ?'
+            params.append(before)
+        if after is not None:
+            query += ' AND timestamp > ? ORDER BY timestamp ASC LIMIT ?'
+            params.append(after)
+        else:
+            query += ' ORDER BY timestamp DESC LIMIT ?'
+        params.append(count)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        if after is not None:
+            rows.reverse()
+        return [{'timestamp': timestamp, 'author': {'id': author_id, 'username': author_name},
+                 'content': content, 'decrypted': bool(decrypted)}
+                for timestamp, author_id, author_name, content, decrypted in rows]
+
+    def save_messages(self, conversation_id, messages, contents=None, replace_older=False):
+        """
+        save server messages, 'contents' are their decrypted contents (None when key is missing).
+        With replace_older messages older than the saved ones are dropped, use it when saved messages
+        may not connect to what is stored
+        """
+        if not messages:
+            return
+        if contents is None:
+            contents = [None] * len(messages)
+        rows = [(conversation_id, message['timestamp'], message['author']['id'], message['author']['username'],
+                 message['content'] if content is None else content, content is not None, message.get('sequence'))
+                for message, content in zip(messages, contents)]
+        with self.lock, self.connection:
+            if replace_older:
+                oldest = min(message['timestamp'] for message in messages)
+                self.connection.execute('DELETE FROM messages WHERE conversation_id = ? AND timestamp < ?',
+                                        (conversation_id, oldest))
+                # it pointed at a message which is not the oldest stored one anymore
+                self.connection.execute('DELETE FROM meta WHERE key = ?', ('before:{}'.format(conversation_id),))
+            # never overwrite decrypted content with the encrypted one
+            self.connection.executemany('INSERT OR REPLACE INTO messages '
+                                        '(conversation_id, timestamp, author_id, author_name, content, decrypted, '
+                                        'sequence) VALUES (?, ?, ?, ?, ?, ?, ?)', [row for row in rows if row[5]])
+            self.connection.executemany('INSERT OR IGNORE INTO messages '
+                                        '(conversation_id, timestamp, author_id, author_name, content, decrypted, '
+                                        'sequence) VALUES (?, ?, ?, ?, ?, ?, ?)', [row for row in rows if not row[5]])
@@ -1,7 +1,16 @@
+import os
 import rsa
 import base64
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 encoding = 'utf-8'
+# messages encrypted with conversation AES key start with this prefix, messages without it are raw RSA (legacy)
+AES_PREFIX = 'v2:'
+NONCE_SIZE = 12
+
 
 class RSAManager():
     def __init__(self, rsa_dict):
@@ -13,20 +22,41 @@ class RSAManager():
 
         self.pub_key = rsa.PublicKey(n, e)
         self.priv_key = rsa.PrivateKey(n, e, d, p, q)
+        self.aes = AESGCM(self.derive_conversation_key(d))
+
+    @staticmethod
+    def derive_conversation_key(d):
+        """ 256 bit AES key of the conversation, derived from private exponent shared by all its members """
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'conversation message key',
+                    backend=default_backend())
+        return hkdf.derive(d.to_bytes((d.bit_length() + 7) // 8, 'big'))
 
     def encrypt(self, message):
         message = message.encode(encoding)
-        encrypted_message = rsa.encrypt(message, self.pub_key)
+        nonce = os.urandom(NONCE_SIZE)
+        encrypted_message = nonce + self.aes.encrypt(nonce, message, None)
         encrypted_message = base64.b64encode(encrypted_message)
-        encrypted_message = encrypted_message.decode(encoding)
+        encrypted_message = AES_PREFIX + encrypted_message.decode(encoding)
         return encrypted_message
-    
+
     def decrypt(self, message):
         try:
-            encoded_message = message.encode(encoding)
-            encoded_message = base64.b64decode(message)
-            decrypted_message = rsa.decrypt(encoded_message, self.priv_key)
+            if message.startswith(AES_PREFIX):
+                encoded_message = base64.b64decode(message[len(AES_PREFIX):])
+                nonce, encoded_message = encoded_message[:NONCE_SIZE], encoded_message[NONCE_SIZE:]
+                decrypted_message = self.aes.decrypt(nonce, encoded_message, None)
+            else:
+                encoded_message = base64.b64decode(message)
+                decrypted_message = rsa.decrypt(encoded_message, self.priv_key)
             decrypted_message = decrypted_message.decode(encoding)
             return decrypted_message
         except:
             return message
+
+    def encrypt_legacy(self, message):
+        """ raw RSA encryption used before AES, kept for benchmarks and tests of old messages """
+        message = message.encode(encoding)
+        encrypted_message = rsa.encrypt(message, self.pub_key)
+        encrypted_message = base64.b64encode(encrypted_message)
+        encrypted_message = encrypted_message.decode(encoding)
+        return encrypted_message
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import aiohttp
+
+try:
+    import brotli  # aiohttp decodes br responses when it is installed
+    ACCEPT_ENCODING = 'br, gzip'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip'
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+class RestError(Exception):
+    """ server could not be reached or did not answer in time """
+
+
+class Response():
+    """ body of a finished request, read once so it can be shared by coalesced callers """
+
+    def __init__(self, status_code, text, etag=None):
+        self.status_code = status_code
+        self.text = text
+        self.etag = etag
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    def json(self):
+        return loads(self.text)
+
+
+class RestClient():
+    """
+    HTTP client of the whole application, running on the asyncio (quamash) loop so the GUI never waits for network.
+    Connections are kept alive in one pool, the auth header is added here and identical GETs which are in flight
+    at the same time are sent only once. Responses with an ETag are kept, the next identical GET sends it in
+    If-None-Match and gets the kept response back when the server answers 304 Not Modified.
+    """
+
+    def __init__(self, base_url, token=None, timeout=10, limit=10, cached_responses=100):
+        self.base_url = base_url
+        self.token = token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.limit = limit
+        self.session = None
+        self.in_flight = dict()
+        # request key -> Response with an ETag, least recently used first
+        self.cached = OrderedDict()
+        self.cached_responses = cached_responses
+
+    def get_session(self):
+        # session has to be created inside a running loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    def headers(self):
+        # big responses like message histories come compressed
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        if self.token is not None:
+            headers['Authorization'] = 'Token ' + self.token
+        return headers
+
+    async def request(self, method, path, params=None, data=None, headers=None):
+        headers = {**self.headers(), **(headers or {})}
+        try:
+            async with self.get_session().request(method, self.base_url + path, params=params, data=data,
+                                                  headers=headers) as r:
+                return Response(r.status, await r.text(), r.headers.get('ETag'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RestError(str(e)) from e
+
+    async def conditional_get(self, key, path, params, data):
+        cached = self.cached.get(key)
+        headers = {'If-None-Match': cached.etag} if cached is not None else None
+        response = await self.request('GET', path, params, data, headers)
+        if response.status_code == 304 and cached is not None:
+            self.cached.move_to_end(key)
+            return cached
+        if response.status_code == 200 and response.etag is not None:
+            self.cached[key] = response
+            self.cached.move_to_end(key)
+            while len(self.cached) > self.cached_responses:
+                self.cached.popitem(last=False)
+        else:
+            self.cached.pop(key, None)
+        return response
+
+    async def get(self, path, params=None, data=None):
+        key = (path, json.dumps(params, sort_keys=True), json.dumps(data, sort_keys=True))
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.conditional_get(key, path, params, data))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda f: self.in_flight.pop(key, None))
+        # one caller giving up must not cancel the request for the others
+        return await asyncio.shield(future)
+
+    async def post(self, path, data=None):
+        return await self.request('POST', path, data=data)
+
+    def clear_cache(self):
+        # kept responses belong to the logged in user
+        self.cached.clear()
+
+    async def close(self):
+        self.clear_cache()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,203 @@
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class Message:
+    """ one row of the messages list, keeps its text layout once computed """
+    __slots__ = ('sender', 'text', 'own', 'timestamp', 'static_text', 'size')
+
+    def __init__(self, sender, text, own, timestamp=None):
+        self.sender = sender
+        self.text = text
+        self.own = own
+        self.timestamp = timestamp
+        self.static_text = None
+        self.size = None
+
+
+class MessagesModel(QtCore.QAbstractListModel):
+    """ messages of the current conversation, oldest first """
+
+    def __init__(self, parent=None):
+        super(MessagesModel, self).__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.messages)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.messages[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return message.text
+        if role == QtCore.Qt.UserRole:
+            return message
+        return None
+
+    def set_messages(self, messages):
+        self.beginResetModel()
+        self.messages = list(messages)
+        self.endResetModel()
+
+    def append_messages(self, messages):
+        if not messages:
+            return
+        first = len(self.messages)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(messages) - 1)
+        self.messages.extend(messages)
+        self.endInsertRows()
+
+    def prepend_messages(self, messages):
+        if not messages:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, len(messages) - 1)
+        self.messages[0:0] = messages
+        self.endInsertRows()
+
+    def remove_first(self, count):
+        count = min(count, len(self.messages))
+        if count <= 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), 0, count - 1)
+        del self.messages[:count]
+        self.endRemoveRows()
+
+    def remove_last(self, count):
+        count = min(count, len(self.messages))
+        if count <= 0:
+            return
+        first = len(self.messages) - count
+        self.beginRemoveRows(QtCore.QModelIndex(), first, len(self.messages) - 1)
+        del self.messages[first:]
+        self.endRemoveRows()
+
+    def clear(self):
+        self.set_messages([])
+
+
+class MessagesView(QtWidgets.QTableView):
+    """
+    single column table showing MessagesModel. Row heights are set once when rows are inserted,
+    so appending a message does not lay out the rows that are already there (QListView would).
+    Rows inserted or removed above the shown ones do not move what is shown
+    """
+
+    def __init__(self, parent=None):
+        super(MessagesView, self).__init__(parent)
+        self.horizontalHeader().hide()
+        self.horizontalHeader().setStretchLastSection(True)
+        self.verticalHeader().hide()
+        self.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        self.setShowGrid(False)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+
+    def setModel(self, model):
+        # connected before the view's own slots, which already move the scroll bar
+        model.rowsAboutToBeRemoved.connect(self.rows_about_to_be_removed)
+        super(MessagesView, self).setModel(model)
+        model.rowsInserted.connect(self.rows_inserted)
+        model.rowsRemoved.connect(self.rows_removed)
+        model.modelReset.connect(self.model_reset)
+        self.removed_height = 0
+        self.removed_value = 0
+
+    def rows_inserted(self, parent, first, last):
+        option = self.viewOptions()
+        delegate = self.itemDelegate()
+        model = self.model()
+        height = 0
+        for row in range(first, last + 1):
+            row_height = delegate.sizeHint(option, model.index(row)).height()
+            self.setRowHeight(row, row_height)
+            height += row_height
+        if first == 0 and last + 1 < model.rowCount():
+            self.shift_scroll(height)
+
+    def rows_about_to_be_removed(self, parent, first, last):
+        self.removed_height = sum(self.rowHeight(row) for row in range(first, last + 1))
+        self.removed_value = self.verticalScrollBar().value()
+
+    def rows_removed(self, parent, first, last):
+        if first == 0:
+            self.shift_scroll(-self.removed_height, self.removed_value)
+
+    def shift_scroll(self, height, value=None):
+        scroll_bar = self.verticalScrollBar()
+        if value is None:
+            value = scroll_bar.value()
+        self.updateGeometries()
+        scroll_bar.setValue(value + height)
+
+    def model_reset(self):
+        self.rows_inserted(QtCore.QModelIndex(), 0, self.model().rowCount() - 1)
+
+
+class MessageDelegate(QtWidgets.QStyledItemDelegate):
+    """ paints message bubbles, text of every message is laid out only once """
+    bubble_width = 225
+    own_indent = 200
+    border = 5
+    margin = 6
+    radius = 10
+    other_color = QtGui.QColor('#ffcccc')
+    own_color = QtGui.QColor('lightgray')
+
+    def __init__(self, parent=None):
+        super(MessageDelegate, self).__init__(parent)
+        self.font = QtGui.QFont()
+        self.font.setPixelSize(11)
+        self.sender_font = QtGui.QFont()
+        self.sender_height = QtGui.QFontMetrics(self.sender_font).height()
+        self.text_option = QtGui.QTextOption()
+        self.text_option.setWrapMode(QtGui.QTextOption.WrapAtWordBoundaryOrAnywhere)
+
+    def layout(self, message):
+        if message.static_text is None:
+            static_text = QtGui.QStaticText(message.text)
+            static_text.setTextFormat(QtCore.Qt.PlainText)
+            static_text.setTextOption(self.text_option)
+            static_text.setTextWidth(self.bubble_width - 2 * self.border)
+            static_text.prepare(QtGui.QTransform(), self.font)
+            size = static_text.size()
+            message.size = QtCore.QSize(int(size.width()) + 1, int(size.height()) + 1)
+            message.static_text = static_text
+        return message.static_text
+
+    def sizeHint(self, option, index):
+        message = index.data(QtCore.Qt.UserRole)
+        self.layout(message)
+        height = message.size.height() + 2 * self.border + 2 * self.margin
+        if not message.own:
+            height += self.sender_height
+        return QtCore.QSize(self.own_indent + self.bubble_width, height)
+
+    def paint(self, painter, option, index):
+        message = index.data(QtCore.Qt.UserRole)
+        static_text = self.layout(message)
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        x = option.rect.x() + self.margin
+        y = option.rect.y() + self.margin
+        if message.own:
+            x += self.own_indent
+            color = self.own_color
+        else:
+            painter.setFont(self.sender_font)
+            painter.drawText(QtCore.QRect(x, y, self.bubble_width, self.sender_height),
+                             QtCore.Qt.AlignLeft, message.sender)
+            y += self.sender_height
+            color = self.other_color
+
+        bubble = QtCore.QRectF(x, y, message.size.width() + 2 * self.border, message.size.height() + 2 * self.border)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(color)
+        painter.drawRoundedRect(bubble, self.radius, self.radius)
+
+        painter.setPen(option.palette.color(QtGui.QPalette.Text))
+        painter.setFont(self.font)
+        painter.drawStaticText(QtCore.QPointF(x + self.border, y + self.border), static_text)
+        painter.restore()
@@ -4,7 +4,7 @@ from SidePackage.Validation import validate_email, validate_password
 from SidePackage.Error import pop_alert
 import urllib.request
 import urllib.parse
-import requests
+import asyncio
 
 
 class RegisterWindow(QtWidgets.QMainWindow):
@@ -35,6 +35,9 @@ class RegisterWindow(QtWidgets.QMainWindow):
         self.LoginWindow.setDisabled(False)
 
     def register_button_pressed(self):
+        asyncio.ensure_future(self.register())
+
+    async def register(self):
         # Firstly check for empty labels
         if self.lineEdit_login.text() == "" or \
                 self.lineEdit_pass.text() == "" or \
@@ -58,7 +61,7 @@ class RegisterWindow(QtWidgets.QMainWindow):
             pop_alert("Podane adresy email się różnią")
             return
 
-        if not self.check_username_availability(self.lineEdit_login.text()):
+        if not await self.check_username_availability(self.lineEdit_login.text()):
             self.lineEdit_login.setText("")
             pop_alert("Ten login jest już zajęty!")
             return
@@ -75,7 +78,7 @@ class RegisterWindow(QtWidgets.QMainWindow):
             pop_alert("Podaj poprawne adres email")
             return
 
-        passed = self.send_request_to_server()
+        passed = await self.send_request_to_server()
         if passed:
             self.close()
         else:
@@ -96,12 +99,11 @@ class RegisterWindow(QtWidgets.QMainWindow):
         # Another conditions
         return True
 
-    def check_username_availability(self, username):
-        url = self.LoginWindow.URLs[0] + '/chat/username_available/'
-        r = requests.post(url, data={'username': username})
+    async def check_username_availability(self, username):
+        r = await self.LoginWindow.rest_client.post('/chat/username_available/', data={'username': username})
         return r.json()['content']
 
-    def send_request_to_server(self):
+    async def send_request_to_server(self):
         # try for server present
         try:
             login = self.lineEdit_login.text()
@@ -109,9 +111,8 @@ class RegisterWindow(QtWidgets.QMainWindow):
             first_name = self.lineEdit_fname.text()
             last_name = self.lineEdit_sname.text()
             email = self.lineEdit_sname.text()
-            url = self.LoginWindow.URLs[0] + '/chat/rest-auth/registration/'
             payload = {'username': login, 'password1': password, 'password2': password}
-            r = requests.post(url, data=payload)
+            r = await self.LoginWindow.rest_client.post('/chat/rest-auth/registration/', data=payload)
             if r.status_code == 400:
                 pop_alert("Błąd rejstracji, spróbuj ponownie z innym hasłem lub loginem")
                 return False
@@ -1,13 +1,18 @@
 import time
-from threading import Thread
 import json
+from threading import Thread
+from urllib.parse import quote
 import websocket
+from websocket import ABNF
 import zmq
 from PyQt5 import QtCore
 from vexmessage import create_vex_message, decode_vex_message
+from . import wire
 
 
 class Messenger(QtCore.QObject):
+    # seconds between attempts to connect again after socket was closed
+    reconnect_delay = 3
     message_signal = QtCore.pyqtSignal()
     key_received_signal = QtCore.pyqtSignal()
     request_received_singal = QtCore.pyqtSignal()
@@ -24,6 +29,10 @@ class Messenger(QtCore.QObject):
         self.callback_friend_req_response = []
         self.callback_conversation_created = []
         self.callback_new_group_created = []
+        self.callback_missed_messages = []
+        self.closing = False
+        # frame format chosen by the server, JSON until the socket is open
+        self.protocol = None
 
     def add_callback_new_message_received(self, f):
         self.callback_new_message_reveiced.append(f)
@@ -46,12 +55,22 @@ class Messenger(QtCore.QObject):
     def add_callback_new_group_created(self, f):
         self.callback_new_group_created.append(f)
 
+    def add_callback_missed_messages(self, f):
+        self.callback_missed_messages.append(f)
+
     def on_message(self, data):
-        data = json.loads(data)
+        if isinstance(data, bytes):
+            data = wire.decode_msgpack(data)
+        else:
+            data = wire.decode_json(data)
         if (data['type'] == 'new_message'):
             for f in self.callback_new_message_reveiced:
                 f(data)
             self.message_signal.emit()
+        elif data['type'] == 'missed_messages':
+            for f in self.callback_missed_messages:
+                f(data)
+            self.message_signal.emit()
         elif (data['type'] == 'key_request'):
             for f in self.callback_new_key_request:
                 f(data)
@@ -79,6 +98,10 @@ class Messenger(QtCore.QObject):
                 f(data)
             self.refresh_conversations.emit()
 
+        if 'mailbox_id' in data:
+            # event is handled, server does not send it again on next connect
+            self.send_event({'type': 'ack', 'mailbox_id': data['mailbox_id']})
+
 
     def on_error(self, *args):
         print('Errors:')
@@ -87,17 +110,52 @@ class Messenger(QtCore.QObject):
     def on_close(self):
         print("### closed ###")
 
-    def subscribe_to_socket(self, address: str, token: str):
+    def on_open(self, *args):
+        self.protocol = self.sub_socket.sock.getsubprotocol()
+
+    def subscribe_to_socket(self, address: str, token: str, resume=None):
+        """
+        connect and keep connecting again until close(). 'resume' returns {conversation_id: last sequence}
+        of messages we have, the server sends what came after them before anything else
+        """
         headers = {'Authorization': 'Token ' + token}
+        self.connect_socket(address, headers, resume)
 
+        self.thread = Thread(target=self.run_socket, args=(address, headers, resume), daemon=True)
+        self.thread.start()
+
+    def connect_socket(self, address, headers, resume):
+        sequences = resume() if resume is not None else None
+        if sequences:
+            address += '?resume=' + quote(json.dumps(sequences))
+        self.protocol = None
         self.sub_socket = websocket.WebSocketApp(address,
                                                  header=headers,
+                                                 subprotocols=wire.offered_protocols(),
+                                                 on_open=self.on_open,
                                                  on_message=self.on_message,
                                                  on_error=self.on_error,
                                                  on_close=self.on_close)
 
-        self.thread = Thread(target=self.sub_socket.run_forever, daemon=True)
-        self.thread.start()
+    def run_socket(self, address, headers, resume):
+        while True:
+            self.sub_socket.run_forever()
+            if self.closing:
+                return
+            time.sleep(self.reconnect_delay)
+            if self.closing:
+                return
+            self.connect_socket(address, headers, resume)
+
+    def close(self):
+        self.closing = True
+        self.sub_socket.close()
+
+    def send_event(self, data):
+        if self.protocol == wire.MSGPACK_PROTOCOL:
+            self.sub_socket.send(wire.encode_msgpack(data), opcode=ABNF.OPCODE_BINARY)
+        else:
+            self.sub_socket.send(wire.encode_json(data))
 
     def publish_message(self, message, conversation_id):
         data = {
@@ -105,7 +163,14 @@ class Messenger(QtCore.QObject):
             'content': message,
             'conversation_id': conversation_id
         }
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
+
+    def send_mark_read(self, conversation_id):
+        data = {
+            'type': 'mark_read',
+            'conversation_id': conversation_id
+        }
+        self.send_event(data)
 
     def send_key_request(self, conversation_id, dh_key):
         data = {
@@ -113,7 +178,7 @@ class Messenger(QtCore.QObject):
             'conversation_id': conversation_id,
             'dh_key': dh_key
         }
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
 
     def send_key_response(self, conversation_id, user_id, dh_key, rsa_key, flag):
         data = {
@@ -124,7 +189,7 @@ class Messenger(QtCore.QObject):
             'rsa_key': rsa_key,
             'flag': flag,
         }
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
 
     def send_friend_request(self, id):
         data = {
@@ -132,7 +197,7 @@ class Messenger(QtCore.QObject):
             'friend_id': id
         }
 
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
 
     def send_f_req_response(self, request_id, response):
         data = {
@@ -141,7 +206,7 @@ class Messenger(QtCore.QObject):
             'response': response,
         }
 
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
 
     def create_group(self, conversation_name, admin, users):
         data = {
@@ -150,4 +215,4 @@ class Messenger(QtCore.QObject):
             'admin_id': admin,
             'users_ids': users,
         }
-        self.sub_socket.send(json.dumps(data))
+        self.send_event(data)
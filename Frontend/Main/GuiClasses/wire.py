@@ -0,0 +1,89 @@
+"""
+Websocket frame codecs of the chat socket, same as chat/wire.py of the backend.
+
+Client picks one with Sec-WebSocket-Protocol when connecting. JSON text frames are used when it asks for
+'justchat.json' or for nothing. 'justchat.msgpack' sends the same events as binary MessagePack frames where
+key material goes as big integers (ext type BIG_INT) and AES ciphertext of messages as raw bytes, instead of
+decimal and base64 strings. Events are dicts of the same shape for both codecs, decoding gives back what
+JSON would.
+"""
+
+import base64
+import json
+
+try:
+    import msgpack
+except ImportError:  # only JSON is offered then
+    msgpack = None
+
+JSON_PROTOCOL = 'justchat.json'
+MSGPACK_PROTOCOL = 'justchat.msgpack'
+
+# msgpack ext type of integers which do not fit in 64 bits, value is big-endian two's complement
+BIG_INT = 1
+# message contents with this prefix are base64 of AES ciphertext, sent as raw bytes
+AES_PREFIX = 'v2:'
+# fields holding integers which JSON events carry as decimal strings
+INT_FIELDS = ('dh_key', 'flag')
+# parts of an RSA key dict ('rsa_key' field) carried the same way, other keys of it are left as they are
+RSA_KEY_FIELDS = ('n', 'e', 'd', 'p', 'q')
+
+
+def encode_json(event):
+    return json.dumps(event)
+
+
+def decode_json(frame):
+    return json.loads(frame)
+
+
+def pack_big_int(value):
+    if not isinstance(value, int):
+        raise TypeError(f'Cannot serialize {type(value).__name__}')
+    length = (value.bit_length() + 8) // 8
+    return msgpack.ExtType(BIG_INT, value.to_bytes(length, 'big', signed=True))
+
+
+def unpack_ext(code, data):
+    if code == BIG_INT:
+        return int.from_bytes(data, 'big', signed=True)
+    return msgpack.ExtType(code, data)
+
+
+def to_int(value):
+    if isinstance(value, str) and value.lstrip('-').isdigit():
+        return int(value)
+    return value
+
+
+def encode_msgpack(event):
+    event = dict(event)
+    for field in INT_FIELDS:
+        if field in event:
+            event[field] = to_int(event[field])
+    if isinstance(event.get('rsa_key'), dict):
+        event['rsa_key'] = {name: to_int(value) if name in RSA_KEY_FIELDS else value
+                            for name, value in event['rsa_key'].items()}
+    content = event.get('content')
+    if isinstance(content, str) and content.startswith(AES_PREFIX):
+        event['content'] = base64.b64decode(content[len(AES_PREFIX):])
+    return msgpack.packb(event, use_bin_type=True, default=pack_big_int)
+
+
+def decode_msgpack(frame):
+    event = msgpack.unpackb(frame, raw=False, ext_hook=unpack_ext)
+    if isinstance(event.get('rsa_key'), dict):
+        # JSON events carry parts of the key as strings, channel layer events must not hold big ints
+        event['rsa_key'] = {name: str(value) if name in RSA_KEY_FIELDS else value
+                            for name, value in event['rsa_key'].items()}
+    content = event.get('content')
+    if isinstance(content, bytes):
+        event['content'] = AES_PREFIX + base64.b64encode(content).decode()
+    return event
+
+
+def offered_protocols():
+    """ protocols sent in Sec-WebSocket-Protocol, preferred first """
+    if msgpack is None:
+        return None
+    return [MSGPACK_PROTOCOL, JSON_PROTOCOL]
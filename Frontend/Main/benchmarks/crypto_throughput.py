@@ -0,0 +1,66 @@
+"""
+Encrypt/decrypt throughput of RSAManager: AES-GCM messages against legacy raw RSA.
+
+Run from Frontend/Main:
+
+    python -m benchmarks.crypto_throughput --bits 512
+"""
+
+import argparse
+import time
+
+import rsa
+
+from GuiClasses.Managers.RSAManager import RSAManager
+
+SIZES = [('100 B', 100), ('4 KB', 4 * 1024), ('64 KB', 64 * 1024)]
+
+
+def measure(function, message, seconds):
+    """ return calls per second of function(message) """
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function(message)
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bits', type=int, default=512, help='RSA key size of the conversation')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent on every measurement')
+    args = parser.parse_args()
+
+    _, key = rsa.newkeys(args.bits)
+    manager = RSAManager({'n': key.n, 'e': key.e, 'd': key.d, 'p': key.p, 'q': key.q})
+
+    print(f'RSA key: {args.bits} bits')
+    print(f'{"size":>6} {"scheme":>7} {"encrypt/s":>11} {"decrypt/s":>11} {"MB/s dec":>9}')
+    for name, size in SIZES:
+        message = 'x' * size
+        encrypted = manager.encrypt(message)
+        assert manager.decrypt(encrypted) == message
+        encrypt = measure(manager.encrypt, message, args.seconds)
+        decrypt = measure(manager.decrypt, encrypted, args.seconds)
+        print(f'{name:>6} {"aes":>7} {encrypt:>11.0f} {decrypt:>11.0f} {decrypt * size / 1e6:>9.1f}')
+
+        try:
+            encrypted = manager.encrypt_legacy(message)
+        except OverflowError:
+            print(f'{name:>6} {"legacy":>7} {"message too long for the key":>33}')
+            continue
+        encrypt = measure(manager.encrypt_legacy, message, args.seconds)
+        decrypt = measure(manager.decrypt, encrypted, args.seconds)
+        print(f'{name:>6} {"legacy":>7} {encrypt:>11.0f} {decrypt:>11.0f} {decrypt * size / 1e6:>9.1f}')
+
+    # longest message raw RSA can hold with this key (PKCS#1 v1.5 padding takes 11 bytes)
+    size = rsa.common.byte_size(key.n) - 11
+    message = 'x' * size
+    encrypt = measure(manager.encrypt_legacy, message, args.seconds)
+    decrypt = measure(manager.decrypt, manager.encrypt_legacy(message), args.seconds)
+    print(f'{str(size) + " B":>6} {"legacy":>7} {encrypt:>11.0f} {decrypt:>11.0f} {decrypt * size / 1e6:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
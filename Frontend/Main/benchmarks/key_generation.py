@@ -0,0 +1,52 @@
+"""
+How long the websocket thread is blocked when a conversation needs a new RSA
+key: rsa.newkeys called in the callback against a key taken from KeyPool,
+for every key size. The pool is given time to fill before each take, like
+between conversations created by a user.
+
+Run from Frontend/Main:
+
+    python -m benchmarks.key_generation --bits 512,1024,2048 --keys 5
+"""
+
+import argparse
+import time
+
+import rsa
+
+from GuiClasses.Managers.KeyPool import KeyPool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bits', default='512,1024,2048')
+    parser.add_argument('--keys', type=int, default=5, help='keys created for every key size')
+    args = parser.parse_args()
+
+    print('milliseconds the callback is blocked per key')
+    print(f'{"bits":>6} {"newkeys avg":>12} {"max":>8} {"pool avg":>10} {"max":>8}')
+    for bits in [int(bits) for bits in args.bits.split(',')]:
+        direct = []
+        for _ in range(args.keys):
+            start = time.perf_counter()
+            rsa.newkeys(bits)
+            direct.append(time.perf_counter() - start)
+
+        pool = KeyPool(bits, size=2)
+        taken = []
+        for _ in range(args.keys):
+            # idle time between two new conversations, enough to top the pool up
+            while not all(future.done() for future in pool.keys):
+                time.sleep(0.01)
+            start = time.perf_counter()
+            future = pool.take()
+            future.result()
+            taken.append(time.perf_counter() - start)
+        pool.close()
+
+        print(f'{bits:>6} {sum(direct) / len(direct) * 1000:>12.1f} {max(direct) * 1000:>8.1f} '
+              f'{sum(taken) / len(taken) * 1000:>10.3f} {max(taken) * 1000:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
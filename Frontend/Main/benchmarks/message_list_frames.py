@@ -0,0 +1,122 @@
+"""
+Frame time of the messages pane for a long conversation.
+
+Compares the model/view list (MessagesView + MessagesModel + MessageDelegate) with the
+previous approach which rebuilt one QWidget per message on every new
+message. Runs without a display:
+
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.message_list_frames --messages 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtWidgets
+
+from GuiClasses.Messages_list import Message, MessagesModel, MessagesView, MessageDelegate
+
+
+def history(count):
+    return [('Ty' if i % 3 == 0 else 'Ala', f'message number {i} ' + 'lorem ipsum ' * (i % 7)) for i in range(count)]
+
+
+def repaint(view):
+    view.viewport().repaint()
+    QtWidgets.QApplication.processEvents()
+
+
+def model_view(messages, frames):
+    view = MessagesView()
+    view.resize(461, 231)
+    view.setItemDelegate(MessageDelegate(view))
+    model = MessagesModel(view)
+    view.setModel(model)
+    view.show()
+
+    start = time.perf_counter()
+    model.set_messages([Message(sender, text, sender == 'Ty') for sender, text in messages])
+    view.scrollToBottom()
+    repaint(view)
+    load = time.perf_counter() - start
+
+    times = []
+    for i in range(frames):
+        start = time.perf_counter()
+        model.append_messages([Message('Ala', f'new message {i}', False)])
+        view.scrollToBottom()
+        repaint(view)
+        times.append(time.perf_counter() - start)
+    return load, times
+
+
+def widget_rebuild(messages, frames):
+    """ what show_messages did before: clear and recreate a widget per message """
+    view = QtWidgets.QListWidget()
+    view.resize(461, 231)
+    view.show()
+
+    def rebuild():
+        view.clear()
+        for sender, text in messages:
+            item = QtWidgets.QListWidgetItem()
+            label = QtWidgets.QLabel(text)
+            label.setWordWrap(True)
+            label.setStyleSheet("max-width: 225px; border-radius: 10px; background: #ffcccc; "
+                                "border: 5px solid #ffcccc; font-size: 11px;")
+            widget = QtWidgets.QWidget()
+            layout = QtWidgets.QVBoxLayout()
+            if sender != 'Ty':
+                layout.addWidget(QtWidgets.QLabel(sender))
+            layout.addWidget(label)
+            layout.addStretch()
+            layout.setSizeConstraint(QtWidgets.QLayout.SetFixedSize)
+            widget.setLayout(layout)
+            item.setSizeHint(widget.sizeHint())
+            view.addItem(item)
+            view.setItemWidget(item, widget)
+        view.scrollToBottom()
+        repaint(view)
+
+    start = time.perf_counter()
+    rebuild()
+    load = time.perf_counter() - start
+
+    times = []
+    for i in range(frames):
+        messages.append(('Ala', f'new message {i}'))
+        start = time.perf_counter()
+        rebuild()
+        times.append(time.perf_counter() - start)
+    return load, times
+
+
+def report(name, load, times):
+    times = sorted(times)
+    print(f'{name:>22} {load * 1000:>10.1f} {times[len(times) // 2] * 1000:>10.2f} {times[-1] * 1000:>10.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--frames', type=int, default=50, help='new messages appended after the load')
+    parser.add_argument('--legacy-frames', type=int, default=3, help='frames measured for the widget rebuild')
+    parser.add_argument('--legacy-messages', type=int, default=1000,
+                        help='messages used for the widget rebuild, it takes minutes at 10000')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    print('times in ms')
+    print(f'{"":>22} {"load":>10} {"median":>10} {"max":>10}')
+    report(f'model/view {args.messages}', *model_view(history(args.messages), args.frames))
+    if args.legacy_frames:
+        report(f'widget rebuild {args.legacy_messages}',
+               *widget_rebuild(history(args.legacy_messages), args.legacy_frames))
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()